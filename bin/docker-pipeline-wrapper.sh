@@ -14,12 +14,5 @@ fi
 PYTHON_BIN="/usr/local/bin/python"
 SITE_PACKAGES=$($PYTHON_BIN -c "import site;print site.getsitepackages()[0]")
 
-ACCESS=$(sudo -u "#$SUDO_UID" "$PYTHON_BIN" "$SITE_PACKAGES/docker-pipeline/check_pipeline_volumes.py" $@)
-if [ $? -ne 0 ]; then
-  echo $ACCESS
-  exit 1
-fi
-
-# Run the docker-pipeline docker image
-
-docker run -i -v /var/run/docker.sock:/var/run/docker.sock -v $1:/pipeline.yaml:ro dukegcb/docker-pipeline /pipeline.yaml ${*:2}
+# Parses the pipeline once, checks its volumes as the invoking user, then runs it in the same process
+exec "$PYTHON_BIN" "$SITE_PACKAGES/docker-pipeline/wrapper.py" "$@"
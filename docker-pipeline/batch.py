@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from pipeline_cache import load_pipeline
+from runner import Runner
+from cache import StepCache
+from endpoints import EndpointPool
+from logs import StepLog
+from utils import extract_var_map, read_sample_sheet
+from multiprocessing.pool import ThreadPool
+from collections import defaultdict
+import argparse
+import os
+import traceback
+
+
+def load_pipelines(yaml_file, samples, var_map, compiled_dir=None):
+    '''
+    Parses the pipeline once for each sample, with the sample's variables replacing !var tags
+    :param yaml_file: path to the pipeline YAML
+    :param samples: list of dicts of variables, one per sample
+    :param var_map: variables shared by all samples. Sample variables take precedence
+    :param compiled_dir: directory of compiled pipelines, see pipeline_cache
+    :return: a list of (sample name, Pipeline) tuples
+    '''
+    pipelines = list()
+    for i, sample in enumerate(samples):
+        sample_var_map = defaultdict(lambda: None, var_map)
+        sample_var_map.update(sample)
+        sample_name = sample.get('SAMPLE') or str(i + 1)
+        pipelines.append((sample_name, load_pipeline(yaml_file, sample_var_map, cache_dir=compiled_dir)))
+    return pipelines
+
+
+def run_sample(runner, sample_name):
+    try:
+        runner.run()
+    except Exception:
+        traceback.print_exc()
+        return {'sample': sample_name, 'code': None, 'error': True}
+    code = runner.result['code'] if runner.result is not None else 0
+    return {'sample': sample_name, 'code': code, 'error': False}
+
+
+def print_summary(summaries):
+    print 'Sample\tStatus'
+    for summary in summaries:
+        if summary['error']:
+            status = 'ERROR'
+        elif summary['code'] == 0:
+            status = 'OK'
+        else:
+            status = 'FAILED (exit code {})'.format(summary['code'])
+        print '{}\t{}'.format(summary['sample'], status)
+    failed = len([summary for summary in summaries if summary['error'] or summary['code'] != 0])
+    print '{} of {} samples succeeded'.format(len(summaries) - failed, len(summaries))
+    return failed
+
+
+def main(yaml_file, sample_sheet, var_map, workers=4, concurrency=None, cache_dir=None, log_dir=None,
+         compiled_dir=None):
+    pipelines = load_pipelines(yaml_file, read_sample_sheet(sample_sheet), var_map, compiled_dir=compiled_dir)
+    if not pipelines:
+        print 'No samples in {}'.format(sample_sheet)
+        return 0
+    cache = None
+    if cache_dir is not None:
+        cache = StepCache(cache_dir)
+    # One set of Docker clients and image pulls serve every sample
+    endpoints = EndpointPool.from_pipeline(pipelines[0][1])
+    runners = list()
+    for sample_name, p in pipelines:
+        if log_dir is not None:
+            p.log_dir = os.path.join(log_dir, StepLog.safe_name(sample_name))
+        runners.append((Runner(p, concurrency=concurrency, cache=cache, endpoints=endpoints),
+                        sample_name))
+    pool = ThreadPool(workers)
+    try:
+        summaries = pool.map(lambda args: run_sample(*args), runners, chunksize=1)
+    finally:
+        pool.close()
+        endpoints.close()
+    return print_summary(summaries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a pipeline once for each row of a sample sheet')
+    parser.add_argument('yaml_file', type=argparse.FileType('r'))
+    parser.add_argument('sample_sheet', type=argparse.FileType('r'),
+                        help='TSV or CSV file. The header row names variables, each row is one sample. '
+                             'A SAMPLE column, if present, names the sample')
+    parser.add_argument('--workers', type=int, default=4, help='Maximum number of samples to run at the same time')
+    parser.add_argument('--concurrency', type=int, help='Maximum number of steps to run at the same time per sample')
+    parser.add_argument('--cache-dir', help='Directory for cached step results. Steps with unchanged inputs are skipped')
+    parser.add_argument('--log-dir', help='Directory to write step output to, in a subdirectory per sample')
+    parser.add_argument('--compiled-dir', help='Directory for parsed pipelines, reused while the YAML and variables '
+                                               'are unchanged')
+    parser.add_argument_group()
+    args, leftovers = parser.parse_known_args()
+    var_map = extract_var_map(leftovers)
+    failed = main(args.yaml_file.name, args.sample_sheet.name, var_map, workers=args.workers,
+                  concurrency=args.concurrency, cache_dir=args.cache_dir, log_dir=args.log_dir,
+                  compiled_dir=args.compiled_dir)
+    exit(1 if failed else 0)
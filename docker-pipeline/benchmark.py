@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from models import Pipeline
+from runner import Runner
+from fake_docker import FakeClient
+from timing import monotonic
+from multiprocessing import Process, Queue
+from tag_handlers import make_loader
+from Queue import Empty
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import yaml
+
+METRICS = ('parse', 'construct', 'run', 'peak_memory_kb', 'startup')
+# What wrapper.py does before the run starts: import, parse the pipeline and check its volumes. Prints whether
+# docker-py was imported on the way
+STARTUP_SCRIPT = '''
+import sys
+import wrapper
+from pipeline_cache import parse_pipeline
+with open(sys.argv[1], 'r') as yaml_file:
+    pipeline = parse_pipeline(yaml_file.read(), {}, safe=True)
+try:
+    pipeline.check_volumes()
+except Exception:
+    pass
+print 'docker' in sys.modules
+'''
+
+
+def generate_pipeline(step_count, infile_count, concurrency=1):
+    '''
+    Generates a synthetic pipeline. Each step reads the previous step's output, plus input files spread over
+    ten directories, and writes one output file.
+    :param step_count: number of steps
+    :param infile_count: number of infiles per step
+    :return: a pipeline dict, as loaded from YAML
+    '''
+    steps = list()
+    for i in range(step_count):
+        infiles = dict(('INPUT_{}'.format(j), '/data/input/dir{}/file{}_{}'.format(j % 10, i, j))
+                       for j in range(infile_count))
+        if i > 0:
+            infiles['INPUT_0'] = '/data/work/step{}.out'.format(i - 1)
+        steps.append({
+            'name': 'Step {}'.format(i),
+            'image': 'bench/image{}'.format(i % 5),
+            'infiles': infiles,
+            'outfiles': {'OUTPUT': '/data/work/step{}.out'.format(i)},
+            'parameters': {'INDEX': str(i)},
+        })
+    return {'name': 'Benchmark {}x{}'.format(step_count, infile_count), 'concurrency': concurrency, 'steps': steps}
+
+
+def measure(step_count, infile_count, concurrency, log_lines, results):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        yaml_path = os.path.join(temp_dir, 'pipeline.yaml')
+        with open(yaml_path, 'w') as yaml_file:
+            yaml.dump(generate_pipeline(step_count, infile_count, concurrency), yaml_file)
+        metrics = dict()
+        start = monotonic()
+        with open(yaml_path, 'r') as yaml_file:
+            pipeline_dict = yaml.load(yaml_file, Loader=make_loader({}))
+        metrics['parse'] = monotonic() - start
+        start = monotonic()
+        pipeline = Pipeline.from_dict(pipeline_dict)
+        metrics['construct'] = monotonic() - start
+        pipeline.log_dir = os.path.join(temp_dir, 'logs')
+        runner = Runner(pipeline, client=FakeClient(log_lines=log_lines))
+        # Runner reports progress on stdout
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            start = monotonic()
+            runner.run()
+            metrics['run'] = monotonic() - start
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        metrics['peak_memory_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results.put(metrics)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def run_case(step_count, infile_count, concurrency, log_lines):
+    # Each case runs in its own process, so peak memory is measured per case
+    results = Queue()
+    process = Process(target=measure, args=(step_count, infile_count, concurrency, log_lines, results))
+    process.start()
+    while True:
+        try:
+            metrics = results.get(timeout=1)
+            break
+        except Empty:
+            if not process.is_alive():
+                raise Exception('ERROR: Benchmark of {} steps with {} infiles failed'.format(step_count, infile_count))
+    process.join()
+    metrics.update({'steps': step_count, 'infiles': infile_count})
+    return metrics
+
+
+def measure_startup(repeats):
+    '''
+    Times the wrapper's path from a new Python process to the start of the run, for a short pipeline
+    :param repeats: number of processes to time
+    :return: a case with the median seconds, and whether docker-py was imported
+    '''
+    temp_dir = tempfile.mkdtemp()
+    try:
+        yaml_path = os.path.join(temp_dir, 'pipeline.yaml')
+        with open(yaml_path, 'w') as yaml_file:
+            yaml.dump(generate_pipeline(3, 2), yaml_file)
+        times = list()
+        for _ in range(repeats):
+            start = monotonic()
+            output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT, yaml_path],
+                                             cwd=os.path.dirname(os.path.abspath(__file__)))
+            times.append(monotonic() - start)
+    finally:
+        shutil.rmtree(temp_dir)
+    return {'case': 'startup', 'startup': sorted(times)[len(times) // 2], 'imports_docker': output.strip() == 'True'}
+
+
+def case_key(case):
+    if 'case' in case:
+        return case['case']
+    return '{}x{}'.format(case['steps'], case['infiles'])
+
+
+def find_regressions(cases, baseline, tolerance):
+    baseline_cases = dict((case_key(case), case) for case in baseline)
+    regressions = list()
+    for case in cases:
+        previous = baseline_cases.get(case_key(case))
+        if previous is None:
+            continue
+        for metric in METRICS:
+            if metric not in case or metric not in previous:
+                continue
+            if case[metric] > previous[metric] * (1 + tolerance):
+                regressions.append('{} {}: {:.4g} (baseline {:.4g})'.format(case_key(case), metric,
+                                                                          case[metric], previous[metric]))
+    return regressions
+
+
+def main(sizes, infile_counts, concurrency=1, log_lines=0, output=None, baseline=None, tolerance=0.2,
+         startup_repeats=5):
+    cases = list()
+    regressions = list()
+    if startup_repeats:
+        startup = measure_startup(startup_repeats)
+        cases.append(startup)
+        print 'startup (s)\t{:.4f}'.format(startup['startup'])
+        if startup['imports_docker']:
+            regressions.append('startup imports docker-py before the run starts')
+    print 'steps\tinfiles\tparse (s)\tconstruct (s)\trun (s)\trun/step (ms)\tpeak memory (KB)'
+    for step_count in sizes:
+        for infile_count in infile_counts:
+            case = run_case(step_count, infile_count, concurrency, log_lines)
+            cases.append(case)
+            print '{}\t{}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.3f}\t{}'.format(
+                step_count, infile_count, case['parse'], case['construct'], case['run'],
+                case['run'] * 1000 / step_count, case['peak_memory_kb'])
+            sys.stdout.flush()
+    if output is not None:
+        with open(output, 'w') as output_file:
+            json.dump(cases, output_file, indent=2)
+    if baseline is not None:
+        with open(baseline, 'r') as baseline_file:
+            regressions += find_regressions(cases, json.load(baseline_file), tolerance)
+    for regression in regressions:
+        print 'REGRESSION: {}'.format(regression)
+    return len(regressions)
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure orchestration overhead on synthetic pipelines, '
+                                                 'using an in-process fake Docker client')
+    parser.add_argument('--sizes', type=int_list, default=[10, 100, 1000, 10000],
+                        help='Comma-separated numbers of steps')
+    parser.add_argument('--infiles', type=int_list, default=[1, 10, 100],
+                        help='Comma-separated numbers of infiles per step')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--log-lines', type=int, default=0, help='Lines of output written by each container')
+    parser.add_argument('--output', help='Write the measurements to this JSON file')
+    parser.add_argument('--baseline', help='JSON file from an earlier --output to compare against')
+    parser.add_argument('--startup-repeats', type=int, default=5,
+                        help='Number of processes to time the startup of the sudo wrapper with, 0 to skip it')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Fraction a metric may exceed its baseline before it is reported as a regression')
+    args = parser.parse_args()
+    regressions = main(args.sizes, args.infiles, concurrency=args.concurrency, log_lines=args.log_lines,
+                       output=args.output, baseline=args.baseline, tolerance=args.tolerance,
+                       startup_repeats=args.startup_repeats)
+    exit(1 if regressions else 0)
@@ -0,0 +1,97 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from fingerprints import Fingerprinter
+import hashlib
+import json
+import os
+import tempfile
+
+
+class StepCache():
+    def __init__(self, path, fingerprinter=None):
+        '''
+        A persistent cache of step results, stored as one JSON file per key in a directory
+        :param path: directory to store cache entries in, created if missing
+        :param fingerprinter: Fingerprinter for infiles and outfiles. By default its index is kept in the cache directory
+        '''
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.fingerprinter = fingerprinter or Fingerprinter(os.path.join(path, 'fingerprints.json'))
+
+    def key(self, step, image_id):
+        '''
+        Computes the cache key for a step
+        :param step: the Step to be run
+        :param image_id: the resolved ID of the step's image
+        :return: a hex digest covering the image, command, environment, binds and input contents
+        '''
+        key_material = {
+            'image_id': image_id,
+            'command': step.command,
+            'environment': step.environment,
+            'binds': step.binds,
+            'infiles': self.fingerprinter.fingerprints(step.infiles.values()),
+        }
+        return hashlib.sha1(json.dumps(key_material, sort_keys=True)).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, '{}.json'.format(key))
+
+    def lookup(self, key, step):
+        '''
+        Finds a cached result for a step. Entries whose outfiles are missing or have changed are ignored.
+        :param key: cache key from key()
+        :param step: the Step to be run
+        :return: the cached result dict, or None
+        '''
+        entry_path = self.entry_path(key)
+        if not os.path.exists(entry_path):
+            return None
+        with open(entry_path, 'r') as entry_file:
+            entry = json.load(entry_file)
+        if self.fingerprinter.fingerprints(step.outfiles.values()) != entry['outfiles']:
+            return None
+        return entry['result']
+
+    def store(self, key, step, result):
+        '''
+        Records a successful step result, along with fingerprints of its outfiles
+        :param key: cache key from key()
+        :param step: the Step that was run
+        :param result: the step's result dict
+        '''
+        if result['code'] != 0:
+            return
+        entry = {
+            'step': step.name,
+            'result': result,
+            'outfiles': self.fingerprinter.fingerprints(step.outfiles.values()),
+        }
+        # Write to a temporary file and rename, so a concurrent lookup never reads a partial entry
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        with os.fdopen(fd, 'w') as entry_file:
+            json.dump(entry, entry_file)
+        os.rename(temp_path, self.entry_path(key))
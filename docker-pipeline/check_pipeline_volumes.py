@@ -24,15 +24,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from models import Pipeline
+from pipeline_cache import load_pipeline
 from utils import extract_var_map
-import tag_handlers
 import argparse
 
 
 def main(yaml_file, var_map):
-    tag_handlers.configure(var_map)
-    p = Pipeline.from_yaml(yaml_file)
+    p = load_pipeline(yaml_file, var_map)
     p.check_volumes()
 
 
@@ -0,0 +1,173 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from docker.client import Client
+from docker.utils import kwargs_from_env
+import os
+import threading
+
+
+def make_client(base_url=None):
+    '''
+    Creates a docker Client
+    :param base_url: URL of the Docker daemon, e.g. unix:///var/run/docker.sock or tcp://host:2375.
+                     If None, the DOCKER_HOST environment variables are used
+    :return: a docker Client
+    '''
+    if base_url is not None:
+        return Client(base_url=base_url, version='auto')
+    # Using boot2docker instructions for now
+    # http://docker-py.readthedocs.org/en/latest/boot2docker/
+    # Workaround for requests.exceptions.SSLError: hostname '192.168.59.103' doesn't match 'boot2docker'
+    return Client(version='auto', **kwargs_from_env(assert_hostname=False))
+
+
+class Endpoint():
+    def __init__(self, url=None, slots=None, mounts=None, client=None):
+        '''
+        A Docker daemon that steps can run on
+        :param url: URL of the Docker daemon, or None to use the DOCKER_HOST environment variables
+        :param slots: maximum number of steps to run on this daemon at the same time, or None for no limit
+        :param mounts: host directories available to this daemon, or None if all paths are available
+        :param client: an existing docker Client for the daemon
+        '''
+        self.url = url
+        self.slots = slots
+        self.mounts = None
+        if mounts is not None:
+            self.mounts = [os.path.normpath(mount) for mount in mounts]
+        self.client = client or make_client(url)
+        self.reaper = None
+        self.running = 0
+
+    def __unicode__(self):
+        return u'<Endpoint: {} - running: {}/{}>'.format(self.url or 'default', self.running, self.slots)
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+    @classmethod
+    def from_dict(cls, host_dict):
+        if isinstance(host_dict, basestring):
+            return cls(url=host_dict)
+        return cls(url=host_dict.get('url'), slots=host_dict.get('slots'), mounts=host_dict.get('mounts'))
+
+    def has_paths(self, paths):
+        if self.mounts is None:
+            return True
+        for path in paths:
+            path = os.path.normpath(path)
+            if not any(path == mount or path.startswith(mount.rstrip('/') + '/') for mount in self.mounts):
+                return False
+        return True
+
+    def is_full(self):
+        return self.slots is not None and self.running >= self.slots
+
+    def load(self):
+        return float(self.running) / self.slots if self.slots else self.running
+
+
+class EndpointPool():
+    def __init__(self, endpoints):
+        if not endpoints:
+            raise ValueError('Must provide at least one Docker host')
+        self.endpoints = endpoints
+        self.condition = threading.Condition()
+
+    def __iter__(self):
+        return iter(self.endpoints)
+
+    @classmethod
+    def from_pipeline(cls, pipeline, client=None):
+        '''
+        Creates the endpoints for a pipeline's hosts. A pipeline without hosts runs on its host,
+        or on the host from the DOCKER_HOST environment variables.
+        :param pipeline: a Pipeline
+        :param client: an existing docker Client, used when the pipeline has no hosts
+        :return: an EndpointPool
+        '''
+        if pipeline.hosts:
+            return cls([Endpoint.from_dict(host) for host in pipeline.hosts])
+        return cls([Endpoint(url=pipeline.host, client=client)])
+
+    def eligible(self, step):
+        # Steps run where all the directories they bind are available
+        paths = step.binds.keys()
+        endpoints = [endpoint for endpoint in self.endpoints if endpoint.has_paths(paths)]
+        if not endpoints:
+            raise Exception('ERROR: No Docker host has access to all paths of step {}'.format(step.name))
+        return endpoints
+
+    def has_free_slot(self, step):
+        with self.condition:
+            return any(not endpoint.is_full() for endpoint in self.eligible(step))
+
+    def acquire(self, step, url=None):
+        '''
+        Chooses the least loaded endpoint for a step, waiting until one has a free slot
+        :param step: the Step to run
+        :param url: prefer the endpoint with this URL, if it is eligible
+        :return: an Endpoint, which must be passed to release() when the step finishes
+        '''
+        endpoints = self.eligible(step)
+        preferred = [endpoint for endpoint in endpoints if endpoint.url == url]
+        if url is not None and preferred:
+            endpoints = preferred
+        with self.condition:
+            while True:
+                available = [endpoint for endpoint in endpoints if not endpoint.is_full()]
+                if available:
+                    endpoint = min(available, key=lambda e: e.load())
+                    endpoint.running += 1
+                    return endpoint
+                self.condition.wait()
+
+    def try_acquire(self, step, avoid=None):
+        '''
+        Chooses the least loaded endpoint for a step with a free slot, without waiting
+        :param step: the Step to run
+        :param avoid: an Endpoint to use only if no other has a free slot
+        :return: an Endpoint, which must be passed to release(), or None if every eligible endpoint is full
+        '''
+        with self.condition:
+            available = [endpoint for endpoint in self.eligible(step) if not endpoint.is_full()]
+            available = [endpoint for endpoint in available if endpoint is not avoid] or available
+            if not available:
+                return None
+            endpoint = min(available, key=lambda e: e.load())
+            endpoint.running += 1
+            return endpoint
+
+    def release(self, endpoint):
+        with self.condition:
+            endpoint.running -= 1
+            self.condition.notify_all()
+
+    def close(self):
+        for endpoint in self.endpoints:
+            if endpoint.reaper is not None:
+                # Containers still being removed are finished before the run exits
+                endpoint.reaper.close()
+                endpoint.reaper = None
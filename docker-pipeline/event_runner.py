@@ -0,0 +1,313 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from runner import Runner
+from scheduler import Scheduler
+import select
+import socket
+import struct
+import sys
+import time
+from urlparse import urlparse
+
+# Seconds to wait for output before checking again for steps that are waiting on an image pull
+POLL_SECONDS = 0.1
+READ_SIZE = 64 * 1024
+# Each frame of an attached container's output starts with the stream type and payload size
+FRAME_HEADER = struct.Struct('>BxxxL')
+STREAM_NAMES = {1: 'stdout', 2: 'stderr'}
+
+
+class AttachStream():
+    def __init__(self, client, container, step, attempt=1):
+        '''
+        Attaches to a running container's output over a raw connection to the Docker host, so that the output of
+        many containers can be read from one thread
+        :param client: docker Client for the host the container runs on
+        :param container: the container, as returned by create_container
+        :param step: the Step running in the container
+        :param attempt: the number of times the step has been started, starting at 1
+        '''
+        self.client = client
+        self.container = container
+        self.step = step
+        self.attempt = attempt
+        # The container is killed once this time passes
+        self.deadline = time.time() + step.timeout if step.timeout is not None else None
+        # Time to start the step again, if it failed and is retried
+        self.retry_at = None
+        self.endpoint = None
+        self.step_log = None
+        self.cache_key = None
+        self.logs_started = None
+        self.sampler = None
+        self.headers_read = False
+        self.buffer = bytearray()
+        container_id = container.get('Id') if isinstance(container, dict) else container
+        self.sock = AttachStream.connect(client.base_url)
+        self.sock.sendall('POST /v{}/containers/{}/attach?logs=1&stream=1&stdout=1&stderr=1 HTTP/1.1\r\n'
+                          'Host: docker\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+                          .format(client.api_version, container_id))
+        self.sock.setblocking(0)
+
+    @classmethod
+    def connect(cls, base_url):
+        if base_url.startswith('http+unix://'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect('/' + base_url[len('http+unix://'):].lstrip('/'))
+            return sock
+        url = urlparse(base_url)
+        if url.scheme != 'http':
+            raise Exception('ERROR: The event loop runner does not support Docker host {}'.format(base_url))
+        return socket.create_connection((url.hostname, url.port or 80))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read(self):
+        '''
+        Reads the output available without blocking
+        :return: list of (stream name, chunk) tuples, or None once the container's output has ended
+        '''
+        data = self.sock.recv(READ_SIZE)
+        if not data:
+            return None
+        self.buffer.extend(data)
+        if not self.headers_read:
+            end = self.buffer.find('\r\n\r\n')
+            if end < 0:
+                return []
+            status_line = str(self.buffer[:self.buffer.find('\r\n')])
+            if status_line.split(' ')[1] != '200':
+                raise Exception('ERROR: Could not attach to container for step {}: {}'.format(self.step.name,
+                                                                                           status_line))
+            del self.buffer[:end + 4]
+            self.headers_read = True
+        chunks = list()
+        while len(self.buffer) >= FRAME_HEADER.size:
+            stream_type, size = FRAME_HEADER.unpack_from(buffer(self.buffer))
+            if len(self.buffer) < FRAME_HEADER.size + size:
+                break
+            chunks.append((STREAM_NAMES.get(stream_type, 'stdout'),
+                           str(self.buffer[FRAME_HEADER.size:FRAME_HEADER.size + size])))
+            del self.buffer[:FRAME_HEADER.size + size]
+        return chunks
+
+    def close(self):
+        self.sock.close()
+
+
+class EventLoopScheduler(Scheduler):
+    def __init__(self, graph, runner, max_concurrency=1, capacity=None, priorities=None):
+        '''
+        Runs the steps of a StepGraph from a single thread, waiting on the output of all running containers at once
+        :param graph: a StepGraph
+        :param runner: the EventLoopRunner that starts and finishes steps
+        :param max_concurrency: maximum number of steps to run at the same time
+        :param capacity: dict of total 'cpus' and 'memory' (bytes) that running steps may declare
+        :param priorities: dict of step index to priority. Ready steps with higher priority start first
+        '''
+        Scheduler.__init__(self, graph, None, max_concurrency=max_concurrency, capacity=capacity,
+                           priorities=priorities)
+        self.runner = runner
+        self.streams = dict()
+        # (AttachStream, index) of failed steps waiting to be retried. They still count as running.
+        self.retrying = list()
+        self.deferred = False
+
+    def run(self):
+        self.start_run()
+        while True:
+            self.deferred = False
+            self.start_retries()
+            self.start_ready(self.start_step)
+            if self.running == 0 and not self.deferred:
+                break
+            readable, _, _ = select.select(self.streams.keys(), [], [], POLL_SECONDS)
+            for stream in readable:
+                self.read(stream)
+            self.runner.check_deadlines(self.streams)
+        return self.finish_run()
+
+    def start_retries(self):
+        now = time.time()
+        for stream, i in list(self.retrying):
+            if stream.retry_at > now or not self.runner.can_start(stream.step):
+                continue
+            self.retrying.remove((stream, i))
+            self.start_step(i, stream.attempt + 1)
+
+    def admit(self, i):
+        if not Scheduler.admit(self, i):
+            return False
+        # Steps whose host is busy or whose image is still being pulled are checked again on the next pass
+        if not self.runner.can_start(self.graph.steps[i]):
+            self.deferred = True
+            return False
+        return True
+
+    def start_step(self, i, attempt=1):
+        try:
+            started = self.runner.launch_step(self.graph.steps[i], attempt)
+        except Exception:
+            self.complete(i, None, sys.exc_info())
+            return
+        if isinstance(started, AttachStream):
+            self.streams[started] = i
+        else:
+            # Cached steps are finished without running a container
+            self.complete(i, started)
+
+    def read(self, stream):
+        i = self.streams[stream]
+        try:
+            chunks = stream.read()
+            if chunks is not None:
+                for name, chunk in chunks:
+                    self.runner.write_chunk(stream, name, chunk)
+                return
+            del self.streams[stream]
+            result = self.runner.collect_step(stream)
+        except Exception:
+            self.streams.pop(stream, None)
+            self.runner.abandon_step(stream)
+            self.complete(i, None, sys.exc_info())
+            return
+        if stream.retry_at is not None:
+            self.retrying.append((stream, i))
+            return
+        self.complete(i, result)
+
+
+class EventLoopRunner(Runner):
+    '''
+    Runs steps from a single thread, instead of a thread per running step, for pipelines with many short steps.
+    Timeouts and retries apply as with Runner, but stragglers are not run again speculatively. Sampling resource
+    usage adds a thread per running container, as the Docker stats API only streams.
+    '''
+
+    def make_scheduler(self, graph):
+        return EventLoopScheduler(graph, self, max_concurrency=self.concurrency, capacity=self.pipeline.capacity,
+                                  priorities=self.priorities(graph))
+
+    def can_start(self, step):
+        if not self.endpoints.has_free_slot(step):
+            return False
+        if self.pipeline.pull_images:
+            return all(self.get_prefetcher(endpoint).is_ready(step.image)
+                       for endpoint in self.endpoints.eligible(step))
+        return True
+
+    def launch_step(self, step, attempt=1):
+        '''
+        Creates and starts the container for a step, and attaches to its output
+        :param step: the Step to run
+        :param attempt: the number of times the step has been started, starting at 1
+        :return: an AttachStream for the container, or the cached result if the step was skipped
+        '''
+        result, previous = None, None
+        if attempt == 1:
+            result, previous = self.check_journal(step)
+        if result is not None:
+            return self.finish_step(step, result)
+        with self.span('acquire_host', step):
+            endpoint = self.endpoints.acquire(step, url=previous[0] if previous else None)
+        try:
+            if self.pipeline.debug:
+                print 'Running step {} on {}'.format(step, endpoint)
+            container = self.reattach(step, endpoint, previous)
+            cache_key = None
+            if container is None:
+                result, cache_key = self.check_cache(step, endpoint)
+                if result is not None:
+                    self.endpoints.release(endpoint)
+                    return self.finish_step(step, result)
+                container = self.launch_container(step, endpoint)
+            stream = AttachStream(endpoint.client, container, step, attempt)
+        except Exception:
+            self.endpoints.release(endpoint)
+            raise
+        stream.endpoint = endpoint
+        stream.cache_key = cache_key
+        stream.step_log = self.open_log(step)
+        stream.logs_started = self.tracer.now()
+        stream.sampler = self.start_sampler(container, endpoint.client)
+        print 'step: {}\nimage: {}\n==============='.format(step.name, step.image)
+        return stream
+
+    def write_chunk(self, stream, name, chunk):
+        if name == 'stderr' and not self.pipeline.separate_stderr:
+            name = 'stdout'
+        self.write_log(chunk, stream.step_log, name)
+
+    def check_deadlines(self, streams):
+        now = time.time()
+        for stream in streams:
+            if stream.deadline is not None and now > stream.deadline:
+                # Its output ends once the container is killed, and the step is collected as usual
+                stream.deadline = None
+                self.expire(stream.container, stream.step, stream.client)
+
+    def collect_step(self, stream):
+        '''
+        Finishes a step whose output has ended
+        :param stream: the step's AttachStream
+        :return: the step's result dict. If the step is retried, its retry_at is set instead.
+        '''
+        step = stream.step
+        client = stream.client
+        self.tracer.record('logs', stream.logs_started, self.tracer.now(), step.name, self.step_number(step))
+        try:
+            stream.close()
+            stream.step_log.close()
+            # The container has exited, so this returns without blocking
+            with self.span('wait', step):
+                code = client.wait(stream.container)
+            result = self.make_result(step, code, stream.step_log, stream.container)
+            if stream.sampler is not None:
+                result['usage'] = stream.sampler.stop()
+            with self.span('finish_container', step):
+                self.finish_container(stream.container, step, stream.endpoint)
+        finally:
+            self.endpoints.release(stream.endpoint)
+            stream.endpoint = None
+        result = self.record_result(step, result, stream.cache_key)
+        delay = self.retry_delay(step, result, stream.attempt)
+        if delay is not None:
+            stream.retry_at = time.time() + delay
+            return result
+        if stream.attempt > 1:
+            result['attempts'] = stream.attempt
+        return self.finish_step(step, result)
+
+    def abandon_step(self, stream):
+        stream.close()
+        if stream.sampler is not None:
+            stream.sampler.stop()
+        if stream.step_log is not None:
+            stream.step_log.close()
+        if stream.endpoint is not None:
+            self.endpoints.release(stream.endpoint)
+            stream.endpoint = None
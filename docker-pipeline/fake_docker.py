@@ -0,0 +1,198 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from collections import defaultdict
+from docker.errors import APIError
+import itertools
+import requests
+import threading
+import time
+
+DEFAULT_LATENCIES = {
+    'pull': 0,
+    'inspect_image': 0,
+    'create_container': 0,
+    'start': 0,
+    'attach': 0,
+    'wait': 0,
+    'kill': 0,
+    'stats': 0,
+    'containers': 0,
+    'remove_container': 0,
+}
+# Seconds between stats samples. Docker sends one each second, which is too slow for tests
+STATS_SECONDS = 0.01
+
+
+def not_found(message):
+    response = requests.Response()
+    response.status_code = 404
+    response.reason = 'Not Found'
+    response._content = message
+    return APIError(message, response)
+
+
+class FakeClient():
+    def __init__(self, latencies=None, run_time=0, log_lines=0, line_size=80, exit_codes=None, images=None,
+                 run_times=None, memory_usage=0):
+        '''
+        An in-process stand-in for the parts of docker.client.Client used by Runner
+        :param latencies: dict of method name to seconds each call takes, see DEFAULT_LATENCIES
+        :param run_time: seconds each container runs, from start until wait returns
+        :param log_lines: number of lines of output each container writes
+        :param line_size: length of each line of output, in bytes
+        :param exit_codes: dict of image name to the exit code of its containers, default 0. A list gives the exit
+                           codes of the image's containers in the order they are created, then 0
+        :param run_times: dict of image name to a list of run times of its containers in the order they are created,
+                          then run_time
+        :param memory_usage: bytes of memory each container reports using. Each container uses one cpu.
+        :param images: names of images already on the host. If None, every image is present
+        '''
+        self.latencies = dict(DEFAULT_LATENCIES)
+        self.latencies.update(latencies or {})
+        self.run_time = run_time
+        self.log_lines = log_lines
+        self.line_size = line_size
+        self.exit_codes = exit_codes or {}
+        self.run_times = run_times or {}
+        self.memory_usage = memory_usage
+        self.images = None if images is None else set(images)
+        # Containers that have been created and not removed, by ID
+        self.existing = dict()
+        self.calls = defaultdict(int)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def call(self, method):
+        with self.lock:
+            self.calls[method] += 1
+        if self.latencies.get(method):
+            time.sleep(self.latencies[method])
+
+    def container(self, container):
+        if isinstance(container, dict):
+            container = container.get('Id')
+        if container not in self.existing:
+            raise not_found('No such container: {}'.format(container))
+        return self.existing[container]
+
+    def pull(self, repository, tag=None, stream=False, insecure_registry=False):
+        self.call('pull')
+        if self.images is not None:
+            with self.lock:
+                self.images.add(repository)
+        return '{{"status":"Downloaded newer image for {}"}}'.format(repository)
+
+    def inspect_image(self, image_id):
+        self.call('inspect_image')
+        if self.images is not None and image_id not in self.images:
+            raise not_found('No such image: {}'.format(image_id))
+        return {'Id': 'sha-{}'.format(image_id)}
+
+    def create_container(self, image, command=None, environment=None, volumes=None, name=None, **kwargs):
+        self.call('create_container')
+        if self.images is not None and image not in self.images:
+            raise not_found('No such image: {}'.format(image))
+        container_id = 'fake{}'.format(next(self.ids))
+        with self.lock:
+            self.existing[container_id] = {'Id': container_id, 'name': name or container_id, 'image': image,
+                                             'command': command, 'environment': environment, 'volumes': volumes,
+                                             'config': kwargs, 'started': None,
+                                             'run_time': self.next_value(self.run_times, image, self.run_time),
+                                             'exit_code': self.next_value(self.exit_codes, image, 0),
+                                             'killed': threading.Event()}
+        return {'Id': container_id, 'Warnings': None}
+
+    @classmethod
+    def next_value(cls, values, image, default):
+        value = values.get(image, default)
+        if not isinstance(value, list):
+            return value
+        return value.pop(0) if value else default
+
+    def start(self, container, binds=None, **kwargs):
+        self.call('start')
+        container = self.container(container)
+        container['binds'] = binds
+        container['started'] = time.time()
+
+    def inspect_container(self, container):
+        self.call('inspect_container')
+        container = self.container(container)
+        return {'Id': container['Id'], 'State': {'Running': container['started'] is not None}}
+
+    def attach(self, container, stdout=True, stderr=True, stream=False, logs=False):
+        self.call('attach')
+        self.container(container)
+        line = 'x' * (self.line_size - 1) + '\n'
+        # Without a separate stream, all output is on stdout
+        count = self.log_lines if stdout else 0
+        if stream:
+            return (line for i in xrange(count))
+        return line * count
+
+    def wait(self, container, timeout=None):
+        self.call('wait')
+        container = self.container(container)
+        remaining = container['started'] + container['run_time'] - time.time()
+        if remaining > 0:
+            container['killed'].wait(remaining)
+        if container['killed'].is_set():
+            # As if killed by SIGKILL
+            return 137
+        return container['exit_code']
+
+    def kill(self, container, signal=None):
+        self.call('kill')
+        self.container(container)['killed'].set()
+
+    def stats(self, container, decode=None):
+        self.call('stats')
+        container = self.container(container)
+        while True:
+            elapsed = time.time() - container['started']
+            yield {'memory_stats': {'usage': self.memory_usage},
+                   'cpu_stats': {'cpu_usage': {'total_usage': int(min(elapsed, container['run_time']) * 1e9)}},
+                   'blkio_stats': {'io_service_bytes_recursive': [{'op': 'Read', 'value': 4096},
+                                                                  {'op': 'Write', 'value': 8192}]},
+                   'network': {'rx_bytes': 100, 'tx_bytes': 200}}
+            if elapsed >= container['run_time'] or container['killed'].is_set():
+                return
+            container['killed'].wait(STATS_SECONDS)
+
+    def containers(self, all=False):
+        self.call('containers')
+        with self.lock:
+            containers = self.existing.values()
+        now = time.time()
+        return [{'Id': container['Id'], 'Names': ['/' + container['name']],
+                 'Status': 'Up' if (container['started'] and now < container['started'] + container['run_time'] and
+                                    not container['killed'].is_set()) else 'Exited'}
+                for container in containers]
+
+    def remove_container(self, container, v=False, link=False, force=False):
+        self.call('remove_container')
+        container = self.container(container)
+        with self.lock:
+            del self.existing[container['Id']]
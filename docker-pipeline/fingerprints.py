@@ -0,0 +1,206 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from multiprocessing.pool import ThreadPool
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DEFAULT_INDEX = '~/.docker-pipeline/fingerprints.json'
+INDEX_FORMAT = 1
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+# Files modified this recently may change again within the same mtime, so their stat is not trusted later
+RACY_SECONDS = 2
+
+
+def content_hash(path):
+    '''
+    Hashes a file's contents with a fast non-cryptographic hash, reading it through a memory map
+    :param path: path to a file
+    :return: a string naming the hash function, the file size and the digest
+    '''
+    size = os.path.getsize(path)
+    if xxhash is not None:
+        name, digest = 'xxh64', xxhash.xxh64()
+    else:
+        name, digest = 'crc32', None
+    crc = 0
+    with open(path, 'rb') as f:
+        # Empty files cannot be mapped
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else ''
+        try:
+            for offset in xrange(0, size, HASH_CHUNK_SIZE):
+                chunk = buffer(mapped, offset, HASH_CHUNK_SIZE)
+                if digest is not None:
+                    digest.update(chunk)
+                else:
+                    crc = zlib.crc32(chunk, crc)
+        finally:
+            if size:
+                mapped.close()
+    value = digest.hexdigest() if digest is not None else '{:08x}'.format(crc & 0xffffffff)
+    return '{}:{}:{}'.format(name, size, value)
+
+
+class Fingerprinter():
+    def __init__(self, index_path=DEFAULT_INDEX, workers=8):
+        '''
+        Fingerprints files and directories by content. Files whose size, mtime and inode match the persistent
+        index are not read again; the rest are hashed in parallel.
+        :param index_path: path of the index of file stats and fingerprints, created if missing
+        :param workers: number of files to hash at the same time
+        '''
+        self.index_path = os.path.expanduser(index_path)
+        self.workers = workers
+        self.pool = None
+        self.lock = threading.Lock()
+        self.index = Fingerprinter.load_index(self.index_path)
+        self.changed = False
+
+    @classmethod
+    def load_index(cls, path):
+        if not os.path.exists(path):
+            return dict()
+        try:
+            with open(path, 'r') as index_file:
+                index = json.load(index_file)
+        except ValueError:
+            return dict()
+        if index.get('format') != INDEX_FORMAT:
+            return dict()
+        return index['files']
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            files = dict(self.index)
+            self.changed = False
+        dirname = os.path.dirname(self.index_path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=dirname)
+        with os.fdopen(fd, 'w') as index_file:
+            json.dump({'format': INDEX_FORMAT, 'files': files}, index_file)
+        os.rename(temp_path, self.index_path)
+
+    def file_fingerprint(self, path):
+        '''
+        Fingerprints a file, using the index when its stat is unchanged
+        :param path: absolute path to a file
+        :return: fingerprint string, or None if the file does not exist
+        '''
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stat_key = [st.st_size, st.st_mtime, st.st_ino]
+        with self.lock:
+            entry = self.index.get(path)
+        if entry is not None and entry['stat'] == stat_key and entry['hashed'] - st.st_mtime > RACY_SECONDS:
+            return entry['fingerprint']
+        hashed = time.time()
+        fingerprint = content_hash(path)
+        with self.lock:
+            self.index[path] = {'stat': stat_key, 'hashed': hashed, 'fingerprint': fingerprint}
+            self.changed = True
+        return fingerprint
+
+    def fingerprints(self, paths):
+        '''
+        Fingerprints files and directories. A directory's fingerprint covers the names and contents of all files in it.
+        :param paths: paths to files or directories
+        :return: dict of path to fingerprint, or None for paths that do not exist
+        '''
+        paths = [os.path.abspath(path) for path in paths]
+        directories = dict()
+        files = set()
+        for path in paths:
+            if os.path.isdir(path):
+                directories[path] = Fingerprinter.walk(path)
+                files.update(directories[path])
+            else:
+                files.add(path)
+        files = sorted(files)
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+            pool = self.pool
+        file_fingerprints = dict(zip(files, pool.map(self.file_fingerprint, files)))
+        self.save()
+        result = dict()
+        for path in paths:
+            if path in directories:
+                digest = hashlib.sha1()
+                for file_path in directories[path]:
+                    digest.update(os.path.relpath(file_path, path))
+                    digest.update(file_fingerprints[file_path] or '')
+                result[path] = 'dir:{}'.format(digest.hexdigest())
+            else:
+                result[path] = file_fingerprints[path]
+        return result
+
+    @classmethod
+    def walk(cls, path):
+        files = list()
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            files.extend(os.path.join(dirpath, filename) for filename in sorted(filenames))
+        return files
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+
+def write_manifest(path, pipeline, inputs, outputs, results):
+    '''
+    Records the fingerprints of a run's inputs and outputs
+    :param path: path of the manifest file
+    :param pipeline: the Pipeline that ran
+    :param inputs: dict of input path to fingerprint, taken before the run
+    :param outputs: dict of output path to fingerprint, taken after the run
+    :param results: list of step results in pipeline order, None for steps that did not run
+    '''
+    manifest = {
+        'pipeline': pipeline.name,
+        'inputs': inputs,
+        'outputs': outputs,
+        'steps': [{'name': step.name, 'code': result['code'] if result else None}
+                  for step, result in zip(pipeline.steps, results)],
+    }
+    with open(path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
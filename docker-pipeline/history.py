@@ -0,0 +1,149 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from scheduler import Scheduler, StepGraph
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+DEFAULT_HISTORY = '~/.docker-pipeline/history.json'
+# Phases of a step's own work, leaving out waiting for a host and pulling its image
+RUN_PHASES = ('cache_lookup', 'create_container', 'start_container', 'logs', 'wait', 'finish_container')
+# Number of past durations kept for each step
+MAX_SAMPLES = 10
+
+
+class StepHistory():
+    def __init__(self, path=DEFAULT_HISTORY):
+        '''
+        Durations of past runs of steps, keyed by image and command, used to estimate how long steps take
+        :param path: path of the history file, created if missing
+        '''
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+        self.durations = StepHistory.load(self.path)
+        self.changed = False
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return dict()
+        try:
+            with open(path, 'r') as history_file:
+                return json.load(history_file)
+        except ValueError:
+            return dict()
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            durations = dict(self.durations)
+            self.changed = False
+        dirname = os.path.dirname(self.path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=dirname)
+        with os.fdopen(fd, 'w') as history_file:
+            json.dump(durations, history_file)
+        os.rename(temp_path, self.path)
+
+    @classmethod
+    def key(cls, step):
+        return hashlib.sha1(json.dumps([step.image, step.command])).hexdigest()
+
+    @classmethod
+    def duration(cls, timings):
+        return sum(timings.get(phase, 0) for phase in RUN_PHASES)
+
+    def record(self, step, result):
+        '''
+        Records how long a step took, if it ran and succeeded
+        :param step: the Step
+        :param result: the step's result dict, with its timings
+        '''
+        if result['code'] != 0 or result.get('cached') or result.get('resumed') or 'timings' not in result:
+            return
+        key = StepHistory.key(step)
+        with self.lock:
+            samples = self.durations.get(key, []) + [StepHistory.duration(result['timings'])]
+            self.durations[key] = samples[-MAX_SAMPLES:]
+            self.changed = True
+
+    def estimate(self, step):
+        '''
+        :param step: a Step
+        :return: the average of the step's recorded durations in seconds, or None if it has never run
+        '''
+        with self.lock:
+            samples = self.durations.get(StepHistory.key(step))
+        if not samples:
+            return None
+        return float(sum(samples)) / len(samples)
+
+    def estimates(self, steps):
+        '''
+        Estimates every step's duration. Steps without history are assumed to take the average of the others.
+        :param steps: list of Steps
+        :return: tuple of dict of step index to seconds, and set of indices of the steps without history
+        '''
+        durations = dict((i, self.estimate(step)) for i, step in enumerate(steps))
+        unknown = set(i for i, duration in durations.iteritems() if duration is None)
+        known = [duration for duration in durations.itervalues() if duration is not None]
+        default = float(sum(known)) / len(known) if known else 0
+        durations.update((i, default) for i in unknown)
+        return durations, unknown
+
+    def priorities(self, graph):
+        # Steps with the longest path to the end of the pipeline start first
+        return graph.remaining(self.estimates(graph.steps)[0])
+
+
+def print_plan(pipeline, history, concurrency=None):
+    '''
+    Prints the predicted run time and critical path of a pipeline, without running it
+    :param pipeline: a Pipeline
+    :param history: StepHistory with the durations of earlier runs
+    :param concurrency: maximum number of steps to run at the same time, defaults to the pipeline's
+    :return: the predicted run time in seconds
+    '''
+    graph = StepGraph(pipeline.steps)
+    durations, unknown = history.estimates(pipeline.steps)
+    scheduler = Scheduler(graph, None, max_concurrency=concurrency or pipeline.concurrency,
+                          capacity=pipeline.capacity, priorities=graph.remaining(durations))
+    times = scheduler.simulate(durations)
+    makespan = max([end for start, end in times.itervalues()] or [0])
+    critical_path = graph.critical_path(durations)
+    print 'Start\tEnd\tStep'
+    for i in sorted(times, key=lambda i: (times[i][0], i)):
+        estimated = ' (no history)' if i in unknown else ''
+        print '{:.1f}\t{:.1f}\t{}{}'.format(times[i][0], times[i][1], pipeline.steps[i].name, estimated)
+    print 'Predicted run time: {:.1f}s'.format(makespan)
+    print 'Critical path: {}'.format(' -> '.join(pipeline.steps[i].name for i in critical_path))
+    if unknown:
+        print '{} of {} steps have no history, and are estimated at the average'.format(len(unknown), len(durations))
+    return makespan
@@ -0,0 +1,155 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from docker.errors import APIError
+from multiprocessing.pool import ThreadPool
+import json
+import os
+import tempfile
+import threading
+import time
+
+PULL_POLICIES = ('always', 'if-missing', 'ttl')
+DEFAULT_DIGEST_CACHE = os.path.join('~', '.docker-pipeline', 'images.json')
+
+
+class ImagePrefetcher():
+    def __init__(self, client, policy='always', ttl=None, digest_cache=DEFAULT_DIGEST_CACHE, workers=4, debug=False):
+        '''
+        Pulls the images of a pipeline in the background, each unique image once
+        :param client: a docker Client
+        :param policy: 'always' pulls every image, 'if-missing' pulls images not on the Docker host,
+                       'ttl' pulls images not pulled by this host within the last ttl seconds
+        :param ttl: seconds a pulled image is considered current, used by the 'ttl' policy
+        :param digest_cache: path to a JSON file recording the IDs and times of pulled images
+        :param workers: number of images to pull at the same time
+        '''
+        if policy not in PULL_POLICIES:
+            raise ValueError('Unknown pull policy: {}. Must be one of {}'.format(policy, ', '.join(PULL_POLICIES)))
+        if policy == 'ttl' and ttl is None:
+            raise ValueError('The ttl pull policy requires a ttl')
+        self.client = client
+        self.policy = policy
+        self.ttl = ttl
+        self.digest_cache = os.path.expanduser(digest_cache)
+        self.workers = workers
+        self.debug = debug
+        self.pool = None
+        self.pending = dict()
+        self.lock = threading.Lock()
+        self.digests = ImagePrefetcher.load_digests(self.digest_cache)
+
+    @classmethod
+    def load_digests(cls, path):
+        if not os.path.exists(path):
+            return dict()
+        with open(path, 'r') as digest_file:
+            return json.load(digest_file)
+
+    def save_digests(self):
+        dirname = os.path.dirname(self.digest_cache)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=dirname)
+        with os.fdopen(fd, 'w') as digest_file:
+            json.dump(self.digests, digest_file)
+        os.rename(temp_path, self.digest_cache)
+
+    def start(self, images):
+        '''
+        Starts pulling images in the background. Returns immediately
+        :param images: image names, in the order they are first needed. Duplicates are pulled once
+        '''
+        # Steps running in parallel ask for their images at the same time
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+            for image in images:
+                if image not in self.pending:
+                    self.pending[image] = self.pool.apply_async(self.fetch, (image,))
+
+    def fetching(self, image):
+        self.start([image])
+        with self.lock:
+            return self.pending[image]
+
+    def wait(self, image):
+        '''
+        Blocks until an image has been fetched, starting the pull if it was not prefetched
+        :param image: image name
+        :return: the image ID on the Docker host, or None if it could not be determined
+        '''
+        return self.fetching(image).get()
+
+    def is_ready(self, image):
+        '''
+        Checks without blocking whether an image has been fetched, starting the pull if it was not prefetched
+        :param image: image name
+        :return: True if wait() would return without blocking
+        '''
+        return self.fetching(image).ready()
+
+    def close(self):
+        # Pulls still in progress are not waited for, e.g. images for steps skipped after a failure
+        with self.lock:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+
+    def local_image_id(self, image):
+        try:
+            return self.client.inspect_image(image)['Id']
+        except APIError:
+            return None
+
+    def is_current(self, image):
+        if self.policy == 'always':
+            return None
+        image_id = self.local_image_id(image)
+        if image_id is None:
+            return None
+        if self.policy == 'ttl':
+            with self.lock:
+                digest = self.digests.get(image)
+            if digest is None or digest['id'] != image_id or time.time() - digest['pulled_at'] > self.ttl:
+                return None
+        return image_id
+
+    def fetch(self, image):
+        image_id = self.is_current(image)
+        if image_id is not None:
+            if self.debug:
+                print 'Image {} is current, not pulling'.format(image)
+            return image_id
+        if self.debug:
+            print 'Pulling image: {}'.format(image)
+        image_result = self.client.pull(image)
+        if self.debug:
+            print image_result
+        image_id = self.local_image_id(image)
+        if image_id is not None and self.policy == 'ttl':
+            with self.lock:
+                self.digests[image] = {'id': image_id, 'pulled_at': time.time()}
+                self.save_digests()
+        return image_id
@@ -0,0 +1,136 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import hashlib
+import json
+import os
+import threading
+
+
+class RunJournal():
+    def __init__(self, path, resume=False):
+        '''
+        An append-only record of each step's containers and results, so an interrupted run can be resumed
+        :param path: path of the journal file
+        :param resume: if True, load the steps recorded by an earlier run and keep appending to its journal.
+                       Otherwise any existing journal is replaced.
+        '''
+        self.path = path
+        self.lock = threading.Lock()
+        self.steps = dict()
+        if resume:
+            self.steps = RunJournal.load(path)
+            RunJournal.truncate(path)
+        self.journal_file = open(path, 'a' if resume else 'w')
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Replays a journal
+        :param path: path of the journal file
+        :return: dict of step number to the last record written for that step
+        '''
+        steps = dict()
+        if not os.path.exists(path):
+            return steps
+        with open(path, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line is incomplete if the process died while writing it
+                    continue
+                steps[record['step']] = record
+        return steps
+
+    @classmethod
+    def truncate(cls, path):
+        '''
+        Removes the incomplete last line of a journal, so the next record starts on a line of its own
+        :param path: path of the journal file
+        '''
+        if not os.path.exists(path):
+            return
+        with open(path, 'r+') as journal_file:
+            contents = journal_file.read()
+            end = contents.rfind('\n') + 1
+            if end < len(contents):
+                journal_file.truncate(end)
+
+    @classmethod
+    def signature(cls, step):
+        # Records only apply to a step if it has not been changed since they were written
+        material = [step.image, step.command, step.environment, step.binds]
+        return hashlib.sha1(json.dumps(material, sort_keys=True)).hexdigest()
+
+    def previous(self, step_number, step):
+        record = self.steps.get(step_number)
+        if record is None or record['signature'] != RunJournal.signature(step):
+            return None
+        return record
+
+    def completed(self, step_number, step):
+        '''
+        Finds the result of a step that succeeded in an earlier run
+        :param step_number: number of the step in the pipeline
+        :param step: the Step
+        :return: the recorded result dict, or None if the step must run
+        '''
+        record = self.previous(step_number, step)
+        if record is None or record['event'] != 'finished' or record['code'] != 0:
+            return None
+        return {'image': step.image, 'code': 0, 'logs': '', 'resumed': True}
+
+    def container(self, step_number, step):
+        '''
+        Finds the container of a step that was running when an earlier run stopped
+        :param step_number: number of the step in the pipeline
+        :param step: the Step
+        :return: tuple of Docker host URL and container ID, or None
+        '''
+        record = self.previous(step_number, step)
+        if record is None or record['event'] != 'started':
+            return None
+        return record['host'], record['container']
+
+    def record(self, event, step_number, step, **fields):
+        record = dict(fields, event=event, step=step_number, name=step.name, signature=RunJournal.signature(step))
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            self.journal_file.write(line)
+            # The journal is only useful if it survives the process, so each record is synced before moving on
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+            self.steps[step_number] = record
+
+    def started(self, step_number, step, host, container):
+        container_id = container.get('Id') if isinstance(container, dict) else container
+        self.record('started', step_number, step, host=host, container=container_id)
+
+    def finished(self, step_number, step, code):
+        self.record('finished', step_number, step, code=code)
+
+    def close(self):
+        self.journal_file.close()
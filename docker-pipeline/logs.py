@@ -0,0 +1,156 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from collections import deque
+import gzip
+import os
+import re
+
+TAIL_LINES = 50
+TAIL_BYTES = 64 * 1024
+
+
+class LogTail():
+    def __init__(self, max_lines=TAIL_LINES, max_bytes=TAIL_BYTES):
+        '''
+        Keeps the last lines of a log stream in memory, bounded by line count and size
+        :param max_lines: maximum number of lines to keep
+        :param max_bytes: maximum number of bytes to keep
+        '''
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.chunks = deque()
+        self.size = 0
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        # Drop whole chunks while the remainder still covers max_bytes
+        while len(self.chunks) > 1 and self.size - len(self.chunks[0]) >= self.max_bytes:
+            self.size -= len(self.chunks.popleft())
+
+    def getvalue(self):
+        buffered = ''.join(self.chunks)
+        lines = buffered[-self.max_bytes:].splitlines(True)
+        if len(buffered) > self.max_bytes and len(lines) > 1:
+            # The first line was cut by the byte limit
+            lines = lines[1:]
+        return ''.join(lines[-self.max_lines:])
+
+
+class StepLog():
+    def __init__(self, log_dir=None, prefix='step', compress=False, separate_stderr=False,
+                 max_lines=TAIL_LINES, max_bytes=TAIL_BYTES):
+        '''
+        Streams the output of one step to log files, keeping only a bounded tail in memory
+        :param log_dir: directory to write log files to. If None, no files are written
+        :param prefix: file name prefix, e.g. the step number and name
+        :param compress: gzip the log files
+        :param separate_stderr: write stderr to its own file instead of the stdout file
+        '''
+        self.paths = dict()
+        self.files = dict()
+        self.tails = {'stdout': LogTail(max_lines, max_bytes)}
+        self.tails['stderr'] = LogTail(max_lines, max_bytes) if separate_stderr else self.tails['stdout']
+        if log_dir is not None:
+            if not os.path.isdir(log_dir):
+                os.makedirs(log_dir)
+            extension = '.log.gz' if compress else '.log'
+            streams = ['stdout', 'stderr'] if separate_stderr else ['stdout']
+            for stream in streams:
+                path = os.path.join(log_dir, '{}.{}{}'.format(StepLog.safe_name(prefix), stream, extension))
+                self.paths[stream] = path
+                self.files[stream] = gzip.open(path, 'wb') if compress else open(path, 'wb')
+            if not separate_stderr:
+                self.paths['stderr'] = self.paths['stdout']
+                self.files['stderr'] = self.files['stdout']
+
+    @classmethod
+    def safe_name(cls, name):
+        return re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_')
+
+    def write(self, chunk, stream='stdout'):
+        self.tails[stream].write(chunk)
+        if stream in self.files:
+            self.files[stream].write(chunk)
+
+    def tail(self, stream='stdout'):
+        return self.tails[stream].getvalue()
+
+    def close(self):
+        for f in set(self.files.values()):
+            f.close()
+
+
+class FusedStepLog(StepLog):
+    def __init__(self, step, **kwargs):
+        '''
+        A StepLog that also splits a FusedStep's output by sub-step, using the markers its script prints
+        :param step: the FusedStep
+        :param kwargs: arguments for StepLog
+        '''
+        StepLog.__init__(self, **kwargs)
+        self.step = step
+        before, after = step.marker.split('{}')
+        self.pattern = re.compile(re.escape(before) + r'(\d+)' + re.escape(after) + r'(\d+)')
+        self.current = 0
+        self.codes = dict()
+        self.sub_tails = [LogTail(kwargs.get('max_lines', TAIL_LINES), kwargs.get('max_bytes', TAIL_BYTES))
+                          for sub_step in step.steps]
+        self.partial = ''
+
+    def write(self, chunk, stream='stdout'):
+        StepLog.write(self, chunk, stream)
+        if stream != 'stdout':
+            self.sub_tails[self.current].write(chunk)
+            return
+        lines = (self.partial + chunk).split('\n')
+        self.partial = lines.pop()
+        # A marker may be split across chunks, so the end of an incomplete line is held back
+        keep = len(self.step.marker) + 32
+        if len(self.partial) > TAIL_BYTES:
+            self.sub_tails[self.current].write(self.partial[:-keep])
+            self.partial = self.partial[-keep:]
+        for line in lines:
+            match = self.pattern.search(line)
+            if match is None:
+                self.sub_tails[self.current].write(line + '\n')
+                continue
+            if match.start():
+                # Output that did not end with a newline
+                self.sub_tails[self.current].write(line[:match.start()] + '\n')
+            self.codes[int(match.group(1))] = int(match.group(2))
+            self.current = min(int(match.group(1)) + 1, len(self.sub_tails) - 1)
+
+    def results(self):
+        '''
+        :return: list of result dicts for the sub-steps that ran, with their name, exit code (None if the container
+                 stopped before the sub-step finished) and the end of their output
+        '''
+        results = list()
+        for i, sub_step in enumerate(self.step.steps):
+            started = all(self.codes.get(j) == 0 for j in range(i))
+            if i in self.codes or (i == self.current and started):
+                results.append({'name': sub_step.name, 'code': self.codes.get(i), 'logs': self.sub_tails[i].getvalue()})
+        return results
@@ -23,20 +23,60 @@
 # SOFTWARE.
 
 from collections import defaultdict
-from check_path_access import can_access
+from preflight import Preflight
+from scratch import place_intermediates
+from utils import parse_duration, parse_memory
+import copy
+import glob
+import hashlib
 import os
+import pipes
+import shlex
 import yaml
 
 
 class Pipeline():
-    def __init__(self, name, host=None, steps=[], debug=False, pull_images=True):
+    def __init__(self, name, host=None, steps=[], debug=False, pull_images=True, concurrency=1,
+                 pull_policy='always', pull_ttl=None, log_dir=None, compress_logs=False, separate_stderr=False,
+                 capacity=None, hosts=None, preflight=False, remove_containers=False, scratch_dir=None, keep=None,
+                 fuse_steps=False, stats_interval=None):
         if name is None:
             raise TypeError('Must provide a name for the pipeline')
         self.name = name
         self.host = host
+        # Docker daemons to distribute steps across, each a URL or a dict with url, slots and mounts
+        self.hosts = hosts or []
+        # Check volumes before running
+        self.preflight = preflight
+        # Remove each step's container once it has finished
+        self.remove_containers = remove_containers
         self.steps = steps
+        # Files that only pass data between steps are moved to scratch storage, mapped to their original paths
+        self.scratch_dir = scratch_dir
+        self.intermediates = dict()
+        if scratch_dir is not None:
+            self.steps, self.intermediates = place_intermediates(steps, scratch_dir, keep)
+        # Run consecutive steps with the same image in one container
+        self.fuse_steps = fuse_steps
+        if fuse_steps:
+            self.steps = FusedStep.fuse(self.steps)
+        self.check_streams()
         self.debug = debug
         self.pull_images = pull_images
+        self.concurrency = concurrency
+        self.pull_policy = pull_policy
+        self.pull_ttl = pull_ttl
+        self.log_dir = log_dir
+        self.compress_logs = compress_logs
+        self.separate_stderr = separate_stderr
+        # Seconds between samples of each running container's resource usage, or None to not sample
+        self.stats_interval = parse_duration(stats_interval)
+        # Total cpus and memory that steps running at the same time may declare
+        self.capacity = None
+        if capacity is not None:
+            self.capacity = {'cpus': capacity.get('cpus'), 'memory': parse_memory(capacity.get('memory'))}
+        # Glob patterns expanded by scatter steps, mapped to the files they matched
+        self.globs = dict()
 
     def __unicode__(self):
         return u'<Pipeline: {} - steps: {} host: {}, debug: {} >'.format(self.name, len(self.steps), self.host, self.debug)
@@ -47,31 +87,123 @@ class Pipeline():
     @classmethod
     def from_dict(cls, pipeline_dict):
         pipeline_dict = defaultdict(lambda: None, pipeline_dict)
-        step_dicts = pipeline_dict['steps']
-        steps = list()
-        for step_dict in step_dicts:
-            step = Step.from_dict(step_dict)
-            steps.append(step)
+        steps, globs = Pipeline.make_steps(pipeline_dict['steps'])
         name = pipeline_dict['name']
         host = pipeline_dict['host']
         debug = pipeline_dict['debug'] or False
         pull_images = pipeline_dict['pull_images'] or False
-        return cls(name, host=host, steps=steps, debug=debug, pull_images=pull_images)
+        concurrency = pipeline_dict['concurrency'] or 1
+        pull_policy = pipeline_dict['pull_policy'] or 'always'
+        pull_ttl = pipeline_dict['pull_ttl']
+        log_dir = pipeline_dict['log_dir']
+        compress_logs = pipeline_dict['compress_logs'] or False
+        separate_stderr = pipeline_dict['separate_stderr'] or False
+        capacity = pipeline_dict['capacity']
+        hosts = pipeline_dict['hosts']
+        preflight = pipeline_dict['preflight'] or False
+        remove_containers = pipeline_dict['remove_containers'] or False
+        scratch_dir = pipeline_dict['scratch_dir']
+        keep = pipeline_dict['keep']
+        fuse_steps = pipeline_dict['fuse_steps'] or False
+        stats_interval = pipeline_dict['stats_interval']
+        pipeline = cls(name, host=host, steps=steps, debug=debug, pull_images=pull_images, concurrency=concurrency,
+                       pull_policy=pull_policy, pull_ttl=pull_ttl, log_dir=log_dir, compress_logs=compress_logs,
+                       separate_stderr=separate_stderr, capacity=capacity, hosts=hosts, preflight=preflight,
+                       remove_containers=remove_containers, scratch_dir=scratch_dir, keep=keep,
+                       fuse_steps=fuse_steps, stats_interval=stats_interval)
+        pipeline.globs = globs
+        return pipeline
 
     @classmethod
-    def from_yaml(cls, file):
+    def make_steps(cls, step_dicts):
+        '''
+        Creates the steps of a pipeline, expanding scatter steps into one step per file and resolving gathers
+        :param step_dicts: list of step dicts from the pipeline YAML
+        :return: tuple of the list of Steps, and dict of glob pattern to the files it matched
+        '''
+        steps = list()
+        globs = dict()
+        # Outfile templates of scatter steps, mapped to the outfiles of their shards
+        shard_outfiles = dict()
+        for step_dict in step_dicts:
+            if step_dict.get('gather'):
+                step_dict = dict(step_dict)
+                step_dict['gather'] = Pipeline.resolve_gather(step_dict, shard_outfiles)
+            if step_dict.get('scatter'):
+                shards, outfiles, matched = Step.scatter_from_dict(step_dict)
+                steps.extend(shards)
+                shard_outfiles.update(outfiles)
+                globs.update(matched)
+            else:
+                steps.append(Step.from_dict(step_dict))
+        return steps, globs
+
+    @classmethod
+    def resolve_gather(cls, step_dict, shard_outfiles):
+        gather = dict()
+        for label, template in step_dict['gather'].iteritems():
+            if isinstance(template, list):
+                gather[label] = template
+            elif template in shard_outfiles:
+                gather[label] = shard_outfiles[template]
+            else:
+                raise ValueError('Gather {} of step {} must be a list of files or an outfile of an earlier scatter step'
+                                 .format(label, step_dict.get('name')))
+        return gather
+
+    def globs_changed(self):
+        # A compiled pipeline must be expanded again if its globs now match different files
+        return any(sorted(glob.glob(pattern)) != matched for pattern, matched in self.globs.iteritems())
+
+    @classmethod
+    def from_yaml(cls, file, loader=yaml.Loader):
         with open(file, 'r') as yamlfile:
-            pipeline_dict = yaml.load(yamlfile)
+            pipeline_dict = yaml.load(yamlfile, Loader=loader)
         return cls.from_dict(pipeline_dict)
 
     def check_volumes(self):
-        # Confirm access to directories
+        # Confirm access to directories and existence of inputs, reporting every problem at once
+        problems = Preflight(self.steps, scratch_dir=self.scratch_dir, debug=self.debug).run()
+        if problems:
+            raise Exception('\n'.join(problems))
+
+    def check_streams(self):
+        # A stream no step reads blocks its writer forever, and one read by several steps splits its data among them
+        readers = dict((path, 0) for path in self.stream_paths())
+        for step in self.steps:
+            for path in readers.viewkeys() & set(step.infiles.values()):
+                readers[path] += 1
+        for path, count in sorted(readers.iteritems()):
+            if count != 1:
+                raise ValueError('Stream {} must be read by exactly one step, not {}'.format(path, count))
+
+    def stream_paths(self):
+        paths = set()
+        for step in self.steps:
+            paths.update(step.stream_paths)
+        return paths
+
+    def inputs(self):
+        # Files read by a step before any step writes them
+        written = set()
+        inputs = set()
+        for step in self.steps:
+            inputs.update(path for path in step.infiles.values() if path not in written)
+            written.update(step.outfiles.values())
+        return inputs
+
+    def outputs(self):
+        # Files written by steps and left in place after the run
+        outputs = set()
         for step in self.steps:
-            step.check_volumes(self.debug)
+            outputs.update(step.outfiles.values())
+        return outputs - self.stream_paths() - set(self.intermediates)
 
 
 class Step():
-    def __init__(self, name, image, command=None, parameters=None, infiles={}, outfiles={}):
+    def __init__(self, name, image, command=None, parameters=None, infiles={}, outfiles={}, cpus=None, memory=None,
+                 streams=[], merge_volumes=False, gather=None, shard=None, timeout=None, retries=0, idempotent=False,
+                 speculate=None, group=None):
         if image is None:
             raise TypeError('Must provide an image name for the step')
         if name is None:
@@ -79,31 +211,71 @@ class Step():
         self.name = name
         self.image = image
         self.command = command
+        self.parameters = parameters
+        # Resources the step needs, used to limit the container and to decide which steps can run together
+        self.cpus = cpus
+        self.memory = parse_memory(memory)
+        # Gathered lists of files are passed as numbered infiles, and as one variable listing them all
+        self.gather = gather or dict()
+        if self.gather:
+            infiles = dict(infiles or {})
+            for label, paths in self.gather.iteritems():
+                infiles.update(('{}_{}'.format(label, i), path) for i, path in enumerate(paths))
+        # Name of the scattered file this step was expanded for, and the name of the scatter step
+        self.shard = shard
+        self.group = group
+        # The container is killed if it runs longer than timeout seconds
+        self.timeout = parse_duration(timeout)
+        # Idempotent steps can be run again: retried when they fail, or duplicated when they run far longer
+        # than the median of their group
+        self.idempotent = idempotent
+        self.retries = retries or 0
+        self.speculate = speculate
+        if (self.retries or speculate) and not idempotent:
+            raise ValueError('Step {} must be idempotent to be retried or run speculatively'.format(name))
         self.infiles = infiles
         self.outfiles = outfiles
 
+        # Outputs written as named pipes, read by later steps while this step runs
+        for label in streams:
+            if label not in outfiles:
+                raise ValueError('Stream {} of step {} must be one of its outfiles'.format(label, name))
+        if speculate and streams:
+            raise ValueError('Step {} writes streams and cannot run speculatively'.format(name))
+        self.streams = streams
+        self.stream_paths = set(outfiles[label] for label in streams)
+        self.merge_volumes = merge_volumes
+
         # Inputs are mounted read-only
-        self.infiles_dirnames_dict = Step.make_dirnames_dict(self.infiles.values())
+        self.infiles_dirnames_dict = Step.make_dirnames_dict(self.infiles.values(), merge_volumes)
         infiles_dirnames = set(self.infiles_dirnames_dict.values())
         self.infiles_volumes_dict = Step.make_volumes_dict(infiles_dirnames, '/mnt/input')
 
         # Outputs will be mounted read-write
-        self.outfiles_dirnames_dict = Step.make_dirnames_dict(self.outfiles.values())
+        self.outfiles_dirnames_dict = Step.make_dirnames_dict(self.outfiles.values(), merge_volumes)
         outfiles_dirnames = set(self.outfiles_dirnames_dict.values())
         self.outfiles_volumes_dict = Step.make_volumes_dict(outfiles_dirnames, '/mnt/output')
 
         self.binds = self.generate_binds()
 
         # Structures for environment are simplified by having input and output together
-        self.allfiles = dict(infiles.items() + outfiles.items())
-        self.dirnames_dict = dict(self.infiles_dirnames_dict.items() + self.outfiles_dirnames_dict.items())
-        self.volumes_dict = dict(self.infiles_volumes_dict.items() + self.outfiles_volumes_dict.items())
+        self.allfiles = dict(infiles)
+        self.allfiles.update(outfiles)
+        self.dirnames_dict = dict(self.infiles_dirnames_dict)
+        self.dirnames_dict.update(self.outfiles_dirnames_dict)
+        # A directory holding both inputs and outputs is bound once, read-write, so it has no input volume
+        self.volumes_dict = dict((remote, local) for remote, local in self.infiles_volumes_dict.iteritems()
+                                 if local not in outfiles_dirnames)
+        self.volumes_dict.update(self.outfiles_volumes_dict)
+        # Reverse of volumes_dict
+        self.remote_dirs = dict((local, remote) for remote, local in self.infiles_volumes_dict.iteritems())
+        self.remote_dirs.update((local, remote) for remote, local in self.outfiles_volumes_dict.iteritems())
 
         # Environment variables passed to container execution must reference file paths from within the container
         # Also pass along parameters as environment variables
         self.environment = self.generate_file_parameters()
         if parameters is not None:
-            self.environment = dict(self.environment.items() + parameters.items())
+            self.environment.update(parameters)
 
     def __unicode__(self):
         return u'<Step: {} - Image: {}, Command: {}, {}i,{}o>'.format(self.name, self.image, self.command, len(self.infiles), len(self.outfiles))
@@ -119,9 +291,71 @@ class Step():
                    command=step_dict['command'],
                    parameters=step_dict['parameters'],
                    infiles=step_dict['infiles'],
-                   outfiles=step_dict['outfiles'])
+                   outfiles=step_dict['outfiles'],
+                   cpus=step_dict['cpus'],
+                   memory=step_dict['memory'],
+                   streams=step_dict['streams'] or [],
+                   merge_volumes=step_dict['merge_volumes'] or False,
+                   gather=step_dict['gather'],
+                   timeout=step_dict['timeout'],
+                   retries=step_dict['retries'] or 0,
+                   idempotent=step_dict['idempotent'] or False,
+                   speculate=step_dict['speculate'])
         return step
 
+    @classmethod
+    def scatter_from_dict(cls, step_dict):
+        '''
+        Expands a step over a list of files, creating one step per file. Outfiles and parameters may contain
+        {shard}, the scattered file's name without its extension, and {index}, its position in the list.
+        :param step_dict: step dict from the pipeline YAML, whose scatter maps one infile label to a glob or a list
+        :return: tuple of the list of Steps, dict of each outfile template to the shards' outfiles, and dict of
+                 glob pattern to the files it matched
+        '''
+        step_dict = defaultdict(lambda: None, step_dict)
+        name = step_dict['name']
+        if len(step_dict['scatter']) != 1:
+            raise ValueError('Step {} must scatter exactly one infile'.format(name))
+        label, pattern = step_dict['scatter'].items()[0]
+        globs = dict()
+        if isinstance(pattern, basestring):
+            paths = sorted(glob.glob(pattern))
+            globs[pattern] = paths
+        else:
+            paths = list(pattern)
+        if not paths:
+            raise ValueError('Scatter {} of step {} matched no files'.format(pattern, name))
+        shard_names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+        if len(set(shard_names)) != len(shard_names):
+            raise ValueError('Files scattered by step {} must have different names'.format(name))
+        outfile_templates = step_dict['outfiles'] or {}
+        steps = list()
+        for index, (path, shard) in enumerate(zip(paths, shard_names)):
+            infiles = dict(step_dict['infiles'] or {})
+            infiles[label] = path
+            outfiles = dict((outfile_label, Step.fill_shard(template, shard, index))
+                            for outfile_label, template in outfile_templates.iteritems())
+            parameters = None
+            if step_dict['parameters'] is not None:
+                parameters = dict((key, Step.fill_shard(value, shard, index)
+                                   if isinstance(value, basestring) else value)
+                                  for key, value in step_dict['parameters'].iteritems())
+            shard_name = '{} [{}]'.format(name, shard)
+            if steps:
+                # Shards usually use the same directories, so the first shard's volumes are reused
+                steps.append(steps[0].with_files(shard_name, shard, infiles, outfiles, parameters))
+            else:
+                steps.append(Step(shard_name, step_dict['image'], command=step_dict['command'], parameters=parameters,
+                                  infiles=infiles, outfiles=outfiles, cpus=step_dict['cpus'],
+                                  memory=step_dict['memory'], streams=step_dict['streams'] or [],
+                                  merge_volumes=step_dict['merge_volumes'] or False,
+                                  gather=step_dict['gather'], shard=shard, timeout=step_dict['timeout'],
+                                  retries=step_dict['retries'] or 0, idempotent=step_dict['idempotent'] or False,
+                                  speculate=step_dict['speculate'], group=name))
+        shard_outfiles = dict((template, [step.outfiles[outfile_label] for step in steps])
+                              for outfile_label, template in outfile_templates.iteritems())
+        return steps, shard_outfiles, globs
+
     @classmethod
     def from_yaml(cls, file):
         step_dict = None
@@ -129,20 +363,116 @@ class Step():
             step_dict = yaml.load(yamlfile)
         return cls.from_dict(step_dict)
 
+    def relocated(self, paths):
+        '''
+        Copies the step with some of its files moved
+        :param paths: dict of original path to new path. Files not in it keep their paths
+        :return: a new Step
+        '''
+        move = lambda files: dict((label, paths.get(path, path)) for label, path in files.iteritems())
+        gather = dict((label, [paths.get(path, path) for path in gathered])
+                      for label, gathered in self.gather.iteritems())
+        return Step(self.name, self.image, command=self.command, parameters=self.parameters,
+                    infiles=move(self.infiles), outfiles=move(self.outfiles), cpus=self.cpus, memory=self.memory,
+                    streams=self.streams, merge_volumes=self.merge_volumes, gather=gather, shard=self.shard,
+                    **self.run_options())
+
+    def run_options(self):
+        return {'timeout': self.timeout, 'retries': self.retries, 'idempotent': self.idempotent,
+                'speculate': self.speculate, 'group': self.group}
+
+    @classmethod
+    def fill_shard(cls, template, shard, index):
+        # Only {shard} and {index} are replaced, so other braces, e.g. in shell or awk snippets, are kept
+        return template.replace('{shard}', shard).replace('{index}', str(index))
+
+    def with_files(self, name, shard, infiles, outfiles, parameters):
+        '''
+        Copies the step for different files. When the files are in the same directories, the copy shares
+        this step's volumes and binds instead of computing them again.
+        :return: a new Step
+        '''
+        infiles_dirnames_dict = Step.make_dirnames_dict(infiles.values(), self.merge_volumes)
+        outfiles_dirnames_dict = Step.make_dirnames_dict(outfiles.values(), self.merge_volumes)
+        if (self.gather or
+                set(infiles_dirnames_dict.values()) != set(self.infiles_dirnames_dict.values()) or
+                set(outfiles_dirnames_dict.values()) != set(self.outfiles_dirnames_dict.values())):
+            return Step(name, self.image, command=self.command, parameters=parameters, infiles=infiles,
+                        outfiles=outfiles, cpus=self.cpus, memory=self.memory, streams=self.streams,
+                        merge_volumes=self.merge_volumes, gather=self.gather, shard=shard, **self.run_options())
+        step = copy.copy(self)
+        step.name = name
+        step.shard = shard
+        step.parameters = parameters
+        step.infiles = infiles
+        step.outfiles = outfiles
+        step.stream_paths = set(outfiles[label] for label in self.streams)
+        step.infiles_dirnames_dict = infiles_dirnames_dict
+        step.outfiles_dirnames_dict = outfiles_dirnames_dict
+        step.allfiles = dict(infiles)
+        step.allfiles.update(outfiles)
+        step.dirnames_dict = dict(infiles_dirnames_dict)
+        step.dirnames_dict.update(outfiles_dirnames_dict)
+        step.environment = step.generate_file_parameters()
+        if parameters is not None:
+            step.environment.update(parameters)
+        return step
+
     def get_volumes(self):
         return sorted(self.volumes_dict.keys())
 
     @classmethod
-    def make_dirnames_dict(cls, filenames=[]):
+    def make_dirnames_dict(cls, filenames=[], merge=False):
         '''
         Creates a dictionary, which maps file names to their containing directories.
 
         :param filenames: a list of filenames
+        :param merge: map files to the merged directories from merge_dirnames, instead of their own directories
         :return: dictionary of filenames, mapping to their directory names
         '''
         dirnames = dict(((filename, os.path.dirname(filename)) for filename in filenames))
+        if merge:
+            merged = Step.merge_dirnames(set(dirnames.values()))
+            ancestors = dict()
+            for dirname in set(dirnames.values()):
+                ancestor = dirname
+                while ancestor not in merged:
+                    ancestor = os.path.dirname(ancestor)
+                ancestors[dirname] = ancestor
+            dirnames = dict((filename, ancestors[dirname]) for filename, dirname in dirnames.iteritems())
         return dirnames
 
+    @classmethod
+    def merge_dirnames(cls, dirnames=set()):
+        '''
+        Reduces a set of directories to fewer, wider directories: directories inside another directory of the set
+        are dropped, and sibling directories are replaced by their parent. Directories are never merged into /.
+
+        :param dirnames: Set of unique directory names.
+        :return: Set of directory names, such that each of dirnames is in or under exactly one of them
+        '''
+        dirnames = set(dirnames)
+        while True:
+            # Drop directories under another directory in the set
+            for dirname in list(dirnames):
+                ancestor = os.path.dirname(dirname)
+                while ancestor != os.path.dirname(ancestor):
+                    if ancestor in dirnames:
+                        dirnames.discard(dirname)
+                        break
+                    ancestor = os.path.dirname(ancestor)
+            siblings = defaultdict(set)
+            for dirname in dirnames:
+                parent = os.path.dirname(dirname)
+                if parent != os.path.dirname(parent):
+                    siblings[parent].add(dirname)
+            merged = [(parent, children) for parent, children in siblings.iteritems() if len(children) > 1]
+            if not merged:
+                return dirnames
+            for parent, children in merged:
+                dirnames.difference_update(children)
+                dirnames.add(parent)
+
     @classmethod
     def make_volumes_dict(cls, dirnames=set(), prefix='/volume'):
         '''
@@ -175,45 +505,132 @@ class Step():
 
         input_binds = Step.make_binds_dict(self.infiles_volumes_dict, ro=True)
         output_binds = Step.make_binds_dict(self.outfiles_volumes_dict)
-        binds = dict(input_binds.items() + output_binds.items())
+        binds = dict(input_binds)
+        binds.update(output_binds)
         return binds
 
     def translate_local_to_remote(self, local_path):
         '''
         Translates a local file path to its path inside the container
         :param local_path: path to local file
-        :param volumes_dict: mapping of remote mount points to local directories
+        :param remote_dirs: mapping of local directories to remote mount points
         :param dirnames_dict: mapping of filenames to their dirnames
         :return:
         '''
 
         dirname = self.dirnames_dict[local_path]
-        filename = os.path.basename(local_path)
-        remote_path = None
-        for remote, local in self.volumes_dict.iteritems():
-            if local == dirname:
-                remote_path = '{}/{}'.format(remote, filename)
-                break
-        return remote_path
-
-    def generate_file_parameters(self):
+        remote_dir = self.remote_dirs[dirname]
+        # With merged volumes, a file may be in a subdirectory of the bound directory
+        relative_path = local_path[len(dirname):].lstrip('/')
+        return '{}/{}'.format(remote_dir, relative_path)
+
+    def generate_file_parameters(self, translate=None):
+        '''
+        :param translate: function translating a local path to its path in the container, defaults to this step's
+        :return: dict of environment variables for the step's files
+        '''
+        translate = translate or self.translate_local_to_remote
         environment = dict()
         # Input: 'CONT_INPUT_BLAST_DB': '/Users/dcl9/Data/go-blastdb'
         # Output: 'CONT_INPUT_BLAST_DB': '/mnt/input_0/go-blastdb'
         for label, filename in self.allfiles.iteritems():
-            environment[label] = self.translate_local_to_remote(filename)
+            environment[label] = translate(filename)
+        # Gathered files are listed in one variable, separated by spaces
+        for label, filenames in self.gather.iteritems():
+            environment[label] = ' '.join(translate(filename) for filename in filenames)
         return environment
 
-    def check_volumes(self, debug):
-        if debug:
-            print 'checking volumes for {}'.format(self)
-        for path, bind_args in self.binds.items():
-            if bind_args['ro']:
-                perm = 'r'
+
+# Printed after each sub-step of a FusedStep, with a token for the group, the sub-step index and its exit code
+FUSED_MARKER = '==== docker-pipeline {}: step {} exited with code '
+
+
+class FusedStep(Step):
+    def __init__(self, steps):
+        '''
+        Runs consecutive steps that use the same image in one container, one after another.
+        Stops at the first sub-step that fails, and exits with its code.
+        :param steps: the Steps to run, in order. All must have the same image and a command
+        '''
+        self.steps = steps
+        infiles = dict()
+        outfiles = dict()
+        written = set()
+        for i, step in enumerate(steps):
+            # Labels are made unique, since each sub-step gets its own environment in the script
+            for label, path in step.infiles.iteritems():
+                # Files written by an earlier sub-step are mounted as outfiles, and are not inputs to the group
+                if path not in written:
+                    infiles['STEP{}_{}'.format(i, label)] = path
+            for label, path in step.outfiles.iteritems():
+                outfiles['STEP{}_{}'.format(i, label)] = path
+            written.update(step.outfiles.values())
+        Step.__init__(self, ' + '.join(step.name for step in steps), steps[0].image,
+                      infiles=infiles, outfiles=outfiles,
+                      cpus=FusedStep.largest(step.cpus for step in steps),
+                      memory=FusedStep.largest(step.memory for step in steps),
+                      merge_volumes=steps[0].merge_volumes,
+                      timeout=FusedStep.total(step.timeout for step in steps),
+                      retries=min(step.retries for step in steps),
+                      idempotent=all(step.idempotent for step in steps))
+        # The token identifies the markers between sub-steps, and is the same every time the pipeline is loaded
+        self.token = hashlib.sha1(repr([(step.name, step.command) for step in steps])).hexdigest()[:12]
+        self.marker = FUSED_MARKER.format(self.token, '{}')
+        self.environment = dict()
+        self.command = ['/bin/sh', '-c', self.script()]
+
+    @classmethod
+    def largest(cls, values):
+        values = [value for value in values if value]
+        return max(values) if values else None
+
+    @classmethod
+    def total(cls, values):
+        # The group only has a limit if every step in it does
+        values = list(values)
+        return None if None in values else sum(values)
+
+    @classmethod
+    def can_fuse(cls, previous, step):
+        # Streams need both ends running at once, so their steps are never fused. Shards of a scatter are
+        # meant to run in parallel, so they are not fused either.
+        return (previous.image == step.image and
+                previous.shard is None and step.shard is None and
+                previous.command is not None and step.command is not None and
+                not previous.stream_paths and not step.stream_paths and
+                previous.merge_volumes == step.merge_volumes)
+
+    @classmethod
+    def fuse(cls, steps):
+        '''
+        Groups runs of consecutive steps that can share a container into FusedSteps
+        :param steps: the pipeline's Steps, in pipeline order
+        :return: list of Steps, with each group of two or more steps replaced by a FusedStep
+        '''
+        groups = []
+        for step in steps:
+            if groups and FusedStep.can_fuse(groups[-1][-1], step):
+                groups[-1].append(step)
             else:
-                perm = 'w'
-            access = can_access(path, perm)
-            if not access:
-                message = 'ERROR: No {0} access to {1}'.format(perm, path)
-                raise Exception(message)
+                groups.append([step])
+        return [FusedStep(group) if len(group) > 1 else group[0] for group in groups]
+
+    def sub_environment(self, step):
+        environment = step.generate_file_parameters(self.translate_local_to_remote)
+        environment.update(step.parameters or {})
+        return environment
 
+    def script(self):
+        lines = []
+        for i, step in enumerate(self.steps):
+            # docker-py splits string commands the same way, and runs them without a shell
+            args = shlex.split(str(step.command)) if isinstance(step.command, basestring) else step.command
+            exports = ' '.join('{}={}'.format(label, pipes.quote(str(value)))
+                               for label, value in sorted(self.sub_environment(step).iteritems()))
+            # A bare export would print the whole environment into the step's log
+            exports = 'export {}; '.format(exports) if exports else ''
+            lines.append('({}exec {})'.format(exports, ' '.join(pipes.quote(str(arg)) for arg in args)))
+            lines.append('code=$?')
+            lines.append('echo "{}$code"'.format(self.marker.format(i)))
+            lines.append('[ $code -eq 0 ] || exit $code')
+        return '\n'.join(lines)
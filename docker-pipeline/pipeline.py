@@ -24,24 +24,106 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from models import Pipeline
-from runner import Runner
-from utils import extract_var_map
-import tag_handlers
+from pipeline_cache import load_pipeline
+from history import DEFAULT_HISTORY, StepHistory, print_plan
+from utils import extract_var_map, parse_duration
 import argparse
 
 
-def main(yaml_file, var_map):
-    tag_handlers.configure(var_map)
-    p = Pipeline.from_yaml(yaml_file)
-    runner = Runner(p)
-    runner.run()
+def main(yaml_file, var_map, compiled_dir=None, **options):
+    '''
+    Parses a pipeline and runs it
+    :param yaml_file: path to the pipeline YAML
+    :param var_map: dict of variables for !var tags
+    :param compiled_dir: directory of compiled pipelines, see pipeline_cache
+    :param options: passed to run()
+    '''
+    run(load_pipeline(yaml_file, var_map, cache_dir=compiled_dir), **options)
 
 
-if __name__ == '__main__':
+def run(p, concurrency=None, cache_dir=None, log_dir=None, report=None, trace=None, preflight=False,
+        event_loop=False, journal_path=None, resume=False, manifest=None, history_path=DEFAULT_HISTORY, plan=False,
+        stats_interval=None):
+    # docker-py takes longer to import than the rest of docker-pipeline, so it is only imported to run steps
+    from cache import StepCache
+    from event_runner import EventLoopRunner
+    from journal import RunJournal
+    from runner import Runner
+    history = StepHistory(history_path)
+    if plan:
+        print_plan(p, history, concurrency)
+        return
+    if preflight:
+        p.preflight = True
+    if log_dir is not None:
+        p.log_dir = log_dir
+    if stats_interval is not None:
+        p.stats_interval = parse_duration(stats_interval)
+    cache = None
+    if cache_dir is not None:
+        cache = StepCache(cache_dir)
+    journal = None
+    if journal_path is not None:
+        journal = RunJournal(journal_path, resume=resume)
+    runner_class = EventLoopRunner if event_loop else Runner
+    runner = runner_class(p, concurrency=concurrency, cache=cache, journal=journal)
+    runner.manifest = manifest
+    runner.history = history
+    try:
+        runner.run()
+    finally:
+        if journal is not None:
+            journal.close()
+        if report is not None:
+            runner.write_report(report)
+        if trace is not None:
+            runner.tracer.write_trace(trace)
+
+
+def parse_args(argv=None, open_yaml=True):
+    '''
+    Parses the command line
+    :param argv: the arguments, defaults to sys.argv
+    :param open_yaml: open the YAML file while parsing. If False, yaml_file is its path, for the caller to open
+    :return: tuple of the parsed arguments, a dict of their options for main(), and the dict of variables
+    '''
     parser = argparse.ArgumentParser()
-    parser.add_argument('yaml_file', type=argparse.FileType('r'))
+    parser.add_argument('yaml_file', type=argparse.FileType('r') if open_yaml else str)
+    parser.add_argument('--concurrency', type=int, help='Maximum number of steps to run at the same time')
+    parser.add_argument('--cache-dir', help='Directory for cached step results. Steps with unchanged inputs are skipped')
+    parser.add_argument('--log-dir', help='Directory to write step output to, instead of the console')
+    parser.add_argument('--report', help='Write a JSON report of the time spent in each phase of each step')
+    parser.add_argument('--stats-interval',
+                        help='Sample the resource usage of each running container this often (e.g. 5s), and '
+                             'include it in --report')
+    parser.add_argument('--trace', help='Write the timing of each phase in Chrome trace format')
+    parser.add_argument('--compiled-dir', help='Directory for parsed pipelines, reused while the YAML and variables '
+                                               'are unchanged')
+    parser.add_argument('--preflight', action='store_true',
+                        help='Check access to all volumes and that all inputs exist before running')
+    parser.add_argument('--event-loop', action='store_true',
+                        help='Wait on all running steps from one thread instead of a thread per step')
+    parser.add_argument('--journal', help='Record the progress of each step in this file, so the run can be resumed')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume the run recorded in --journal, skipping steps that succeeded and reattaching '
+                             'to containers that are still running')
+    parser.add_argument('--manifest', help='Write the fingerprints of all inputs and outputs of the run to this file')
+    parser.add_argument('--history', default=DEFAULT_HISTORY,
+                        help='File of past step durations, used to start the longest chains of steps first')
+    parser.add_argument('--plan', action='store_true',
+                        help='Print the predicted run time and critical path from past durations, without running')
     parser.add_argument_group()
-    args, leftovers = parser.parse_known_args()
-    var_map = extract_var_map(leftovers)
-    main(args.yaml_file.name, var_map)
+    args, leftovers = parser.parse_known_args(argv)
+    if args.resume and args.journal is None:
+        parser.error('--resume requires --journal')
+    options = dict(concurrency=args.concurrency, cache_dir=args.cache_dir, log_dir=args.log_dir, report=args.report,
+                   trace=args.trace, compiled_dir=args.compiled_dir, preflight=args.preflight,
+                   event_loop=args.event_loop, journal_path=args.journal, resume=args.resume,
+                   manifest=args.manifest, history_path=args.history, plan=args.plan,
+                   stats_interval=args.stats_interval)
+    return args, options, extract_var_map(leftovers)
+
+
+if __name__ == '__main__':
+    args, options, var_map = parse_args()
+    main(args.yaml_file.name, var_map, **options)
@@ -0,0 +1,122 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from models import Pipeline
+import cPickle as pickle
+import hashlib
+import json
+import models
+import os
+import tag_handlers
+import tempfile
+import yaml
+
+# Increment when the pickled form of Pipeline or Step changes in a way models.py does not show
+CACHE_FORMAT = 1
+
+
+def load_pipeline(yaml_file, var_map, cache_dir=None):
+    '''
+    Loads a pipeline, replacing !var tags with values from var_map
+    :param yaml_file: path to the pipeline YAML
+    :param var_map: dict of variables
+    :param cache_dir: directory of compiled pipelines. If None, the YAML is always parsed
+    :return: a Pipeline
+    '''
+    if cache_dir is None:
+        return Pipeline.from_yaml(yaml_file, loader=tag_handlers.make_loader(var_map))
+    return PipelineCache(cache_dir).load(yaml_file, var_map)
+
+
+def load_pipeline_contents(yaml_contents, var_map, cache_dir=None):
+    '''
+    Loads a pipeline from YAML text, such as a pipeline submitted to the server
+    :param yaml_contents: the pipeline YAML
+    :param var_map: dict of variables
+    :param cache_dir: directory of compiled pipelines. If None, the YAML is always parsed
+    :return: a Pipeline
+    '''
+    if cache_dir is None:
+        return parse_pipeline(yaml_contents, var_map)
+    return PipelineCache(cache_dir).load_contents(yaml_contents, var_map)
+
+
+def parse_pipeline(yaml_contents, var_map, safe=False):
+    return Pipeline.from_dict(yaml.load(yaml_contents, Loader=tag_handlers.make_loader(var_map, safe=safe)))
+
+
+class PipelineCache():
+    def __init__(self, path):
+        '''
+        A cache of fully constructed Pipelines, keyed by the YAML contents and the variables
+        :param path: directory to store compiled pipelines in, created if missing
+        '''
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    @classmethod
+    def code_version(cls):
+        # Compiled pipelines are invalid once the models change
+        models_source = os.path.splitext(models.__file__)[0] + '.py'
+        with open(models_source, 'rb') as f:
+            return '{}-{}'.format(CACHE_FORMAT, hashlib.sha1(f.read()).hexdigest())
+
+    def key(self, yaml_contents, var_map):
+        digest = hashlib.sha1(PipelineCache.code_version())
+        digest.update(yaml_contents)
+        digest.update(json.dumps(sorted(var_map.items())))
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, '{}.pickle'.format(key))
+
+    def load(self, yaml_file, var_map):
+        '''
+        Loads a pipeline from the cache, parsing and storing it if it is not there
+        :param yaml_file: path to the pipeline YAML
+        :param var_map: dict of variables
+        :return: a Pipeline
+        '''
+        with open(yaml_file, 'rb') as f:
+            yaml_contents = f.read()
+        return self.load_contents(yaml_contents, var_map)
+
+    def load_contents(self, yaml_contents, var_map):
+        entry_path = self.entry_path(self.key(yaml_contents, var_map))
+        if os.path.exists(entry_path):
+            try:
+                with open(entry_path, 'rb') as entry_file:
+                    pipeline = pickle.load(entry_file)
+                if not pipeline.globs_changed():
+                    return pipeline
+            except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+                # Unreadable entries are replaced below
+                pass
+        pipeline = parse_pipeline(yaml_contents, var_map)
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        with os.fdopen(fd, 'wb') as entry_file:
+            pickle.dump(pipeline, entry_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, entry_path)
+        return pipeline
@@ -0,0 +1,111 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from check_path_access import can_access
+from multiprocessing.pool import ThreadPool
+import os
+
+
+class Preflight():
+    def __init__(self, steps, workers=16, scratch_dir=None, debug=False):
+        '''
+        Checks a pipeline's paths before it runs. Each distinct check runs once, and checks run concurrently,
+        since each may be a slow round-trip to network storage.
+        :param steps: the pipeline's Steps, in pipeline order
+        :param workers: number of checks to run at the same time
+        :param scratch_dir: the pipeline's scratch directory, whose subdirectories are created when it runs
+        '''
+        self.steps = steps
+        self.scratch_dir = scratch_dir
+        self.workers = workers
+        self.debug = debug
+
+    def access_checks(self):
+        '''
+        :return: set of (path, perm) for every directory bound by any step, perm being 'r' or 'w'
+        '''
+        checks = set()
+        for step in self.steps:
+            for path, bind_args in step.binds.iteritems():
+                if self.in_scratch(path):
+                    checks.add((self.scratch_parent(), 'w'))
+                else:
+                    checks.add((path, 'r' if bind_args['ro'] else 'w'))
+        return checks
+
+    def in_scratch(self, path):
+        return self.scratch_dir is not None and (path + '/').startswith(self.scratch_dir.rstrip('/') + '/')
+
+    def scratch_parent(self):
+        # Intermediates' directories are created under the scratch directory, which is created if missing
+        path = self.scratch_dir
+        while not os.path.isdir(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        return path
+
+    def existence_checks(self):
+        '''
+        :return: dict of infile path to the name of the first step reading it, for infiles no earlier step writes
+        '''
+        written = set()
+        checks = dict()
+        for step in self.steps:
+            for path in step.infiles.values():
+                if path not in written and path not in checks:
+                    checks[path] = step.name
+            written.update(step.outfiles.values())
+        return checks
+
+    @classmethod
+    def check_access(cls, check):
+        path, perm = check
+        if not can_access(path, perm):
+            return 'ERROR: No {0} access to {1}'.format(perm, path)
+        return None
+
+    @classmethod
+    def check_exists(cls, check):
+        path, step_name = check
+        if not os.path.exists(path):
+            return 'ERROR: Input {0} of step {1} does not exist'.format(path, step_name)
+        return None
+
+    def run(self):
+        '''
+        Runs every check
+        :return: a sorted list of problems found, empty if all checks passed
+        '''
+        access_checks = sorted(self.access_checks())
+        existence_checks = sorted(self.existence_checks().items())
+        if self.debug:
+            print 'Checking access to {} directories and existence of {} inputs'.format(len(access_checks),
+                                                                                   len(existence_checks))
+        pool = ThreadPool(self.workers)
+        try:
+            access_problems = pool.map_async(Preflight.check_access, access_checks)
+            existence_problems = pool.map_async(Preflight.check_exists, existence_checks)
+            problems = access_problems.get() + existence_problems.get()
+        finally:
+            pool.close()
+        return [problem for problem in problems if problem is not None]
@@ -0,0 +1,110 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from endpoints import make_client
+from Queue import Queue
+import argparse
+import threading
+
+# Containers created by docker-pipeline are named with this prefix, so they can be found after a crash
+CONTAINER_PREFIX = 'docker-pipeline-'
+
+
+class ContainerReaper():
+    def __init__(self, client, debug=False):
+        '''
+        Removes finished containers on a background thread, so steps do not wait for their removal
+        :param client: docker Client for the host the containers ran on
+        :param debug: print each container as it is removed
+        '''
+        self.client = client
+        self.debug = debug
+        self.queue = Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def remove(self, container):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='container-reaper')
+                self.thread.daemon = True
+                self.thread.start()
+        self.queue.put(container)
+
+    def run(self):
+        while True:
+            container = self.queue.get()
+            try:
+                if container is None:
+                    return
+                if self.debug:
+                    print 'Removing container {}'.format(container)
+                # v removes the container's anonymous volumes along with it
+                self.client.remove_container(container, v=True)
+            except Exception as e:
+                # Connection errors are reported too, so the thread keeps removing the containers queued after
+                print 'Could not remove container {}: {}'.format(container, e)
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+
+
+def sweep(client, include_running=False, prefix=CONTAINER_PREFIX):
+    '''
+    Removes containers left behind by runs that did not finish
+    :param client: docker Client for the host to clean up
+    :param include_running: also kill and remove containers that are still running
+    :param prefix: name prefix of the containers to remove
+    :return: list of names of the removed containers
+    '''
+    removed = list()
+    for container in client.containers(all=True):
+        names = [name.lstrip('/') for name in container.get('Names') or []]
+        if not any(name.startswith(prefix) for name in names):
+            continue
+        running = (container.get('Status') or '').startswith('Up')
+        if running and not include_running:
+            continue
+        client.remove_container(container['Id'], v=True, force=running)
+        removed.append(names[0])
+    return removed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Remove containers left behind by docker-pipeline runs')
+    parser.add_argument('--host', action='append', help='Docker host to clean up, may be repeated. Defaults to '
+                                                        'the host from the DOCKER_HOST environment variables')
+    parser.add_argument('--running', action='store_true',
+                        help='Also remove containers that are still running. Only use this when no runs are active')
+    args = parser.parse_args()
+    for host in args.host or [None]:
+        for name in sweep(make_client(host), include_running=args.running):
+            print 'Removed {}'.format(name)
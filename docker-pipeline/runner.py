@@ -22,84 +22,648 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from docker.client import Client
-from docker.utils import kwargs_from_env
+from docker.errors import APIError
+from endpoints import EndpointPool, make_client
+from fingerprints import Fingerprinter, write_manifest
+from images import ImagePrefetcher
+from logs import FusedStepLog, StepLog
+from models import FusedStep
+from reaper import CONTAINER_PREFIX, ContainerReaper
+from scratch import ScratchCleaner
+from scheduler import StepGraph, Scheduler
+from stats import StatsSampler
+from timing import Tracer
+from collections import defaultdict
+import Queue
+import itertools
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+# Seconds to wait before retrying a failed idempotent step, doubled for each further attempt
+RETRY_SECONDS = 5
+MAX_RETRY_SECONDS = 300
+# Shards of a scatter that must finish before their median duration is used to spot stragglers
+MIN_SIBLINGS = 3
+# Seconds between checks of whether a running shard has become a straggler
+SPECULATE_POLL_SECONDS = 1
 
 
 class Runner():
-    def __init__(self, pipeline=None):
+    def __init__(self, pipeline=None, concurrency=None, cache=None, client=None, endpoints=None, journal=None):
         self.pipeline = pipeline
-        self.client = Runner.get_client()
-        self.remove_containers = False
+        # Endpoints passed in are shared with other runners, and are closed by their owner
+        self.endpoints = endpoints or EndpointPool.from_pipeline(pipeline, client=client)
+        self.shared_endpoints = endpoints is not None
+        self.client = self.endpoints.endpoints[0].client
+        self.remove_containers = pipeline.remove_containers
+        # Container names identify the run and step, and are unique within the run
+        self.run_id = uuid.uuid4().hex[:12]
+        self.container_numbers = itertools.count(1)
+        self.concurrency = concurrency or pipeline.concurrency
+        self.cache = cache
+        self.journal = journal
+        self.scratch = None
+        # Path to write a manifest of input and output fingerprints to
+        self.manifest = None
+        self.fingerprinter = None
+        self.image_ids = dict()
+        self.retry_seconds = RETRY_SECONDS
+        # Durations of the shards of each scatter that have succeeded, keyed by the scatter step's name
+        self.sibling_durations = defaultdict(list)
+        # IDs of containers killed for running longer than their step's timeout
+        self.timed_out = set()
+        # Resource usage of each step that was sampled, by step number
+        self.usage = dict()
+        self.lock = threading.Lock()
+        # ImagePrefetchers by endpoint URL. Each run has its own, so a pull's result is not kept past the run
+        self.prefetchers = dict()
+        # StepHistory of step durations, used to start steps on the critical path first
+        self.history = None
+        self.tracer = Tracer()
+        self.step_numbers = None
+        self.stream_paths = set()
         self.result = None
+        self.results = list()
 
     @classmethod
-    def get_client(cls):
-        # Using boot2docker instructions for now
-        # http://docker-py.readthedocs.org/en/latest/boot2docker/
-        # Workaround for requests.exceptions.SSLError: hostname '192.168.59.103' doesn't match 'boot2docker'
-        client = Client(version='auto', **kwargs_from_env(assert_hostname=False))
-        return client
+    def get_client(cls, base_url=None):
+        return make_client(base_url)
 
     def run(self):
         if self.pipeline.debug:
             print "Running pipeline: {}".format(self)
-        for each_step in self.pipeline.steps:
-            if self.pipeline.pull_images:
-                self.pull_image(each_step)
-            container = self.create_container(each_step)
-            self.start_container(container, each_step)
-            self.result = self.get_result(container, each_step)
-            self.finish_container(container, each_step)
-            if self.result['code'] != 0:
-                # Container exited with nonzero status code
-                print "Error: step exited with code {}".format(self.result['code'])
-                # Pipeline breaks if nonzero result is encountered
-                break
+        if self.pipeline.intermediates:
+            self.scratch = ScratchCleaner(self.pipeline.steps, self.pipeline.intermediates, debug=self.pipeline.debug)
+            self.scratch.prepare()
+        if self.pipeline.preflight:
+            with self.tracer.span('preflight'):
+                self.pipeline.check_volumes()
+        if self.pipeline.pull_images:
+            # Pull all images up front, while the first steps run
+            for endpoint in self.endpoints:
+                self.get_prefetcher(endpoint).start([step.image for step in self.pipeline.steps])
+        if self.manifest is not None:
+            with self.tracer.span('fingerprint_inputs'):
+                inputs = self.get_fingerprinter().fingerprints(self.pipeline.inputs())
+        # Steps run as soon as the steps producing their infiles have finished
+        graph = StepGraph(self.pipeline.steps)
+        scheduler = self.make_scheduler(graph)
+        stream_paths = self.pipeline.stream_paths()
+        try:
+            self.make_streams(stream_paths)
+            self.results = scheduler.run()
+            if self.manifest is not None:
+                with self.tracer.span('fingerprint_outputs'):
+                    outputs = self.get_fingerprinter().fingerprints(self.pipeline.outputs())
+                write_manifest(self.manifest, self.pipeline, inputs, outputs,
+                               [scheduler.results.get(i) for i in range(len(self.pipeline.steps))])
+        finally:
+            self.remove_streams(stream_paths)
+            for prefetcher in self.prefetchers.values():
+                prefetcher.close()
+            if not self.shared_endpoints:
+                self.endpoints.close()
+            self.tracer.finish()
+            if self.history is not None:
+                self.history.save()
+        if scheduler.failed:
+            # Pipeline breaks if nonzero result is encountered
+            self.result = scheduler.results[scheduler.failed[0]]
+        elif self.results:
+            self.result = self.results[-1]
         if self.pipeline.debug:
             print 'Result: {}'.format(self.result)
 
-    def pull_image(self, step):
-        if self.pipeline.debug:
-            print 'Pulling image for step: {}'.format(step)
-        image_result = self.client.pull(step.image)
+    def get_fingerprinter(self):
+        if self.fingerprinter is None:
+            # Shares the cache's index, so files are only hashed again when they change
+            self.fingerprinter = self.cache.fingerprinter if self.cache is not None else Fingerprinter()
+        return self.fingerprinter
+
+    def make_scheduler(self, graph):
+        return Scheduler(graph, self.run_step, max_concurrency=self.concurrency, capacity=self.pipeline.capacity,
+                         priorities=self.priorities(graph))
+
+    def priorities(self, graph):
+        if self.history is None:
+            return None
+        return self.history.priorities(graph)
+
+    def run_step(self, step):
+        result, previous = self.check_journal(step)
+        if result is not None:
+            return self.finish_step(step, result)
+        attempt = 1
+        while True:
+            # Steps run on the least loaded Docker host that has their paths
+            with self.span('acquire_host', step):
+                endpoint = self.endpoints.acquire(step, url=previous[0] if previous else None)
+            try:
+                if self.pipeline.debug:
+                    print 'Running step {} on {}'.format(step, endpoint)
+                result = self.run_step_on(step, endpoint, previous)
+            finally:
+                self.endpoints.release(endpoint)
+            delay = self.retry_delay(step, result, attempt)
+            if delay is None:
+                break
+            time.sleep(delay)
+            attempt += 1
+            previous = None
+        if attempt > 1:
+            result['attempts'] = attempt
+        return self.finish_step(step, result)
+
+    def retry_delay(self, step, result, attempt):
+        '''
+        Decides whether a failed step runs again
+        :param step: the Step that ran
+        :param result: the result dict of its latest attempt
+        :param attempt: the number of the latest attempt, starting at 1
+        :return: seconds to wait before the next attempt, or None if the step is not retried
+        '''
+        if result['code'] == 0 or attempt > step.retries:
+            return None
+        delay = min(self.retry_seconds * 2 ** (attempt - 1), MAX_RETRY_SECONDS)
+        print 'Retrying step {} in {} seconds, attempt {} of {}'.format(step.name, delay, attempt + 1,
+                                                                       step.retries + 1)
+        return delay
+
+    def check_journal(self, step):
+        '''
+        Looks up a step in the journal of an earlier run
+        :param step: the Step to run
+        :return: tuple of the result if the step already succeeded, and the (host URL, container ID) of its
+                 container if it was still running
+        '''
+        if self.journal is None:
+            return None, None
+        step_number = self.step_number(step)
+        result = self.journal.completed(step_number, step)
+        if result is not None:
+            print 'step: {}\nimage: {}\nSkipped, completed in a previous run'.format(step.name, step.image)
+            return result, None
+        return None, self.journal.container(step_number, step)
+
+    def finish_step(self, step, result):
+        result['timings'] = self.tracer.step_timings(self.step_number(step))
+        # Steps resumed from the journal are already recorded there
+        if self.journal is not None and not result.get('resumed'):
+            self.journal.finished(self.step_number(step), step, result['code'])
+        if self.scratch is not None and result['code'] == 0:
+            self.scratch.finished(step)
+        if self.history is not None:
+            self.history.record(step, result)
+        if 'usage' in result:
+            with self.lock:
+                self.usage[self.step_number(step)] = result['usage']
+        return result
+
+    def step_number(self, step):
+        if self.step_numbers is None:
+            self.step_numbers = dict((id(each_step), i + 1) for i, each_step in enumerate(self.pipeline.steps))
+        return self.step_numbers.get(id(step), 0)
+
+    def span(self, phase, step):
+        return self.tracer.span(phase, step.name, self.step_number(step))
+
+    def run_step_on(self, step, endpoint, previous=None):
+        client = endpoint.client
+        container = self.reattach(step, endpoint, previous)
+        cache_key = None
+        if container is None:
+            result, cache_key = self.check_cache(step, endpoint)
+            if result is not None:
+                return result
+            container = self.launch_container(step, endpoint)
+        started = time.time()
+        if step.speculate and step.group is not None:
+            result = self.race(step, endpoint, container)
+        else:
+            result = self.get_result(container, step, client)
+            with self.span('finish_container', step):
+                self.finish_container(container, step, endpoint)
+        if result['code'] == 0 and step.group is not None:
+            with self.lock:
+                self.sibling_durations[step.group].append(time.time() - started)
+        return self.record_result(step, result, cache_key)
+
+    def race(self, step, endpoint, container):
+        '''
+        Waits for a shard's container, starting a speculative duplicate on a free slot if it runs far longer than
+        the median of the other shards of its scatter. The first container to succeed wins and the other is killed.
+        The duplicate writes its outfiles to staging directories, which are moved into place if it wins.
+        :param step: the Step, with speculate set
+        :param endpoint: the Endpoint the container runs on
+        :param container: the step's running container
+        :return: the result of the winning container, or of the original if neither succeeded
+        '''
+        finished = Queue.Queue()
+        racers = [(container, endpoint)]
+        self.start_racer(finished, 0, container, step, endpoint.client)
+        started = time.time()
+        results = dict()
+        winner = None
+        staged = dict()
+        try:
+            while len(results) < len(racers):
+                try:
+                    index, result, exc_info = finished.get(timeout=SPECULATE_POLL_SECONDS)
+                except Queue.Empty:
+                    if len(racers) == 1 and self.is_straggler(step, time.time() - started):
+                        duplicate = self.launch_duplicate(step, endpoint, time.time() - started)
+                        if duplicate is not None:
+                            duplicate_container, duplicate_endpoint, staged = duplicate
+                            racers.append((duplicate_container, duplicate_endpoint))
+                            self.start_racer(finished, 1, duplicate_container, step, duplicate_endpoint.client)
+                    continue
+                results[index] = (result, exc_info)
+                if winner is None and result is not None and result['code'] == 0:
+                    winner = index
+                    for other, (other_container, other_endpoint) in enumerate(racers):
+                        if other not in results:
+                            self.kill_container(other_container, step, other_endpoint.client)
+        finally:
+            with self.span('finish_container', step):
+                for racer_container, racer_endpoint in racers:
+                    self.finish_container(racer_container, step, racer_endpoint)
+            for _, racer_endpoint in racers[1:]:
+                self.endpoints.release(racer_endpoint)
+            self.unstage(staged, promote=winner == 1)
+        result, exc_info = results[winner if winner is not None else 0]
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        if winner == 1:
+            result['speculative'] = True
+        return result
+
+    def start_racer(self, finished, index, container, step, client):
+        thread = threading.Thread(target=self.wait_racer, args=(finished, index, container, step, client))
+        thread.daemon = True
+        thread.start()
+
+    def wait_racer(self, finished, index, container, step, client):
+        try:
+            finished.put((index, self.get_result(container, step, client, speculative=index > 0), None))
+        except Exception:
+            finished.put((index, None, sys.exc_info()))
+
+    def is_straggler(self, step, elapsed):
+        with self.lock:
+            durations = sorted(self.sibling_durations[step.group])
+        if len(durations) < MIN_SIBLINGS:
+            return False
+        return elapsed > step.speculate * durations[len(durations) // 2]
+
+    def launch_duplicate(self, step, endpoint, elapsed):
+        '''
+        Starts a second container for a straggling step, preferably on another host
+        :return: tuple of the container, its Endpoint and the dict of its staged outfiles to the step's outfiles,
+                 or None if no host has a free slot
+        '''
+        duplicate_endpoint = self.endpoints.try_acquire(step, avoid=endpoint)
+        if duplicate_endpoint is None:
+            return None
+        print 'Step {} has run for {:.0f} seconds, starting a speculative duplicate'.format(step.name, elapsed)
+        staged = dict()
+        try:
+            duplicate, staged = self.stage_duplicate(step)
+            # The journal keeps the original container, which is the one to reattach to on resume
+            container = self.create_container(duplicate, duplicate_endpoint.client, name=self.container_name(step))
+            self.start_container(container, duplicate, duplicate_endpoint.client)
+        except Exception:
+            self.endpoints.release(duplicate_endpoint)
+            self.unstage(staged)
+            raise
+        return container, duplicate_endpoint, staged
+
+    def stage_duplicate(self, step):
+        '''
+        Copies a step to write its outfiles to a staging directory inside each output directory, so a speculative
+        duplicate does not write the files the original container is writing
+        :param step: the Step to duplicate
+        :return: tuple of the copied Step, and dict of its staged outfiles to the step's outfiles
+        '''
+        staging_dirs = dict()
+        outfiles = dict()
+        try:
+            for label, path in step.outfiles.iteritems():
+                dirname, basename = os.path.split(path)
+                if dirname not in staging_dirs:
+                    staging_dirs[dirname] = tempfile.mkdtemp(prefix='.speculative-', dir=dirname)
+                    # Containers write as whichever user the output directory allows
+                    os.chmod(staging_dirs[dirname], stat.S_IMODE(os.stat(dirname).st_mode))
+                outfiles[label] = os.path.join(staging_dirs[dirname], basename)
+        except Exception:
+            for staging_dir in staging_dirs.values():
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        duplicate = step.with_files(step.name, step.shard, step.infiles, outfiles, step.parameters)
+        return duplicate, dict((outfiles[label], path) for label, path in step.outfiles.iteritems())
+
+    def unstage(self, staged, promote=False):
+        '''
+        Removes the staging directories of a speculative duplicate
+        :param staged: dict of staged outfiles to the step's outfiles
+        :param promote: if True, the staged outfiles first replace the step's outfiles
+        '''
+        if promote:
+            for staged_path, path in staged.iteritems():
+                if os.path.exists(staged_path):
+                    os.rename(staged_path, path)
+        for staging_dir in set(os.path.dirname(staged_path) for staged_path in staged):
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def launch_container(self, step, endpoint):
+        client = endpoint.client
+        with self.span('create_container', step):
+            container = self.create_container(step, client)
+        with self.span('start_container', step):
+            self.start_container(container, step, client)
+        if self.journal is not None:
+            self.journal.started(self.step_number(step), step, endpoint.url, container)
+        return container
+
+    def reattach(self, step, endpoint, previous):
+        '''
+        Checks whether the container a step ran in during an earlier run can be attached to again
+        :param step: the Step to run
+        :param endpoint: the Endpoint the step runs on
+        :param previous: (host URL, container ID) from the journal, or None
+        :return: the container ID, or None if the step must be started again
+        '''
+        if previous is None or previous[0] != endpoint.url:
+            return None
+        try:
+            endpoint.client.inspect_container(previous[1])
+        except APIError:
+            print 'Container {} for step {} no longer exists, starting it again'.format(previous[1], step.name)
+            return None
+        print 'Reattaching to container {} for step {}'.format(previous[1], step.name)
+        return previous[1]
+
+    def check_cache(self, step, endpoint):
+        '''
+        Pulls the step's image if needed, and looks up the step in the cache
+        :param step: the Step to run
+        :param endpoint: the Endpoint the step runs on
+        :return: tuple of the cached result, or None if the step must run, and the key to store its result under
+        '''
+        client = endpoint.client
+        image_id = None
+        if self.pipeline.pull_images:
+            with self.span('pull_image', step):
+                image_id = self.pull_image(step, endpoint)
+        cache_key = None
+        # Steps connected by streams have nothing on disk to compare, so they always run
+        uses_streams = not self.stream_paths.isdisjoint(step.allfiles.values())
+        if self.cache is not None and not uses_streams:
+            result = None
+            with self.span('cache_lookup', step):
+                image_id = image_id or self.resolve_image(step, client)
+                if image_id is not None:
+                    cache_key = self.cache.key(step, image_id)
+                    result = self.cache.lookup(cache_key, step)
+            if result is not None:
+                print 'step: {}\nimage: {}\nSkipped, outfiles are up to date'.format(step.name, step.image)
+                result['cached'] = True
+                return result, cache_key
+        return None, cache_key
+
+    def record_result(self, step, result, cache_key):
+        if result['code'] != 0:
+            # Container exited with nonzero status code
+            print "Error: step exited with code {}".format(result['code'])
+            if 'log_files' in result:
+                # Output went to log files, so show the end of it here
+                print 'Last output of step {}:\n{}'.format(step.name, result['logs'])
+                print 'Full output in {}'.format(', '.join(sorted(set(result['log_files'].values()))))
+        elif cache_key is not None:
+            self.cache.store(cache_key, step, result)
+        return result
+
+    def make_streams(self, paths):
+        '''
+        Creates a named pipe for each streamed outfile, so the writing and reading steps run at the same time
+        :param paths: host paths of the streams
+        '''
+        self.stream_paths = set(paths)
+        for path in paths:
+            if os.path.exists(path):
+                if not stat.S_ISFIFO(os.stat(path).st_mode):
+                    raise Exception('ERROR: Stream {} already exists and is not a named pipe'.format(path))
+                continue
+            if self.pipeline.debug:
+                print 'Creating stream {}'.format(path)
+            os.mkfifo(path)
+
+    def remove_streams(self, paths):
+        for path in paths:
+            if os.path.exists(path) and stat.S_ISFIFO(os.stat(path).st_mode):
+                os.remove(path)
+
+    def resolve_image(self, step, client=None):
+        '''
+        Looks up the ID of a step's image on the Docker host
+        :param step: a Step
+        :param client: docker Client for the host, defaults to the first host
+        :return: the image ID, or None if the image is not available locally
+        '''
+        client = client or self.client
+        # Images are resolved once per host and run, however many steps (such as the shards of a scatter) use them
+        key = (id(client), step.image)
+        if key not in self.image_ids:
+            try:
+                self.image_ids[key] = client.inspect_image(step.image)['Id']
+            except APIError:
+                return None
+        return self.image_ids[key]
+
+    def pull_image(self, step, endpoint=None):
         if self.pipeline.debug:
-            print image_result
+            print 'Waiting for image for step: {}'.format(step)
+        return self.get_prefetcher(endpoint or self.endpoints.endpoints[0]).wait(step.image)
 
-    def create_container(self, step):
+    def get_prefetcher(self, endpoint):
+        with self.lock:
+            if endpoint.url not in self.prefetchers:
+                self.prefetchers[endpoint.url] = ImagePrefetcher(endpoint.client,
+                                                                 policy=self.pipeline.pull_policy,
+                                                                 ttl=self.pipeline.pull_ttl,
+                                                                 debug=self.pipeline.debug)
+            return self.prefetchers[endpoint.url]
+
+    def create_container(self, step, client=None, name=None):
+        client = client or self.client
         if self.pipeline.debug:
             print 'Creating container for step: {}'.format(step)
             print 'Image: {}'.format(step.image)
             print 'Volumes: {}'.format(step.get_volumes())
             print 'Environment: {}'.format(step.environment)
-        container = self.client.create_container(step.image,
-                                                 command=step.command,
-                                                 environment=step.environment,
-                                                 volumes=step.get_volumes())
+            print 'Resources: {} cpus, {} bytes memory'.format(step.cpus, step.memory)
+        # cpus is applied as a relative cpu weight, 1024 shares per cpu
+        cpu_shares = int(step.cpus * 1024) if step.cpus else None
+        container = client.create_container(step.image,
+                                            name=name or self.container_name(step),
+                                            command=step.command,
+                                            environment=step.environment,
+                                            volumes=step.get_volumes(),
+                                            mem_limit=step.memory or 0,
+                                            cpu_shares=cpu_shares)
         return container
 
-    def start_container(self, container, step):
+    def container_name(self, step):
+        return '{}{}-{:03d}-{}'.format(CONTAINER_PREFIX, self.run_id, self.step_number(step),
+                                       next(self.container_numbers))
+
+    def start_container(self, container, step, client=None):
+        client = client or self.client
         if self.pipeline.debug:
             print 'Running container for step {}'.format(step)
             print 'Binds: {}'.format(step.binds)
         # client.start does not return anything
-        self.client.start(container, binds=step.binds)
+        client.start(container, binds=step.binds)
+
+    def get_result(self, container, step, client=None, speculative=False):
+        client = client or self.client
+        step_log = self.open_log(step, speculative)
+        print 'step: {}{}\nimage: {}\n==============='.format(step.name, ' (speculative)' if speculative else '',
+                                                            step.image)
+        timer = self.start_timer(container, step, client)
+        sampler = self.start_sampler(container, client)
+        usage = None
+        try:
+            with self.span('logs', step):
+                if self.pipeline.separate_stderr:
+                    stderr = client.attach(container, stdout=False, stderr=True, stream=True, logs=True)
+                    stderr_thread = threading.Thread(target=self.stream_log, args=(stderr, step_log, 'stderr'))
+                    stderr_thread.start()
+                    stdout = client.attach(container, stdout=True, stderr=False, stream=True, logs=True)
+                    self.stream_log(stdout, step_log, 'stdout')
+                    stderr_thread.join()
+                else:
+                    logs = client.attach(container, stream=True, logs=True)
+                    self.stream_log(logs, step_log, 'stdout')
+            # Store the return value
+            with self.span('wait', step):
+                code = client.wait(container)
+        finally:
+            step_log.close()
+            if timer is not None:
+                timer.cancel()
+            if sampler is not None:
+                usage = sampler.stop()
+        result = self.make_result(step, code, step_log, container)
+        if usage is not None:
+            result['usage'] = usage
+        return result
+
+    def start_sampler(self, container, client):
+        if self.pipeline.stats_interval is None:
+            return None
+        return StatsSampler(client, container, self.pipeline.stats_interval, debug=self.pipeline.debug).start()
+
+    def start_timer(self, container, step, client):
+        if step.timeout is None:
+            return None
+        timer = threading.Timer(step.timeout, self.expire, args=(container, step, client))
+        timer.daemon = True
+        timer.start()
+        return timer
 
-    def get_result(self, container, step):
-        logs = self.client.attach(container, stream=True, logs=True)
-        result = {'image': step.image}
-        print 'step: {}\nimage: {}\n==============='.format(step.name, step.image)
-        all_logs = str()
+    def expire(self, container, step, client):
+        print 'Step {} timed out after {} seconds, killing its container'.format(step.name, step.timeout)
+        with self.lock:
+            self.timed_out.add(Runner.container_id(container))
+        self.kill_container(container, step, client)
+
+    def kill_container(self, container, step, client):
+        try:
+            client.kill(container)
+        except APIError as e:
+            # The container may have exited on its own in the meantime
+            if self.pipeline.debug:
+                print 'Could not kill container for step {}: {}'.format(step.name, e)
+
+    @classmethod
+    def container_id(cls, container):
+        return container.get('Id') if isinstance(container, dict) else container
+
+    def make_result(self, step, code, step_log, container=None):
+        result = {'image': step.image, 'code': code}
+        with self.lock:
+            if Runner.container_id(container) in self.timed_out:
+                self.timed_out.discard(Runner.container_id(container))
+                result['timed_out'] = True
+        # Only the end of the output is kept in memory
+        result['logs'] = step_log.tail('stdout')
+        if self.pipeline.separate_stderr:
+            result['stderr'] = step_log.tail('stderr')
+        if step_log.paths:
+            result['log_files'] = step_log.paths
+        if isinstance(step, FusedStep):
+            # Each step that ran in the shared container is reported separately
+            result['steps'] = step_log.results()
+        return result
+
+    def open_log(self, step, speculative=False):
+        prefix = '{:03d}-{}{}'.format(self.step_number(step), step.name, '.speculative' if speculative else '')
+        if isinstance(step, FusedStep):
+            return FusedStepLog(step, log_dir=self.pipeline.log_dir, prefix=prefix,
+                                compress=self.pipeline.compress_logs,
+                                separate_stderr=self.pipeline.separate_stderr)
+        return StepLog(self.pipeline.log_dir, prefix=prefix,
+                       compress=self.pipeline.compress_logs,
+                       separate_stderr=self.pipeline.separate_stderr)
+
+    def stream_log(self, logs, step_log, stream):
         for log in logs:
-            all_logs = all_logs + log
+            self.write_log(log, step_log, stream)
+
+    def write_log(self, log, step_log, stream):
+        step_log.write(log, stream)
+        if self.pipeline.log_dir is None:
+            # Without log files, output goes to the console
             print log,
-        # Store the return value
-        code = self.client.wait(container)
-        result['code'] = code
-        return result
 
-    def finish_container(self, container, step):
+    def finish_container(self, container, step, endpoint=None):
+        endpoint = endpoint or self.endpoints.endpoints[0]
         if self.pipeline.debug:
             print 'Cleaning up container for step {}'.format(step)
         if self.remove_containers:
-            self.client.remove_container(container)
+            # Removal can take seconds on a busy host, so it happens in the background
+            self.get_reaper(endpoint).remove(container)
+
+    def report(self):
+        '''
+        Summarizes the run: the tracer's report, with each step's declared resources and sampled usage
+        '''
+        report = self.tracer.report()
+        steps = dict((self.step_number(step), step) for step in self.pipeline.steps)
+        with self.lock:
+            usage = dict(self.usage)
+        for step_report in report['steps']:
+            step = steps.get(step_report['number'])
+            if step is not None:
+                step_report['cpus'] = step.cpus
+                step_report['memory'] = step.memory
+            if step_report['number'] in usage:
+                step_report['usage'] = usage[step_report['number']]
+        return report
+
+    def write_report(self, path):
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+    def get_reaper(self, endpoint):
+        with self.endpoints.condition:
+            if endpoint.reaper is None:
+                endpoint.reaper = ContainerReaper(endpoint.client, debug=self.pipeline.debug)
+            return endpoint.reaper
@@ -0,0 +1,335 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from Queue import Queue
+import heapq
+import sys
+import threading
+
+RESOURCES = ('cpus', 'memory')
+
+
+class StepGraph():
+    def __init__(self, steps=[]):
+        self.steps = steps
+        self.dependencies, self.stream_dependencies = StepGraph.make_dependencies_dicts(steps)
+        self.dependents = StepGraph.make_dependents_dict(self.dependencies)
+        self.stream_dependents = StepGraph.make_dependents_dict(self.stream_dependencies)
+        self.reader_dependencies = StepGraph.make_reader_dependencies_dict(steps, self.dependencies,
+                                                                          self.stream_dependencies)
+        self.reader_dependents = StepGraph.make_dependents_dict(self.reader_dependencies)
+
+    @classmethod
+    def make_dependencies_dicts(cls, steps=[]):
+        '''
+        Creates dictionaries, mapping each step index to the indices of earlier steps it must wait for.
+
+        A step depends on an earlier step when one of its infiles is an earlier outfile. A step that
+        writes a path an earlier step reads or writes also waits, so the earlier step sees the file
+        it would have seen when running in order.
+
+        An infile that an earlier step writes as a stream is a stream dependency instead: the step
+        must start once the earlier step has started, rather than after it finishes.
+
+        :param steps: a list of Steps, in pipeline order
+        :return: tuple of dictionaries of step index to a set of step indices: (dependencies, stream dependencies)
+        '''
+        writers = dict()
+        readers = dict()
+        dependencies = dict()
+        stream_dependencies = dict()
+        for i, step in enumerate(steps):
+            depends_on = set()
+            streams_from = set()
+            for path in step.infiles.values():
+                if path in writers:
+                    if path in steps[writers[path]].stream_paths:
+                        streams_from.add(writers[path])
+                    else:
+                        depends_on.add(writers[path])
+            for path in step.outfiles.values():
+                if path in writers:
+                    depends_on.add(writers[path])
+                depends_on.update(readers.get(path, set()))
+            depends_on.discard(i)
+            dependencies[i] = depends_on
+            stream_dependencies[i] = streams_from - depends_on
+            for path in step.infiles.values():
+                readers.setdefault(path, set()).add(i)
+            for path in step.outfiles.values():
+                writers[path] = i
+                readers[path] = set()
+        return dependencies, stream_dependencies
+
+    @classmethod
+    def make_reader_dependencies_dict(cls, steps, dependencies, stream_dependencies):
+        '''
+        Creates a dictionary, mapping each step writing a stream to the steps that must finish before its reader
+        can start. The writer blocks until the stream is opened, so it must not start before its reader can.
+
+        :param steps: a list of Steps, in pipeline order
+        :param dependencies: dictionary of step index to the indices of steps it must wait for
+        :param stream_dependencies: dictionary of step index to the indices of steps whose streams it reads
+        :return: dictionary of step index to a set of step indices
+        '''
+        reader_dependencies = dict((i, set()) for i in dependencies)
+        # Readers come after their writers, so a reader that also writes a stream is handled first
+        for reader in sorted(stream_dependencies, reverse=True):
+            for writer in stream_dependencies[reader]:
+                reader_dependencies[writer].update(dependencies[reader], reader_dependencies[reader])
+        for writer, waits_for in reader_dependencies.iteritems():
+            if StepGraph.reaches(dependencies, waits_for, writer):
+                raise ValueError('The reader of a stream written by step {} waits for a step that needs {} to finish'
+                                 .format(steps[writer].name, steps[writer].name))
+        return reader_dependencies
+
+    @classmethod
+    def reaches(cls, dependencies, starts, target):
+        # Whether the target is among the starts or their dependencies. Steps only depend on earlier steps
+        seen = set()
+        pending = [i for i in starts if i >= target]
+        while pending:
+            i = pending.pop()
+            if i == target:
+                return True
+            if i not in seen:
+                seen.add(i)
+                pending.extend(j for j in dependencies[i] if j >= target)
+        return False
+
+    @classmethod
+    def make_dependents_dict(cls, dependencies):
+        dependents = dict((i, set()) for i in dependencies)
+        for i, depends_on in dependencies.iteritems():
+            for j in depends_on:
+                dependents[j].add(i)
+        return dependents
+
+    def remaining(self, durations):
+        '''
+        Finds the longest path from each step to the end of the pipeline
+        :param durations: dict of step index to estimated seconds
+        :return: dict of step index to the seconds from the step starting until its last dependent finishes
+        '''
+        remaining = dict()
+        # Steps only depend on earlier steps, so every dependent is done before the steps it depends on
+        for i in reversed(range(len(self.steps))):
+            remaining[i] = durations[i] + max([remaining[j] for j in self.dependents[i]] or [0])
+        return remaining
+
+    def critical_path(self, durations):
+        '''
+        :param durations: dict of step index to estimated seconds
+        :return: list of the step indices on the longest path through the pipeline
+        '''
+        if not self.steps:
+            return []
+        remaining = self.remaining(durations)
+        path = [max(range(len(self.steps)), key=lambda i: (remaining[i], -i))]
+        while self.dependents[path[-1]]:
+            path.append(max(self.dependents[path[-1]], key=lambda i: (remaining[i], -i)))
+        return path
+
+
+class Scheduler():
+    def __init__(self, graph, run_step, max_concurrency=1, succeeded=None, capacity=None, priorities=None):
+        '''
+        Runs the steps of a StepGraph, starting every ready step as soon as a slot is available
+        :param graph: a StepGraph
+        :param run_step: callable taking a Step and returning its result dict
+        :param max_concurrency: maximum number of steps to run at the same time
+        :param succeeded: callable taking a result and returning True if downstream steps may run
+        :param capacity: dict of total 'cpus' and 'memory' (bytes) that running steps may declare.
+                         Steps that do not declare a resource are not limited by it
+        :param priorities: dict of step index to priority. Ready steps with higher priority start first
+        '''
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency must be at least 1')
+        self.graph = graph
+        self.run_step = run_step
+        self.max_concurrency = max_concurrency
+        self.succeeded = succeeded or (lambda result: result['code'] == 0)
+        self.capacity = capacity or dict()
+        self.priorities = priorities
+        self.in_use = dict((resource, 0) for resource in RESOURCES)
+        self.results = dict()
+        self.failed = list()
+
+    def priority(self, i):
+        # Ready steps are started by priority, then in pipeline order
+        if self.priorities is None:
+            return (0, i)
+        return (-self.priorities.get(i, 0), i)
+
+    def run(self):
+        '''
+        Runs all steps. Once a step fails no further steps are started, other than readers of streams
+        being written by running steps; running steps are allowed to finish.
+        :return: a list of results, in the order the steps finished
+        '''
+        completed = Queue()
+        self.start_run()
+        while True:
+            self.start_ready(lambda i: self.start_thread(i, completed))
+            if self.running == 0:
+                break
+            self.complete(*completed.get())
+        return self.finish_run()
+
+    def simulate(self, durations):
+        '''
+        Predicts when each step would start and finish, if every step succeeds in its estimated time
+        :param durations: dict of step index to estimated seconds
+        :return: dict of step index to a (start, end) tuple of seconds from the start of the run
+        '''
+        times = dict()
+        ends = []
+
+        def start(i):
+            times[i] = (self.now, self.now + durations[i])
+            heapq.heappush(ends, (self.now + durations[i], i))
+
+        self.now = 0
+        self.start_run()
+        while True:
+            self.start_ready(start)
+            if not ends:
+                break
+            self.now, i = heapq.heappop(ends)
+            self.complete(i, {'code': 0})
+        self.finish_run()
+        return times
+
+    def start_run(self):
+        self.finished = set()
+        self.started = set()
+        self.running = 0
+        self.completed_results = list()
+        self.error = None
+        # A step is ready once its dependencies have finished and its stream dependencies have started. A step
+        # writing a stream also waits for its reader's dependencies. Counting what each step still waits for keeps
+        # every completion proportional to its dependents.
+        self.waiting_on = dict((i, len(self.graph.dependencies[i]) + len(self.graph.stream_dependencies[i]) +
+                                len(self.graph.reader_dependencies[i]))
+                               for i in range(len(self.graph.steps)))
+        # Heaps of (priority, index). Readers of streams are kept apart, since they start without a free slot
+        self.ready = list()
+        self.ready_readers = list()
+        for i, count in sorted(self.waiting_on.iteritems()):
+            if count == 0:
+                self.make_ready(i)
+
+    def make_ready(self, i):
+        heapq.heappush(self.ready_readers if self.graph.stream_dependencies[i] else self.ready, (self.priority(i), i))
+
+    def satisfy(self, dependents):
+        for j in dependents:
+            self.waiting_on[j] -= 1
+            if self.waiting_on[j] == 0:
+                self.make_ready(j)
+
+    def has_slot(self):
+        return not self.failed and self.error is None and self.running < self.max_concurrency
+
+    def start_ready(self, start):
+        '''
+        Starts every ready step that may be admitted
+        :param start: callable taking a step index, which starts the step and arranges for complete() to be called
+        '''
+        skipped = list()
+        while True:
+            if self.ready_readers:
+                entry = heapq.heappop(self.ready_readers)
+            elif self.ready and self.has_slot():
+                entry = heapq.heappop(self.ready)
+            else:
+                break
+            i = entry[1]
+            if not self.admit(i):
+                skipped.append(i)
+                continue
+            self.started.add(i)
+            self.running += 1
+            self.reserve(self.graph.steps[i], 1)
+            # Steps reading its streams are ready as soon as it starts
+            self.satisfy(self.graph.stream_dependents[i])
+            start(i)
+        for i in skipped:
+            self.make_ready(i)
+
+    def complete(self, i, result, exc_info=None):
+        self.running -= 1
+        self.reserve(self.graph.steps[i], -1)
+        if exc_info is not None:
+            self.error = self.error or exc_info
+            return
+        self.results[i] = result
+        self.completed_results.append(result)
+        if self.succeeded(result):
+            self.finished.add(i)
+            self.satisfy(self.graph.dependents[i])
+            self.satisfy(self.graph.reader_dependents[i])
+        else:
+            self.failed.append(i)
+
+    def finish_run(self):
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.completed_results
+
+    def admit(self, i):
+        # A step reading a stream must start, or the running step writing it would block
+        if self.graph.stream_dependencies[i]:
+            return True
+        if self.failed or self.error is not None:
+            return False
+        if self.running >= self.max_concurrency:
+            return False
+        # A step that would exceed capacity waits, but smaller steps behind it may start
+        return self.running == 0 or self.fits(self.graph.steps[i])
+
+    def fits(self, step):
+        for resource in RESOURCES:
+            limit = self.capacity.get(resource)
+            needed = getattr(step, resource)
+            if limit is not None and needed and self.in_use[resource] + needed > limit:
+                return False
+        return True
+
+    def reserve(self, step, sign):
+        for resource in RESOURCES:
+            self.in_use[resource] += sign * (getattr(step, resource) or 0)
+
+    def start_thread(self, i, completed):
+        step = self.graph.steps[i]
+
+        def target():
+            try:
+                completed.put((i, self.run_step(step), None))
+            except Exception:
+                completed.put((i, None, sys.exc_info()))
+
+        thread = threading.Thread(target=target, name=step.name)
+        thread.daemon = True
+        thread.start()
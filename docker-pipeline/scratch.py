@@ -0,0 +1,101 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import shutil
+import threading
+
+
+def place_intermediates(steps, scratch_dir, keep=None):
+    '''
+    Moves intermediate files, which are written by one step and read by later steps, to scratch storage.
+    Only the order of the steps is considered: a file that some step reads before any step writes it is an input of
+    the pipeline, so it stays where it is. Whether a file exists is not checked.
+    :param steps: the pipeline's Steps, in pipeline order
+    :param scratch_dir: directory on fast local storage, such as a tmpfs or local SSD
+    :param keep: paths to leave in place even though they are intermediates
+    :return: tuple of the list of steps with intermediates moved, and a dict of scratch path to original path
+    '''
+    written = set()
+    read_first = set()
+    consumed = set()
+    streams = set()
+    for step in steps:
+        for path in step.infiles.values():
+            (consumed if path in written else read_first).add(path)
+        written.update(step.outfiles.values())
+        streams.update(step.stream_paths)
+    # Streams are named pipes rather than files, so there is nothing to move
+    intermediates = consumed - read_first - streams - set(keep or [])
+    paths = dict((path, os.path.join(scratch_dir, path.lstrip('/'))) for path in intermediates)
+    relocated = list()
+    for step in steps:
+        if paths.viewkeys() & set(step.allfiles.values()):
+            step = step.relocated(paths)
+        relocated.append(step)
+    return relocated, dict((scratch_path, path) for path, scratch_path in paths.iteritems())
+
+
+class ScratchCleaner():
+    def __init__(self, steps, intermediates, debug=False):
+        '''
+        Deletes intermediate files from scratch storage once every step reading them has succeeded
+        :param steps: the pipeline's Steps, after place_intermediates
+        :param intermediates: dict of scratch path to original path, from place_intermediates
+        '''
+        self.intermediates = intermediates
+        self.debug = debug
+        # A fused step both writes and reads the intermediates passed between its sub-steps
+        self.readers = dict((path, set(id(step) for step in steps if path in step.allfiles.values()))
+                            for path in intermediates)
+        self.lock = threading.Lock()
+
+    def prepare(self):
+        # Docker would create missing directories owned by root, so they are created here first
+        for path in self.intermediates:
+            dirname = os.path.dirname(path)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+
+    def finished(self, step):
+        '''
+        Records that a step succeeded, deleting the intermediates it was the last to read
+        :param step: the Step that succeeded
+        '''
+        unread = list()
+        with self.lock:
+            for path, readers in self.readers.items():
+                if id(step) in readers:
+                    readers.discard(id(step))
+                    if not readers:
+                        unread.append(path)
+                        del self.readers[path]
+        for path in unread:
+            if self.debug:
+                print 'Deleting intermediate {} ({})'.format(path, self.intermediates[path])
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
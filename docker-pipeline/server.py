@@ -0,0 +1,353 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn, UnixStreamServer
+from Queue import Queue
+from cache import StepCache
+from collections import OrderedDict, defaultdict
+from endpoints import EndpointPool
+from history import DEFAULT_HISTORY, StepHistory
+from pipeline_cache import load_pipeline_contents
+from runner import Runner
+from utils import extract_var_map
+import argparse
+import httplib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+DEFAULT_SOCKET = '~/.docker-pipeline/server.sock'
+# Finished runs kept for status requests. The oldest are forgotten first
+MAX_FINISHED_RUNS = 1000
+# Seconds between status checks of submit --wait
+WAIT_POLL_SECONDS = 1
+
+
+class PipelineRun():
+    def __init__(self, pipeline):
+        '''
+        A pipeline submitted to the server, and its progress
+        :param pipeline: the parsed Pipeline
+        '''
+        self.id = uuid.uuid4().hex[:12]
+        self.pipeline = pipeline
+        self.state = 'queued'
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.code = None
+        self.error = None
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.pipeline.name, 'state': self.state, 'submitted': self.submitted,
+                'started': self.started, 'finished': self.finished, 'code': self.code, 'error': self.error}
+
+
+class ServerHandler(BaseHTTPRequestHandler):
+    '''
+    The server's HTTP API:
+    POST /runs with a JSON body of 'yaml' (the pipeline YAML) and 'vars' (dict of variables) queues a run
+    GET /runs lists the runs, and GET /runs/<id> reports one
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return 'local'
+
+    def log_message(self, format, *args):
+        if self.server.pipeline_server.debug:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, code, body):
+        body = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server.pipeline_server
+        parts = self.path.strip('/').split('/')
+        if parts == ['runs']:
+            self.send_json(200, [run.to_dict() for run in server.list_runs()])
+        elif len(parts) == 2 and parts[0] == 'runs' and server.get_run(parts[1]) is not None:
+            self.send_json(200, server.get_run(parts[1]).to_dict())
+        else:
+            self.send_json(404, {'error': 'Not found: {}'.format(self.path)})
+
+    def do_POST(self):
+        server = self.server.pipeline_server
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        if self.path.strip('/') != 'runs':
+            self.send_json(404, {'error': 'Not found: {}'.format(self.path)})
+            return
+        try:
+            request = json.loads(body)
+            run = server.submit(request['yaml'], request.get('vars') or {})
+        except Exception as e:
+            # Invalid pipelines are reported to the submitter rather than queued
+            self.send_json(400, {'error': '{}: {}'.format(type(e).__name__, e)})
+            return
+        self.send_json(202, run.to_dict())
+
+
+class ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class PipelineServer():
+    def __init__(self, socket_path=DEFAULT_SOCKET, workers=2, concurrency=None, cache_dir=None, compiled_dir=None,
+                 log_dir=None, history_path=DEFAULT_HISTORY, client=None, debug=False):
+        '''
+        Runs submitted pipelines from one long-running process, so each run starts without the cost of starting
+        Python, importing docker-py and connecting to the Docker hosts
+        :param socket_path: path of the unix socket to serve the HTTP API on
+        :param workers: maximum number of pipelines to run at the same time
+        :param concurrency: maximum number of steps to run at the same time per pipeline, overriding the pipeline
+        :param cache_dir: directory for cached step results, shared by all runs
+        :param compiled_dir: directory for parsed pipelines, see pipeline_cache
+        :param log_dir: directory to write step output to, in a subdirectory per run
+        :param history_path: file of past step durations, or None to not use history
+        :param client: docker Client to use for pipelines without hosts, instead of connecting to DOCKER_HOST
+        :param debug: log each request
+        '''
+        self.socket_path = os.path.expanduser(socket_path)
+        self.workers = workers
+        self.concurrency = concurrency
+        self.cache = StepCache(cache_dir) if cache_dir is not None else None
+        self.compiled_dir = compiled_dir
+        self.log_dir = log_dir
+        self.history = StepHistory(history_path) if history_path is not None else None
+        self.client = client
+        self.debug = debug
+        self.queue = Queue()
+        self.runs = OrderedDict()
+        # Endpoint pools by the pipeline's hosts. Their clients stay connected between runs
+        self.endpoint_pools = dict()
+        self.lock = threading.Lock()
+        self.server = None
+        self.threads = list()
+
+    def submit(self, yaml_contents, var_map):
+        '''
+        Parses a pipeline and queues it to run
+        :param yaml_contents: the pipeline YAML
+        :param var_map: dict of variables for !var tags
+        :return: the queued PipelineRun
+        '''
+        pipeline = load_pipeline_contents(yaml_contents, defaultdict(lambda: None, var_map),
+                                          cache_dir=self.compiled_dir)
+        run = PipelineRun(pipeline)
+        with self.lock:
+            self.runs[run.id] = run
+        self.queue.put(run)
+        return run
+
+    def get_run(self, run_id):
+        with self.lock:
+            return self.runs.get(run_id)
+
+    def list_runs(self):
+        with self.lock:
+            return self.runs.values()
+
+    def get_endpoints(self, pipeline):
+        key = json.dumps([pipeline.host, pipeline.hosts], sort_keys=True)
+        with self.lock:
+            if key not in self.endpoint_pools:
+                self.endpoint_pools[key] = EndpointPool.from_pipeline(pipeline, client=self.client)
+            return self.endpoint_pools[key]
+
+    def work(self):
+        while True:
+            run = self.queue.get()
+            if run is None:
+                return
+            self.run_pipeline(run)
+
+    def run_pipeline(self, run):
+        pipeline = run.pipeline
+        if self.log_dir is not None and pipeline.log_dir is None:
+            pipeline.log_dir = os.path.join(self.log_dir, run.id)
+        run.state = 'running'
+        run.started = time.time()
+        try:
+            runner = Runner(pipeline, concurrency=self.concurrency, cache=self.cache,
+                            endpoints=self.get_endpoints(pipeline))
+            runner.history = self.history
+            runner.run()
+            run.code = runner.result['code'] if runner.result is not None else 0
+            run.state = 'succeeded' if run.code == 0 else 'failed'
+        except Exception as e:
+            traceback.print_exc()
+            run.error = '{}: {}'.format(type(e).__name__, e)
+            run.state = 'error'
+        run.finished = time.time()
+        self.forget_finished()
+
+    def forget_finished(self):
+        with self.lock:
+            finished = [run_id for run_id, run in self.runs.iteritems() if run.finished is not None]
+            for run_id in finished[:max(0, len(finished) - MAX_FINISHED_RUNS)]:
+                del self.runs[run_id]
+
+    def start(self):
+        dirname = os.path.dirname(self.socket_path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        if os.path.exists(self.socket_path):
+            # Left behind by a server that did not shut down cleanly
+            os.remove(self.socket_path)
+        self.server = ThreadingUnixServer(self.socket_path, ServerHandler)
+        # Anyone who can connect can run containers, so only the owner may
+        os.chmod(self.socket_path, 0600)
+        self.server.pipeline_server = self
+        targets = [self.work] * self.workers + [self.server.serve_forever]
+        for target in targets:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def close(self):
+        '''
+        Stops accepting submissions, finishes the runs already queued, and disconnects from the Docker hosts
+        '''
+        self.server.shutdown()
+        self.server.server_close()
+        for _ in range(self.workers):
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        for endpoints in self.endpoint_pools.values():
+            endpoints.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, socket_path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def request(socket_path, method, path, body=None):
+    '''
+    Sends a request to a running server
+    :param socket_path: path of the server's unix socket
+    :param method: HTTP method
+    :param path: request path, e.g. /runs
+    :param body: object to send as JSON, or None
+    :return: tuple of the HTTP status and the decoded JSON response
+    '''
+    connection = UnixHTTPConnection(os.path.expanduser(socket_path))
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def submit(socket_path, yaml_file, var_map, wait=False):
+    with open(yaml_file, 'r') as f:
+        status, run = request(socket_path, 'POST', '/runs', {'yaml': f.read(), 'vars': var_map})
+    if status != 202:
+        print 'Error: {}'.format(run['error'])
+        return 1
+    print 'Submitted run {}'.format(run['id'])
+    while wait and run['finished'] is None:
+        time.sleep(WAIT_POLL_SECONDS)
+        _, run = request(socket_path, 'GET', '/runs/{}'.format(run['id']))
+    if wait:
+        print 'Run {} {}'.format(run['id'], run['state'])
+        return 0 if run['state'] == 'succeeded' else 1
+    return 0
+
+
+def print_status(socket_path, run_id=None):
+    status, runs = request(socket_path, 'GET', '/runs/{}'.format(run_id) if run_id else '/runs')
+    if status != 200:
+        print 'Error: {}'.format(runs['error'])
+        return 1
+    for run in runs if run_id is None else [runs]:
+        print '{}\t{}\t{}'.format(run['id'], run['state'], run['name'])
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run pipelines from a long-running server, or submit them to it')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket of the server')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve', help='Start the server')
+    serve_parser.add_argument('--workers', type=int, default=2,
+                              help='Maximum number of pipelines to run at the same time')
+    serve_parser.add_argument('--concurrency', type=int,
+                              help='Maximum number of steps to run at the same time per pipeline')
+    serve_parser.add_argument('--cache-dir', help='Directory for cached step results, shared by all runs')
+    serve_parser.add_argument('--compiled-dir', help='Directory for parsed pipelines, reused while the YAML and '
+                                                     'variables are unchanged')
+    serve_parser.add_argument('--log-dir', help='Directory to write step output to, in a subdirectory per run')
+    serve_parser.add_argument('--history', default=DEFAULT_HISTORY,
+                              help='File of past step durations, used to start the longest chains of steps first')
+    serve_parser.add_argument('--debug', action='store_true', help='Log each request')
+    submit_parser = subparsers.add_parser('submit', help='Queue a pipeline on the server')
+    submit_parser.add_argument('yaml_file', type=argparse.FileType('r'))
+    submit_parser.add_argument('--wait', action='store_true',
+                               help='Wait for the run to finish, and exit with an error if it did not succeed')
+    status_parser = subparsers.add_parser('status', help='Show the state of runs on the server')
+    status_parser.add_argument('run_id', nargs='?', help='Show only this run')
+    args, leftovers = parser.parse_known_args()
+    if args.command == 'serve':
+        pipeline_server = PipelineServer(args.socket, workers=args.workers, concurrency=args.concurrency,
+                                         cache_dir=args.cache_dir, compiled_dir=args.compiled_dir,
+                                         log_dir=args.log_dir, history_path=args.history, debug=args.debug)
+        pipeline_server.start()
+        print 'Serving on {}'.format(pipeline_server.socket_path)
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            print 'Finishing queued runs'
+            pipeline_server.close()
+    elif args.command == 'submit':
+        sys.exit(submit(args.socket, args.yaml_file.name, extract_var_map(leftovers), wait=args.wait))
+    else:
+        sys.exit(print_status(args.socket, args.run_id))
@@ -0,0 +1,220 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from docker.errors import DockerException
+import argparse
+import json
+import math
+import threading
+import time
+
+# Memory suggestions leave this much room above the largest peak seen
+MEMORY_HEADROOM = 1.25
+MEMORY_UNIT = 64 * 1024 ** 2
+CPU_UNIT = 0.5
+# Seconds to wait for the stats stream of an exited container to end, so its final sample is counted
+STOP_SECONDS = 1
+
+
+class ResourceUsage():
+    def __init__(self):
+        '''
+        Aggregates Docker stats samples of one container into a fixed number of values, however long it runs
+        '''
+        self.samples = 0
+        self.memory_peak = 0
+        self.memory_total = 0
+        self.cpu_peak = 0.0
+        self.cpu_ns = 0
+        self.previous_cpu = None
+        # The I/O counters are cumulative, so only the latest values are kept
+        self.block_read = 0
+        self.block_write = 0
+        self.network_rx = 0
+        self.network_tx = 0
+
+    def add(self, stats, now=None):
+        '''
+        Adds one sample from the Docker stats API
+        :param stats: the decoded stats dict
+        :param now: the time the sample was taken, defaults to now
+        '''
+        now = now if now is not None else time.time()
+        memory = (stats.get('memory_stats') or {}).get('usage') or 0
+        cpu_ns = ((stats.get('cpu_stats') or {}).get('cpu_usage') or {}).get('total_usage') or 0
+        self.samples += 1
+        self.memory_peak = max(self.memory_peak, memory)
+        self.memory_total += memory
+        if self.previous_cpu is not None and now > self.previous_cpu[1]:
+            # CPU seconds used per second since the previous sample
+            self.cpu_peak = max(self.cpu_peak, (cpu_ns - self.previous_cpu[0]) / 1e9 / (now - self.previous_cpu[1]))
+        self.previous_cpu = (cpu_ns, now)
+        self.cpu_ns = max(self.cpu_ns, cpu_ns)
+        for entry in (stats.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []:
+            if entry.get('op') == 'Read':
+                self.block_read = max(self.block_read, entry.get('value') or 0)
+            elif entry.get('op') == 'Write':
+                self.block_write = max(self.block_write, entry.get('value') or 0)
+        # API versions before 1.21 report one network, later versions report each interface
+        networks = (stats.get('networks') or {}).values() or [stats.get('network') or {}]
+        self.network_rx = max(self.network_rx, sum(network.get('rx_bytes') or 0 for network in networks))
+        self.network_tx = max(self.network_tx, sum(network.get('tx_bytes') or 0 for network in networks))
+
+    def summary(self):
+        return {
+            'samples': self.samples,
+            'memory_peak': self.memory_peak,
+            'memory_average': self.memory_total // self.samples if self.samples else 0,
+            'cpu_seconds': self.cpu_ns / 1e9,
+            'cpu_peak': self.cpu_peak,
+            'block_read_bytes': self.block_read,
+            'block_write_bytes': self.block_write,
+            'network_rx_bytes': self.network_rx,
+            'network_tx_bytes': self.network_tx,
+        }
+
+
+class StatsSampler():
+    def __init__(self, client, container, interval, debug=False):
+        '''
+        Samples a running container's resource usage on a background thread, from the streaming Docker stats API
+        :param client: docker Client for the host the container runs on
+        :param container: the container, as returned by create_container
+        :param interval: seconds between the samples that are kept. Docker sends a sample about every second.
+        :param debug: print why sampling stopped early
+        '''
+        self.client = client
+        self.container = container
+        self.interval = interval
+        self.debug = debug
+        self.usage = ResourceUsage()
+        self.latest = None
+        self.stopped = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='stats-sampler')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        last = None
+        try:
+            for stats in self.client.stats(self.container, decode=True):
+                now = time.time()
+                with self.lock:
+                    if self.stopped:
+                        return
+                    if last is None or now - last >= self.interval:
+                        self.usage.add(stats, now)
+                        self.latest = None
+                        last = now
+                    else:
+                        # Kept so the cumulative counters are up to date when the container exits
+                        self.latest = (stats, now)
+        except (DockerException, IOError, ValueError) as e:
+            # Older Docker hosts have no stats API, and the stream ends with an error when the container is removed
+            if self.debug:
+                print 'Stopped sampling stats of container {}: {}'.format(self.container, e)
+
+    def stop(self):
+        '''
+        Stops sampling, once the container has exited. A stream that has not ended by itself within STOP_SECONDS
+        is abandoned, and its thread exits when the next sample arrives.
+        :return: the summary of the container's resource usage
+        '''
+        if self.thread.is_alive():
+            self.thread.join(STOP_SECONDS)
+        with self.lock:
+            self.stopped = True
+            if self.latest is not None:
+                self.usage.add(*self.latest)
+                self.latest = None
+            return self.usage.summary()
+
+
+def summarize(reports):
+    '''
+    Aggregates the resource usage of each step over the reports of several runs
+    :param reports: list of run reports, as written by Runner.write_report
+    :return: dict of step name to dict of the step's runs, its largest usage, and its declared cpus and memory
+    '''
+    steps = dict()
+    for report in reports:
+        for step in report.get('steps', []):
+            usage = step.get('usage')
+            if not usage:
+                continue
+            running = sum(step['phases'].get(phase, 0) for phase in ('logs', 'wait'))
+            summary = steps.setdefault(step['name'], {'runs': 0, 'memory_peak': 0, 'cpu_peak': 0.0,
+                                                      'cpu_average': 0.0})
+            summary['runs'] += 1
+            summary['memory_peak'] = max(summary['memory_peak'], usage['memory_peak'])
+            summary['cpu_peak'] = max(summary['cpu_peak'], usage['cpu_peak'])
+            if running > 0:
+                summary['cpu_average'] = max(summary['cpu_average'], usage['cpu_seconds'] / running)
+            summary['cpus'] = step.get('cpus')
+            summary['memory'] = step.get('memory')
+    return steps
+
+
+def format_memory(size):
+    if size % 1024 ** 3 == 0:
+        return '{}g'.format(size // 1024 ** 3)
+    return '{}m'.format(int(math.ceil(float(size) / 1024 ** 2)))
+
+
+def suggest(summary):
+    '''
+    Suggests cpus and memory settings for a step from its usage
+    :param summary: the step's entry from summarize()
+    :return: tuple of cpus and memory in bytes
+    '''
+    # Steps are given enough cpus for their average use, as short peaks only slow them a little. Averages within
+    # 1% of a whole unit are not rounded up to the next one.
+    cpus = max(CPU_UNIT, math.ceil(round(summary['cpu_average'] / CPU_UNIT, 2)) * CPU_UNIT)
+    # Exceeding the memory limit kills the step, so memory is sized from the peak
+    memory = max(1, int(math.ceil(summary['memory_peak'] * MEMORY_HEADROOM / MEMORY_UNIT))) * MEMORY_UNIT
+    return cpus, memory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Suggest cpus and memory for each step from the resource usage '
+                                                 'recorded in run reports')
+    parser.add_argument('reports', nargs='+', type=argparse.FileType('r'),
+                        help='Reports written by pipeline.py with --report and --stats-interval')
+    args = parser.parse_args()
+    steps = summarize([json.load(report) for report in args.reports])
+    row = '{:<40} {:>5} {:>12} {:>9} {:>18} {:>18}'
+    print row.format('step', 'runs', 'peak memory', 'avg cpus', 'declared', 'suggested')
+    for name in sorted(steps):
+        summary = steps[name]
+        cpus, memory = suggest(summary)
+        declared = '{} cpus {}'.format(summary['cpus'] or '-', format_memory(summary['memory']) if summary['memory']
+                                       else '-')
+        print row.format(name[:40], summary['runs'], format_memory(summary['memory_peak']),
+                         '{:.2f}'.format(summary['cpu_average']), declared,
+                         '{:g} cpus {}'.format(cpus, format_memory(memory)))
@@ -30,8 +30,13 @@ import yaml
 from yaml.loader import ConstructorError
 import os.path
 
+# Use libyaml's parser when PyYAML was built with it
+FastLoader = getattr(yaml, 'CLoader', yaml.Loader)
+# Safe loaders do not construct arbitrary Python objects, for YAML parsed with more privileges than its author has
+FastSafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
-def configure(var_map):
+
+def make_constructors(var_map):
     def join(loader, node):
         """
         YAML Tag handler to join components to a string
@@ -86,8 +91,33 @@ def configure(var_map):
         path = seq[0]
         return os.path.basename(path)
 
-    # Register tag handlers
-    yaml.add_constructor('!join', join)
-    yaml.add_constructor('!var', interpret_var)
-    yaml.add_constructor('!change_ext', change_ext)
-    yaml.add_constructor('!base', base)
+    return {
+        '!join': join,
+        '!var': interpret_var,
+        '!change_ext': change_ext,
+        '!base': base,
+    }
+
+
+def configure(var_map):
+    """
+    Registers the tag handlers on the default YAML Loader, for use with yaml.load()
+    :param var_map: dict of variables for !var
+    """
+    for tag, constructor in make_constructors(var_map).items():
+        yaml.add_constructor(tag, constructor)
+
+
+def make_loader(var_map, safe=False):
+    """
+    Creates a YAML Loader class with the tag handlers registered on it alone, leaving the default Loader unchanged
+    :param var_map: dict of variables for !var
+    :param safe: only construct plain YAML types and the pipeline tags
+    :return: a Loader class, for yaml.load(stream, Loader=...)
+    """
+    class PipelineLoader(FastSafeLoader if safe else FastLoader):
+        pass
+
+    for tag, constructor in make_constructors(var_map).items():
+        PipelineLoader.add_constructor(tag, constructor)
+    return PipelineLoader
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+# 
+# The MIT License (MIT)
+# 
+# Copyright (c) 2015 Dan Leehr
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+from cache import StepCache
+from models import Step
+
+
+class StepCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = StepCache(os.path.join(self.temp_dir, 'cache'))
+        self.infile = os.path.join(self.temp_dir, 'input.txt')
+        self.outfile = os.path.join(self.temp_dir, 'output.txt')
+        self.write(self.infile, 'input')
+        self.step = Step('Test Step', 'docker/image', infiles={'IN': self.infile}, outfiles={'OUT': self.outfile})
+        self.result = {'image': 'docker/image', 'code': 0}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, path, contents):
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def test_miss_then_hit(self):
+        key = self.cache.key(self.step, 'image-id')
+        self.assertIsNone(self.cache.lookup(key, self.step))
+        self.write(self.outfile, 'output')
+        self.cache.store(key, self.step, self.result)
+        self.assertEqual(self.cache.lookup(key, self.step), self.result)
+
+    def test_key_changes_with_inputs(self):
+        key = self.cache.key(self.step, 'image-id')
+        self.assertNotEqual(key, self.cache.key(self.step, 'other-image-id'))
+        self.write(self.infile, 'changed')
+        self.assertNotEqual(key, self.cache.key(self.step, 'image-id'))
+
+    def test_changed_outfile_misses(self):
+        key = self.cache.key(self.step, 'image-id')
+        self.write(self.outfile, 'output')
+        self.cache.store(key, self.step, self.result)
+        self.write(self.outfile, 'modified')
+        self.assertIsNone(self.cache.lookup(key, self.step))
+
+    def test_failed_result_not_stored(self):
+        key = self.cache.key(self.step, 'image-id')
+        self.cache.store(key, self.step, {'image': 'docker/image', 'code': 1})
+        self.assertIsNone(self.cache.lookup(key, self.step))
+
+    def test_fingerprint_directory(self):
+        fingerprints = self.cache.fingerprinter.fingerprints([self.temp_dir, self.outfile])
+        self.assertIsNotNone(fingerprints[self.temp_dir])
+        self.assertIsNone(fingerprints[self.outfile])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+# 
+# The MIT License (MIT)
+# 
+# Copyright (c) 2015 Dan Leehr
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn, UnixStreamServer
+from urlparse import urlparse
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+from endpoints import Endpoint, EndpointPool
+from event_runner import EventLoopRunner
+from models import Pipeline, Step
+from runner import Runner
+
+
+class FakeDaemonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        return 'fake-daemon'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.endswith('/version'):
+            self.send_body(200, json.dumps({'ApiVersion': '1.17', 'Version': '1.5.0'}))
+        else:
+            self.send_body(404, '')
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        length = int(self.headers.getheader('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        daemon = self.server.daemon
+        if path.endswith('/containers/create'):
+            with daemon.lock:
+                daemon.created += 1
+                container_id = 'container{}'.format(daemon.created)
+            self.send_body(201, json.dumps({'Id': container_id}))
+        elif path.endswith('/start'):
+            self.send_body(204, '')
+        elif path.endswith('/attach'):
+            # One multiplexed stdout frame, then the end of the stream
+            log = 'output from {}\n'.format(daemon.name)
+            self.send_body(200, struct.pack('>BxxxL', 1, len(log)) + log, 'application/vnd.docker.raw-stream')
+            self.close_connection = 1
+        elif path.endswith('/wait'):
+            self.send_body(200, json.dumps({'StatusCode': 0}))
+        else:
+            self.send_body(404, '')
+
+
+class ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class FakeDaemon():
+    def __init__(self, socket_path, name):
+        self.name = name
+        self.created = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingUnixServer(socket_path, FakeDaemonHandler)
+        self.server.daemon = self
+        self.url = 'unix://{}'.format(socket_path)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class EndpointPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.daemons = [FakeDaemon(os.path.join(self.temp_dir, 'docker{}.sock'.format(i)), 'daemon{}'.format(i))
+                        for i in range(2)]
+
+    def tearDown(self):
+        for daemon in self.daemons:
+            daemon.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def make_pipeline(self, hosts, steps):
+        return Pipeline('Test Pipeline', steps=steps, hosts=hosts, concurrency=len(steps), pull_images=False)
+
+    def test_has_paths(self):
+        endpoint = Endpoint(url=self.daemons[0].url, mounts=['/data/lab1'])
+        self.assertTrue(endpoint.has_paths(['/data/lab1', '/data/lab1/raw']))
+        self.assertFalse(endpoint.has_paths(['/data/lab1', '/data/lab10']))
+        self.assertTrue(Endpoint(url=self.daemons[0].url).has_paths(['/anything']))
+
+    def test_least_loaded(self):
+        pool = EndpointPool([Endpoint(url=daemon.url, slots=2) for daemon in self.daemons])
+        step = Step('Test Step', 'docker/image')
+        first = pool.acquire(step)
+        second = pool.acquire(step)
+        self.assertNotEqual(first, second)
+        pool.release(first)
+        self.assertEqual(pool.acquire(step), first)
+
+    def test_affinity(self):
+        hosts = [{'url': self.daemons[0].url, 'mounts': ['/data/lab0']},
+                 {'url': self.daemons[1].url, 'mounts': ['/data/lab1']}]
+        pool = EndpointPool([Endpoint.from_dict(host) for host in hosts])
+        step = Step('Test Step', 'docker/image', infiles={'IN': '/data/lab1/file'})
+        self.assertEqual(pool.acquire(step).url, self.daemons[1].url)
+        step = Step('Test Step', 'docker/image', infiles={'IN': '/data/other/file'})
+        self.assertRaises(Exception, pool.acquire, step)
+
+    def test_runs_steps_across_daemons(self):
+        hosts = [{'url': daemon.url, 'slots': 1} for daemon in self.daemons]
+        steps = [Step('step{}'.format(i), 'docker/image') for i in range(4)]
+        runner = Runner(self.make_pipeline(hosts, steps))
+        runner.run()
+        self.assertEqual(len(runner.results), 4)
+        self.assertTrue(all(result['code'] == 0 for result in runner.results))
+        self.assertEqual(sum(daemon.created for daemon in self.daemons), 4)
+        self.assertTrue(all(daemon.created > 0 for daemon in self.daemons))
+        report = runner.tracer.report()
+        self.assertEqual(len(report['steps']), 4)
+        self.assertTrue(set(['create_container', 'start_container', 'logs', 'wait', 'finish_container']) <=
+                        set(runner.results[0]['timings']))
+
+    def test_event_loop_runner(self):
+        hosts = [{'url': daemon.url, 'slots': 2} for daemon in self.daemons]
+        steps = [Step('step{}'.format(i), 'docker/image') for i in range(6)]
+        runner = EventLoopRunner(self.make_pipeline(hosts, steps))
+        runner.run()
+        self.assertEqual(len(runner.results), 6)
+        self.assertTrue(all(result['code'] == 0 for result in runner.results))
+        self.assertTrue(all(result['logs'].startswith('output from daemon') for result in runner.results))
+        self.assertEqual(sum(daemon.created for daemon in self.daemons), 6)
+        self.assertTrue(set(['create_container', 'start_container', 'logs', 'wait', 'finish_container']) <=
+                        set(runner.results[0]['timings']))
+
+
+if __name__ == '__main__':
+    unittest.main()
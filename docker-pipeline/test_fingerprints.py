@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+# 
+# The MIT License (MIT)
+# 
+# Copyright (c) 2015 Dan Leehr
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import fingerprints
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from fingerprints import Fingerprinter, content_hash
+
+
+class FingerprinterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.temp_dir, 'index', 'fingerprints.json')
+        self.data_dir = os.path.join(self.temp_dir, 'data')
+        os.makedirs(os.path.join(self.data_dir, 'sub'))
+        self.file = os.path.join(self.data_dir, 'sub', 'file.txt')
+        self.write(self.file, 'contents')
+        # Files are only trusted by stat once they are older than the racy window
+        self.age(self.file)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, path, contents):
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def age(self, path):
+        past = time.time() - 60
+        os.utime(path, (past, past))
+
+    def test_content_hash(self):
+        self.assertEqual(content_hash(self.file), content_hash(self.file))
+        empty = os.path.join(self.temp_dir, 'empty')
+        self.write(empty, '')
+        self.assertEqual(content_hash(empty).split(':')[1], '0')
+        self.assertNotEqual(content_hash(empty), content_hash(self.file))
+
+    def test_index_fast_path(self):
+        first = Fingerprinter(self.index_path).fingerprints([self.file])[self.file]
+        hashed = []
+        original = fingerprints.content_hash
+        fingerprints.content_hash = lambda path: hashed.append(path) or original(path)
+        try:
+            # A new Fingerprinter reads the saved index and does not hash the unchanged file again
+            fingerprinter = Fingerprinter(self.index_path)
+            self.assertEqual(fingerprinter.fingerprints([self.file])[self.file], first)
+            self.assertEqual(hashed, [])
+            self.write(self.file, 'changed!')
+            self.age(self.file)
+            self.assertNotEqual(fingerprinter.fingerprints([self.file])[self.file], first)
+            self.assertEqual(hashed, [self.file])
+        finally:
+            fingerprints.content_hash = original
+
+    def test_recently_modified_is_hashed(self):
+        fingerprinter = Fingerprinter(self.index_path)
+        recent = os.path.join(self.data_dir, 'recent')
+        self.write(recent, 'one')
+        first = fingerprinter.fingerprints([recent])[recent]
+        # Same size and possibly the same mtime, but the file was too new to trust its stat
+        self.write(recent, 'two')
+        self.assertNotEqual(fingerprinter.fingerprints([recent])[recent], first)
+
+    def test_directories_and_missing(self):
+        fingerprinter = Fingerprinter(self.index_path, workers=2)
+        missing = os.path.join(self.data_dir, 'missing')
+        result = fingerprinter.fingerprints([self.data_dir, missing])
+        self.assertTrue(result[self.data_dir].startswith('dir:'))
+        self.assertIsNone(result[missing])
+        self.write(os.path.join(self.data_dir, 'new'), 'new')
+        self.assertNotEqual(fingerprinter.fingerprints([self.data_dir])[self.data_dir], result[self.data_dir])
+
+
+if __name__ == '__main__':
+    unittest.main()
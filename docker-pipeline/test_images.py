@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+# 
+# The MIT License (MIT)
+# 
+# Copyright (c) 2015 Dan Leehr
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from fake_docker import FakeClient
+from images import ImagePrefetcher
+
+
+class ImagePrefetcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.digest_cache = os.path.join(self.temp_dir, 'images.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def fetch(self, client, images, **kwargs):
+        prefetcher = ImagePrefetcher(client, digest_cache=self.digest_cache, **kwargs)
+        prefetcher.start(images)
+        try:
+            return [prefetcher.wait(image) for image in images]
+        finally:
+            prefetcher.close()
+
+    def test_always(self):
+        client = FakeClient(images=['dleehr/filesize'])
+        image_ids = self.fetch(client, ['dleehr/filesize', 'dleehr/add', 'dleehr/filesize'])
+        self.assertEqual(image_ids, ['sha-dleehr/filesize', 'sha-dleehr/add', 'sha-dleehr/filesize'])
+        self.assertEqual(client.calls['pull'], 2)
+
+    def test_if_missing(self):
+        client = FakeClient(images=['dleehr/filesize'])
+        image_ids = self.fetch(client, ['dleehr/filesize', 'dleehr/add'], policy='if-missing')
+        self.assertEqual(image_ids, ['sha-dleehr/filesize', 'sha-dleehr/add'])
+        # Only the missing image is pulled
+        self.assertEqual(client.calls['pull'], 1)
+
+    def test_ttl(self):
+        client = FakeClient(images=['dleehr/filesize'])
+        self.fetch(client, ['dleehr/filesize'], policy='ttl', ttl=60)
+        self.assertEqual(client.calls['pull'], 1)
+        with open(self.digest_cache) as digest_file:
+            digests = json.load(digest_file)
+        self.assertEqual(digests['dleehr/filesize']['id'], 'sha-dleehr/filesize')
+        # Pulled within the ttl, so not pulled again
+        self.fetch(client, ['dleehr/filesize'], policy='ttl', ttl=60)
+        self.assertEqual(client.calls['pull'], 1)
+        digests['dleehr/filesize']['pulled_at'] -= 120
+        with open(self.digest_cache, 'w') as digest_file:
+            json.dump(digests, digest_file)
+        self.fetch(client, ['dleehr/filesize'], policy='ttl', ttl=60)
+        self.assertEqual(client.calls['pull'], 2)
+
+    def test_invalid_policy(self):
+        self.assertRaises(ValueError, ImagePrefetcher, FakeClient(), policy='sometimes')
+        self.assertRaises(ValueError, ImagePrefetcher, FakeClient(), policy='ttl')
+
+    def test_concurrent_start(self):
+        client = FakeClient(latencies={'pull': 0.01})
+        prefetcher = ImagePrefetcher(client, digest_cache=self.digest_cache)
+        images = ['image{}'.format(i) for i in range(20)]
+        threads = [threading.Thread(target=prefetcher.start, args=(images,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(prefetcher.wait(image) == 'sha-{}'.format(image) for image in images))
+        prefetcher.close()
+        # Each image is pulled once, however many threads asked for it
+        self.assertEqual(client.calls['pull'], 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+# 
+# The MIT License (MIT)
+# 
+# Copyright (c) 2015 Dan Leehr
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from logs import LogTail, StepLog
+
+
+class LogTailTestCase(unittest.TestCase):
+
+    def test_line_bound(self):
+        tail = LogTail(max_lines=3, max_bytes=1024)
+        for i in range(10):
+            tail.write('line {}\n'.format(i))
+        self.assertEqual(tail.getvalue(), 'line 7\nline 8\nline 9\n')
+
+    def test_byte_bound(self):
+        tail = LogTail(max_lines=100, max_bytes=20)
+        for i in range(10):
+            tail.write('line {}\n'.format(i))
+        # The last 20 bytes start inside 'line 7', which is dropped rather than kept in part
+        self.assertEqual(tail.getvalue(), 'line 8\nline 9\n')
+        # Chunks no longer needed to cover the byte limit are dropped
+        self.assertLessEqual(len(tail.chunks), 4)
+
+    def test_long_line(self):
+        tail = LogTail(max_lines=10, max_bytes=10)
+        tail.write('x' * 100)
+        # A single line longer than the limit is cut rather than dropped
+        self.assertEqual(tail.getvalue(), 'x' * 10)
+
+
+class StepLogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_no_log_dir(self):
+        step_log = StepLog()
+        step_log.write('out\n')
+        step_log.write('err\n', 'stderr')
+        step_log.close()
+        self.assertEqual(step_log.paths, {})
+        self.assertEqual(step_log.tail(), 'out\nerr\n')
+
+    def test_files(self):
+        step_log = StepLog(self.temp_dir, prefix='001-Add sizes', max_lines=2)
+        for i in range(5):
+            step_log.write('line {}\n'.format(i))
+        step_log.write('error\n', 'stderr')
+        step_log.close()
+        path = os.path.join(self.temp_dir, '001-Add_sizes.stdout.log')
+        self.assertEqual(step_log.paths, {'stdout': path, 'stderr': path})
+        with open(path) as log_file:
+            self.assertEqual(log_file.read(), 'line 0\nline 1\nline 2\nline 3\nline 4\nerror\n')
+        self.assertEqual(step_log.tail(), 'line 4\nerror\n')
+
+    def test_compress(self):
+        step_log = StepLog(self.temp_dir, prefix='step', compress=True)
+        step_log.write('compressed\n')
+        step_log.close()
+        path = os.path.join(self.temp_dir, 'step.stdout.log.gz')
+        self.assertEqual(step_log.paths['stdout'], path)
+        with gzip.open(path) as log_file:
+            self.assertEqual(log_file.read(), 'compressed\n')
+
+    def test_separate_stderr(self):
+        step_log = StepLog(self.temp_dir, prefix='step', separate_stderr=True)
+        step_log.write('out\n')
+        step_log.write('err\n', 'stderr')
+        step_log.close()
+        self.assertNotEqual(step_log.paths['stdout'], step_log.paths['stderr'])
+        for stream, contents in [('stdout', 'out\n'), ('stderr', 'err\n')]:
+            with open(step_log.paths[stream]) as log_file:
+                self.assertEqual(log_file.read(), contents)
+            self.assertEqual(step_log.tail(stream), contents)
+
+
+if __name__ == '__main__':
+    unittest.main()
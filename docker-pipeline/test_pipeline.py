@@ -26,9 +26,16 @@
 
 __author__ = 'dcl9'
 
+import os
+import shutil
+import subprocess
+import tempfile
 import unittest
-from models import Step
-from utils import extract_var_map
+import yaml
+from logs import FusedStepLog
+from models import FusedStep, Pipeline, Step
+from pipeline_cache import PipelineCache
+from utils import extract_var_map, read_sample_sheet, parse_memory
 
 
 class StepTestCase(unittest.TestCase):
@@ -80,5 +87,257 @@ class StepTestCase(unittest.TestCase):
         var_map = extract_var_map(leftovers)
         self.assertEqual(var_map, {'FOO': 'bar', 'BAZ': 'bat'})
 
+    def test_merge_volumes(self):
+        infiles = {'READS_{}'.format(i): '/data/run1/lane{}/reads.fastq'.format(i) for i in range(4)}
+        infiles['REFERENCE'] = '/ref/genome/hg38.fa'
+        step = Step(self.name, self.image, infiles=infiles, outfiles=self.outfiles, merge_volumes=True)
+        self.assertEqual(step.binds, {
+            '/data/run1': {'bind': '/mnt/input_0', 'ro': True},
+            '/ref/genome': {'bind': '/mnt/input_1', 'ro': True},
+            '/path/to/readwrite': {'bind': '/mnt/output_0', 'ro': False}
+        })
+        self.assertEqual(step.environment['READS_2'], '/mnt/input_0/lane2/reads.fastq')
+        self.assertEqual(step.environment['REFERENCE'], '/mnt/input_1/hg38.fa')
+
+    def test_merge_dirnames(self):
+        merged = Step.merge_dirnames(set(['/a/b/c', '/a/b/d', '/a/b/e/f', '/x/y', '/z']))
+        self.assertEqual(merged, set(['/a/b', '/x/y', '/z']))
+
+    def test_shared_directory_is_read_write(self):
+        step = Step(self.name, self.image, infiles={'IN': '/data/shared/in'}, outfiles={'OUT': '/data/shared/out'})
+        self.assertEqual(step.binds, {'/data/shared': {'bind': '/mnt/output_0', 'ro': False}})
+        self.assertEqual(step.get_volumes(), ['/mnt/output_0'])
+        self.assertEqual(step.environment, {'IN': '/mnt/output_0/in', 'OUT': '/mnt/output_0/out'})
+
+    def test_resources(self):
+        step = Step(self.name, self.image, cpus=2, memory='512m')
+        self.assertEqual(step.cpus, 2)
+        self.assertEqual(step.memory, 512 * 1024 * 1024)
+
+    def test_parse_memory(self):
+        self.assertEqual(parse_memory(1000), 1000)
+        self.assertEqual(parse_memory('4g'), 4 * 1024 ** 3)
+        self.assertEqual(parse_memory('1.5GB'), int(1.5 * 1024 ** 3))
+        self.assertIsNone(parse_memory(None))
+        self.assertRaises(ValueError, parse_memory, 'lots')
+
+    def test_place_intermediates(self):
+        steps = [Step('size1', self.image, infiles={'IN': '/data/file1'}, outfiles={'OUT': '/tmp/step1-size'}),
+                 Step('size2', self.image, infiles={'IN': '/data/file2'}, outfiles={'OUT': '/tmp/step2-size'}),
+                 Step('add', self.image, infiles={'IN1': '/tmp/step1-size', 'IN2': '/tmp/step2-size'},
+                      outfiles={'OUT': '/data/total'}, parameters={'MODE': 'sum'})]
+        pipeline = Pipeline('Test Pipeline', steps=steps, scratch_dir='/scratch', keep=['/tmp/step2-size'])
+        self.assertEqual(pipeline.intermediates, {'/scratch/tmp/step1-size': '/tmp/step1-size'})
+        self.assertEqual(pipeline.steps[0].outfiles, {'OUT': '/scratch/tmp/step1-size'})
+        self.assertIs(pipeline.steps[1], steps[1])
+        add = pipeline.steps[2]
+        self.assertEqual(add.infiles, {'IN1': '/scratch/tmp/step1-size', 'IN2': '/tmp/step2-size'})
+        self.assertEqual(add.environment['IN1'], '/mnt/input_0/step1-size')
+        self.assertEqual(add.environment['MODE'], 'sum')
+        self.assertTrue('/scratch/tmp' in add.binds)
+
+    def test_fuse_steps(self):
+        steps = [Step('size', self.image, command='size', infiles={'IN': '/data/file'}, outfiles={'OUT': '/tmp/size'}),
+                 Step('double', self.image, command=['double', '2'], infiles={'IN': '/tmp/size'},
+                      outfiles={'OUT': '/tmp/double'}, memory='1g'),
+                 Step('add', 'docker/other', command='add', infiles={'IN': '/tmp/double'}),
+                 Step('print', 'docker/other', infiles={'IN': '/tmp/double'})]
+        pipeline = Pipeline('Test Pipeline', steps=steps, fuse_steps=True)
+        self.assertEqual([step.name for step in pipeline.steps], ['size + double', 'add', 'print'])
+        fused = pipeline.steps[0]
+        self.assertIsInstance(fused, FusedStep)
+        self.assertEqual(fused.infiles, {'STEP0_IN': '/data/file'})
+        self.assertEqual(fused.outfiles, {'STEP0_OUT': '/tmp/size', 'STEP1_OUT': '/tmp/double'})
+        self.assertEqual(fused.memory, 1024 ** 3)
+        self.assertEqual(fused.command[:2], ['/bin/sh', '-c'])
+        self.assertTrue("(export IN=/mnt/output_0/size OUT=/mnt/output_0/double; exec double 2)" in fused.command[2])
+
+    def test_fused_step_log(self):
+        fused = FusedStep([Step('one', self.image, command='one'), Step('two', self.image, command='two'),
+                           Step('three', self.image, command='three')])
+        step_log = FusedStepLog(fused)
+        output = 'first\n' + fused.marker.format(0) + '0\nsecond' + fused.marker.format(1) + '2\n'
+        # Markers split across chunks are still found
+        for i in range(0, len(output), 5):
+            step_log.write(output[i:i + 5])
+        self.assertEqual(step_log.results(), [{'name': 'one', 'code': 0, 'logs': 'first\n'},
+                                              {'name': 'two', 'code': 2, 'logs': 'second\n'}])
+        self.assertEqual(step_log.tail(), output)
+        # Running the script, a sub-step without files or parameters logs only its own output
+        fused = FusedStep([Step('one', self.image, command='echo first'),
+                           Step('two', self.image, command='echo second', parameters={'NUMBER': '2'})])
+        step_log = FusedStepLog(fused)
+        step_log.write(subprocess.check_output(fused.command))
+        self.assertEqual(step_log.results(), [{'name': 'one', 'code': 0, 'logs': 'first\n'},
+                                              {'name': 'two', 'code': 0, 'logs': 'second\n'}])
+
+    def test_stream_readers(self):
+        produce = Step('produce', self.image, outfiles={'OUT': '/data/pipe'}, streams=['OUT'])
+        consume = Step('consume', self.image, infiles={'IN': '/data/pipe'})
+        Pipeline('Test Pipeline', steps=[produce, consume])
+        self.assertRaises(ValueError, Pipeline, 'Test Pipeline', steps=[produce])
+        self.assertRaises(ValueError, Pipeline, 'Test Pipeline', steps=[produce, consume, consume])
+
+    def test_read_sample_sheet(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write('SAMPLE,FILE1\ns1,/data/s1\n\ns2,/data/s2\n')
+        try:
+            samples = read_sample_sheet(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(samples, [{'SAMPLE': 's1', 'FILE1': '/data/s1'}, {'SAMPLE': 's2', 'FILE1': '/data/s2'}])
+
+
+class PreflightTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.temp_dir, 'input')
+        self.output_dir = os.path.join(self.temp_dir, 'output')
+        os.mkdir(self.input_dir)
+        os.mkdir(self.output_dir)
+        self.input_file = os.path.join(self.input_dir, 'file1')
+        open(self.input_file, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_check_volumes(self):
+        steps = [
+            Step('step1', 'image', infiles={'IN': self.input_file}, outfiles={'OUT': self.output_dir + '/step1'}),
+            Step('step2', 'image', infiles={'IN': self.output_dir + '/step1'}, outfiles={'OUT': self.output_dir + '/2'}),
+        ]
+        Pipeline('Test Pipeline', steps=steps).check_volumes()
+
+    def test_scratch_dir(self):
+        steps = [
+            Step('step1', 'image', infiles={'IN': self.input_file}, outfiles={'OUT': self.output_dir + '/step1'}),
+            Step('step2', 'image', infiles={'IN': self.output_dir + '/step1'}, outfiles={'OUT': self.output_dir + '/2'}),
+        ]
+        # The intermediate's directory under scratch does not exist until the run starts
+        scratch_dir = os.path.join(self.temp_dir, 'scratch')
+        Pipeline('Test Pipeline', steps=steps, scratch_dir=scratch_dir).check_volumes()
+
+    def test_reports_all_problems(self):
+        missing_dir = os.path.join(self.temp_dir, 'missing')
+        steps = [
+            Step('step1', 'image', infiles={'IN': os.path.join(self.input_dir, 'file2')},
+                 outfiles={'OUT': os.path.join(missing_dir, 'out')}),
+            Step('step2', 'image', infiles={'IN': os.path.join(missing_dir, 'in')}),
+        ]
+        with self.assertRaises(Exception) as cm:
+            Pipeline('Test Pipeline', steps=steps).check_volumes()
+        problems = cm.exception.message.splitlines()
+        self.assertEqual(len(problems), 4)
+        self.assertIn('ERROR: No w access to {}'.format(missing_dir), problems)
+        self.assertIn('ERROR: Input {} of step step1 does not exist'.format(os.path.join(self.input_dir, 'file2')),
+                      problems)
+
+
+class PipelineCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.yaml_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'total_size.yaml')
+        self.var_map = {'FILE1': '/data/file1', 'FILE2': '/data/file2', 'RESULT': '/data/result'}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_load(self):
+        cache = PipelineCache(self.temp_dir)
+        pipeline = cache.load(self.yaml_file, self.var_map)
+        self.assertEqual(pipeline.steps[0].infiles, {'CONT_INPUT_FILE': '/data/file1'})
+        self.assertEqual(len(os.listdir(self.temp_dir)), 1)
+        cached = cache.load(self.yaml_file, self.var_map)
+        self.assertEqual(cached.steps[2].outfiles, {'CONT_OUTPUT_FILE': '/data/result'})
+        self.assertEqual(cached.steps[2].environment, pipeline.steps[2].environment)
+
+    def test_variables_change_key(self):
+        cache = PipelineCache(self.temp_dir)
+        cache.load(self.yaml_file, self.var_map)
+        self.var_map['FILE1'] = '/data/other'
+        pipeline = cache.load(self.yaml_file, self.var_map)
+        self.assertEqual(pipeline.steps[0].infiles, {'CONT_INPUT_FILE': '/data/other'})
+        self.assertEqual(len(os.listdir(self.temp_dir)), 2)
+
+
+class ScatterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.chunks_dir = os.path.join(self.temp_dir, 'chunks')
+        os.makedirs(self.chunks_dir)
+        for name in ['chr1', 'chr2', 'chr3']:
+            open(os.path.join(self.chunks_dir, '{}.txt'.format(name)), 'w').close()
+        self.pipeline_dict = {
+            'name': 'Scatter Pipeline',
+            'steps': [
+                {'name': 'size', 'image': 'dleehr/filesize',
+                 'scatter': {'CONT_INPUT_FILE': os.path.join(self.chunks_dir, '*.txt')},
+                 'outfiles': {'CONT_OUTPUT_FILE': '/tmp/sizes/{shard}.size'},
+                 'parameters': {'SHARD': 'shard {index}', 'AWK': '{print $1}'}},
+                {'name': 'add', 'image': 'dleehr/add',
+                 'gather': {'CONT_INPUT_FILES': '/tmp/sizes/{shard}.size'},
+                 'outfiles': {'CONT_OUTPUT_FILE': '/data/total'}},
+            ]
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_scatter_gather(self):
+        pipeline = Pipeline.from_dict(self.pipeline_dict)
+        self.assertEqual([step.name for step in pipeline.steps], ['size [chr1]', 'size [chr2]', 'size [chr3]', 'add'])
+        shard = pipeline.steps[1]
+        self.assertEqual(shard.infiles, {'CONT_INPUT_FILE': os.path.join(self.chunks_dir, 'chr2.txt')})
+        self.assertEqual(shard.environment, {'CONT_INPUT_FILE': '/mnt/input_0/chr2.txt',
+                                             'CONT_OUTPUT_FILE': '/mnt/output_0/chr2.size',
+                                             'SHARD': 'shard 1', 'AWK': '{print $1}'})
+        # Shards share the volumes computed for the first shard
+        self.assertIs(shard.binds, pipeline.steps[0].binds)
+        add = pipeline.steps[3]
+        self.assertEqual(add.infiles['CONT_INPUT_FILES_2'], '/tmp/sizes/chr3.size')
+        self.assertEqual(add.environment['CONT_INPUT_FILES'],
+                         '/mnt/input_0/chr1.size /mnt/input_0/chr2.size /mnt/input_0/chr3.size')
+        self.assertEqual(pipeline.globs.values(), [sorted(os.path.join(self.chunks_dir, '{}.txt'.format(name))
+                                                          for name in ['chr1', 'chr2', 'chr3'])])
+
+    def test_scatter_gathers_from_scatter(self):
+        self.pipeline_dict['steps'][1] = {
+            'name': 'scale', 'image': 'dleehr/scale',
+            'scatter': {'CONT_INPUT_FILE': ['/data/factors/x.txt', '/data/factors/y.txt']},
+            'gather': {'CONT_INPUT_FILES': '/tmp/sizes/{shard}.size'},
+            'outfiles': {'CONT_OUTPUT_FILE': '/data/scaled/{shard}'}}
+        pipeline = Pipeline.from_dict(self.pipeline_dict)
+        sizes = ['/tmp/sizes/{}.size'.format(name) for name in ['chr1', 'chr2', 'chr3']]
+        for step, factor in zip(pipeline.steps[3:], ['x', 'y']):
+            self.assertEqual(step.infiles, {'CONT_INPUT_FILE': '/data/factors/{}.txt'.format(factor),
+                                            'CONT_INPUT_FILES_0': sizes[0], 'CONT_INPUT_FILES_1': sizes[1],
+                                            'CONT_INPUT_FILES_2': sizes[2]})
+            self.assertEqual(step.environment['CONT_INPUT_FILES'],
+                             '/mnt/input_1/chr1.size /mnt/input_1/chr2.size /mnt/input_1/chr3.size')
+            self.assertEqual(step.gather, {'CONT_INPUT_FILES': sizes})
+
+    def test_scatter_errors(self):
+        self.pipeline_dict['steps'][0]['scatter'] = {'CONT_INPUT_FILE': os.path.join(self.chunks_dir, '*.fastq')}
+        self.assertRaises(ValueError, Pipeline.from_dict, self.pipeline_dict)
+        self.pipeline_dict['steps'][0]['scatter'] = {'CONT_INPUT_FILE': ['/a/chr1.txt', '/b/chr1.txt']}
+        self.assertRaises(ValueError, Pipeline.from_dict, self.pipeline_dict)
+        self.pipeline_dict['steps'][0]['scatter'] = {'CONT_INPUT_FILE': ['/a/chr1.txt', '/a/chr2.txt']}
+        self.pipeline_dict['steps'][1]['gather'] = {'CONT_INPUT_FILES': '/tmp/sizes/other'}
+        self.assertRaises(ValueError, Pipeline.from_dict, self.pipeline_dict)
+
+    def test_compiled_pipeline_follows_glob(self):
+        yaml_file = os.path.join(self.temp_dir, 'scatter.yaml')
+        with open(yaml_file, 'w') as f:
+            yaml.safe_dump(self.pipeline_dict, f)
+        cache = PipelineCache(os.path.join(self.temp_dir, 'compiled'))
+        self.assertEqual(len(cache.load(yaml_file, {}).steps), 4)
+        open(os.path.join(self.chunks_dir, 'chr4.txt'), 'w').close()
+        self.assertEqual(len(cache.load(yaml_file, {}).steps), 5)
+
+
 if __name__ == '__main__':
     unittest.main()
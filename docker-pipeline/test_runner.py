@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+# 
+# The MIT License (MIT)
+# 
+# Copyright (c) 2015 Dan Leehr
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import os
+import requests
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+from fake_docker import FakeClient
+from fingerprints import Fingerprinter
+from journal import RunJournal
+from models import Pipeline, Step
+from reaper import ContainerReaper, sweep
+from runner import Runner
+from stats import format_memory, suggest, summarize
+
+
+class RunnerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.steps = [
+            Step('size1', 'dleehr/filesize', infiles={'IN': '/data/file1'}, outfiles={'OUT': '/tmp/step1-size'}),
+            Step('size2', 'dleehr/filesize', infiles={'IN': '/data/file2'}, outfiles={'OUT': '/tmp/step2-size'}),
+            Step('add', 'dleehr/add', infiles={'IN1': '/tmp/step1-size', 'IN2': '/tmp/step2-size'},
+                 outfiles={'OUT': '/data/total'}),
+        ]
+        self.pipeline = Pipeline('Test Pipeline', steps=self.steps, pull_images=False,
+                                 log_dir=os.path.join(self.temp_dir, 'logs'))
+        # Runner reports progress on stdout
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.temp_dir)
+
+    def run_pipeline(self, client, journal=None):
+        runner = Runner(self.pipeline, client=client, journal=journal)
+        runner.run()
+        return runner
+
+    def test_run(self):
+        client = FakeClient(log_lines=3)
+        runner = self.run_pipeline(client)
+        self.assertEqual(len(runner.results), 3)
+        self.assertEqual(runner.result['image'], 'dleehr/add')
+        self.assertEqual(runner.result['code'], 0)
+        self.assertEqual(client.calls['create_container'], 3)
+        self.assertEqual(client.calls['pull'], 0)
+        self.assertEqual(len(runner.result['logs'].splitlines()), 3)
+
+    def test_failure_stops_pipeline(self):
+        client = FakeClient(exit_codes={'dleehr/filesize': 2})
+        runner = self.run_pipeline(client)
+        self.assertEqual(runner.result['code'], 2)
+        self.assertEqual(client.calls['create_container'], 1)
+
+    def test_resume(self):
+        journal_path = os.path.join(self.temp_dir, 'journal')
+        journal = RunJournal(journal_path)
+        self.run_pipeline(FakeClient(exit_codes={'dleehr/add': 1}), journal)
+        journal.close()
+        # Only the failed step runs again
+        client = FakeClient()
+        runner = self.run_pipeline(client, RunJournal(journal_path, resume=True))
+        self.assertEqual(runner.result['code'], 0)
+        self.assertEqual(client.calls['create_container'], 1)
+        self.assertTrue(all(result.get('resumed') for result in runner.results[:2]))
+
+    def test_resume_after_partial_record(self):
+        journal_path = os.path.join(self.temp_dir, 'journal')
+        journal = RunJournal(journal_path)
+        journal.finished(1, self.steps[0], 0)
+        journal.close()
+        # The process died while writing the next record
+        with open(journal_path, 'a') as journal_file:
+            journal_file.write('{"event": "fini')
+        journal = RunJournal(journal_path, resume=True)
+        journal.finished(2, self.steps[1], 0)
+        journal.close()
+        steps = RunJournal.load(journal_path)
+        self.assertEqual(sorted(steps), [1, 2])
+        self.assertEqual(steps[2]['event'], 'finished')
+
+    def test_resume_reattaches(self):
+        journal_path = os.path.join(self.temp_dir, 'journal')
+        client = FakeClient(log_lines=2)
+        journal = RunJournal(journal_path)
+        journal.finished(1, self.steps[0], 0)
+        journal.finished(2, self.steps[1], 0)
+        # The run stopped while the last step's container was running
+        container = client.create_container('dleehr/add')
+        client.start(container)
+        journal.started(3, self.steps[2], None, container)
+        journal.close()
+        runner = self.run_pipeline(client, RunJournal(journal_path, resume=True))
+        self.assertEqual(runner.result['code'], 0)
+        self.assertEqual(client.calls['create_container'], 1)
+        self.assertEqual(len(runner.result['logs'].splitlines()), 2)
+        self.assertEqual(RunJournal.load(journal_path)[3]['event'], 'finished')
+        # A changed step is not resumed
+        self.steps[0].command = 'changed'
+        self.assertIsNone(RunJournal(journal_path, resume=True).completed(1, self.steps[0]))
+
+    def test_remove_containers(self):
+        self.pipeline.remove_containers = True
+        client = FakeClient()
+        runner = self.run_pipeline(client)
+        self.assertEqual(runner.result['code'], 0)
+        # Removal happens in the background, and is finished before run() returns
+        self.assertEqual(client.calls['remove_container'], 3)
+        self.assertEqual(client.existing, {})
+
+    def test_reaper_survives_errors(self):
+        client = FakeClient()
+        first = client.create_container('dleehr/add')
+        second = client.create_container('dleehr/add')
+        remove_container = client.remove_container
+
+        def flaky_remove(container, **kwargs):
+            if container == first:
+                raise requests.exceptions.ConnectionError('connection refused')
+            return remove_container(container, **kwargs)
+        client.remove_container = flaky_remove
+        reaper = ContainerReaper(client)
+        reaper.remove(first)
+        reaper.remove(second)
+        reaper.close()
+        self.assertEqual(client.existing.keys(), [first['Id']])
+        self.assertIn('connection refused', sys.stdout.getvalue())
+
+    def test_sweep(self):
+        client = FakeClient(run_time=60)
+        left = client.create_container('dleehr/add', name='docker-pipeline-abc-001-1')
+        running = client.create_container('dleehr/add', name='docker-pipeline-abc-002-2')
+        client.start(running)
+        other = client.create_container('dleehr/add', name='unrelated')
+        self.assertEqual(sweep(client), ['docker-pipeline-abc-001-1'])
+        self.assertEqual(sorted(client.existing), sorted([running['Id'], other['Id']]))
+        self.assertEqual(sweep(client, include_running=True), ['docker-pipeline-abc-002-2'])
+        self.assertEqual(client.existing.keys(), [other['Id']])
+
+    def test_scratch_cleanup(self):
+        scratch_dir = os.path.join(self.temp_dir, 'scratch')
+        self.pipeline = Pipeline('Test Pipeline', steps=self.steps, pull_images=False, scratch_dir=scratch_dir)
+        self.assertEqual(len(self.pipeline.intermediates), 2)
+        # The fake containers write nothing, so the intermediates are created up front
+        os.makedirs(os.path.join(scratch_dir, 'tmp'))
+        for path in self.pipeline.intermediates:
+            open(path, 'w').close()
+        runner = self.run_pipeline(FakeClient())
+        self.assertEqual(runner.result['code'], 0)
+        self.assertFalse(any(os.path.exists(path) for path in self.pipeline.intermediates))
+
+    def test_resumed_scratch_cleanup(self):
+        scratch_dir = os.path.join(self.temp_dir, 'scratch')
+        self.pipeline = Pipeline('Test Pipeline', steps=self.steps, pull_images=False, scratch_dir=scratch_dir)
+        os.makedirs(os.path.join(scratch_dir, 'tmp'))
+        for path in self.pipeline.intermediates:
+            open(path, 'w').close()
+        journal_path = os.path.join(self.temp_dir, 'journal')
+        journal = RunJournal(journal_path)
+        self.run_pipeline(FakeClient(exit_codes={'dleehr/add': 1}), journal)
+        journal.close()
+        self.assertTrue(all(os.path.exists(path) for path in self.pipeline.intermediates))
+        # The steps writing the intermediates are skipped, and still count towards deleting them
+        runner = self.run_pipeline(FakeClient(), RunJournal(journal_path, resume=True))
+        self.assertEqual(runner.result['code'], 0)
+        self.assertFalse(any(os.path.exists(path) for path in self.pipeline.intermediates))
+
+    def test_manifest(self):
+        infile = os.path.join(self.temp_dir, 'file1')
+        with open(infile, 'w') as f:
+            f.write('input')
+        self.steps[0] = Step('size1', 'dleehr/filesize', infiles={'IN': infile}, outfiles={'OUT': '/tmp/step1-size'})
+        self.pipeline.steps = self.steps
+        runner = Runner(self.pipeline, client=FakeClient())
+        runner.manifest = os.path.join(self.temp_dir, 'manifest.json')
+        runner.fingerprinter = Fingerprinter(os.path.join(self.temp_dir, 'fingerprints.json'))
+        runner.run()
+        with open(runner.manifest) as f:
+            manifest = json.load(f)
+        self.assertIsNotNone(manifest['inputs'][infile])
+        self.assertIsNone(manifest['inputs']['/data/file2'])
+        self.assertEqual(sorted(manifest['outputs']), ['/data/total', '/tmp/step1-size', '/tmp/step2-size'])
+        self.assertEqual([step['code'] for step in manifest['steps']], [0, 0, 0])
+
+    def test_pull_images_once(self):
+        self.pipeline.pull_images = True
+        client = FakeClient(images=[])
+        runner = self.run_pipeline(client)
+        self.assertEqual(runner.result['code'], 0)
+        self.assertEqual(client.calls['pull'], 2)
+
+    def test_log_tail_is_bounded(self):
+        client = FakeClient(log_lines=10000)
+        runner = self.run_pipeline(client)
+        self.assertLessEqual(len(runner.result['logs'].splitlines()), 50)
+        with open(runner.result['log_files']['stdout']) as log_file:
+            self.assertEqual(len(log_file.readlines()), 10000)
+
+    def test_timeout(self):
+        self.steps[0].timeout = 0.1
+        client = FakeClient(run_time=60)
+        start = time.time()
+        runner = self.run_pipeline(client)
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(runner.result['code'], 137)
+        self.assertTrue(runner.result['timed_out'])
+        self.assertEqual(client.calls['kill'], 1)
+
+    def test_retries(self):
+        self.steps[2].idempotent = True
+        self.steps[2].retries = 2
+        client = FakeClient(exit_codes={'dleehr/add': [1, 1]})
+        runner = Runner(self.pipeline, client=client)
+        runner.retry_seconds = 0.01
+        runner.run()
+        self.assertEqual(runner.result['code'], 0)
+        self.assertEqual(runner.result['attempts'], 3)
+        self.assertEqual(client.calls['create_container'], 5)
+        self.assertRaises(ValueError, Step, 'flaky', 'dleehr/add', retries=2)
+
+    def test_speculation(self):
+        shards = [Step('size{}'.format(i), 'dleehr/filesize', infiles={'IN': '/data/file{}'.format(i)},
+                       outfiles={'OUT': os.path.join(self.temp_dir, 'size{}'.format(i))}, idempotent=True,
+                       speculate=2, group='size')
+                  for i in range(4)]
+        self.pipeline = Pipeline('Test Pipeline', steps=shards, pull_images=False)
+        # Whichever shard starts last hangs, and its duplicate finishes as quickly as the others
+        client = FakeClient(run_time=0.05, run_times={'dleehr/filesize': [0.05, 0.05, 0.05, 60]})
+        start = time.time()
+        runner = Runner(self.pipeline, client=client, concurrency=4)
+        runner.run()
+        self.assertLess(time.time() - start, 10)
+        self.assertTrue(all(result['code'] == 0 for result in runner.results))
+        self.assertEqual(sum(1 for result in runner.results if result.get('speculative')), 1)
+        self.assertEqual(client.calls['create_container'], 5)
+        self.assertEqual(client.calls['kill'], 1)
+        # The duplicate's staging directory is removed
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_stage_duplicate(self):
+        outfile = os.path.join(self.temp_dir, 'size')
+        step = Step('size', 'dleehr/filesize', infiles={'IN': '/data/file1'}, outfiles={'OUT': outfile},
+                    idempotent=True, speculate=2, group='size')
+        runner = Runner(Pipeline('Test Pipeline', steps=[step]), client=FakeClient())
+        duplicate, staged = runner.stage_duplicate(step)
+        staged_path = duplicate.outfiles['OUT']
+        self.assertEqual(staged, {staged_path: outfile})
+        self.assertNotEqual(os.path.dirname(staged_path), self.temp_dir)
+        self.assertEqual(duplicate.environment, step.environment)
+        self.assertNotEqual(duplicate.binds, step.binds)
+        with open(staged_path, 'w') as f:
+            f.write('duplicate')
+        runner.unstage(staged, promote=True)
+        with open(outfile) as f:
+            self.assertEqual(f.read(), 'duplicate')
+        self.assertEqual(os.listdir(self.temp_dir), ['size'])
+
+    def test_stats(self):
+        self.pipeline.stats_interval = 0
+        self.steps[0].memory = 1024 ** 3
+        client = FakeClient(run_time=0.1, memory_usage=300 * 1024 ** 2)
+        runner = self.run_pipeline(client)
+        usage = runner.result['usage']
+        self.assertGreater(usage['samples'], 1)
+        self.assertEqual(usage['memory_peak'], 300 * 1024 ** 2)
+        self.assertAlmostEqual(usage['cpu_seconds'], 0.1, places=2)
+        self.assertEqual(usage['block_write_bytes'], 8192)
+        self.assertEqual(usage['network_rx_bytes'], 100)
+        report = runner.report()
+        self.assertEqual(len([step for step in report['steps'] if 'usage' in step]), 3)
+        steps = summarize([report, report])
+        self.assertEqual(steps['size1']['runs'], 2)
+        self.assertEqual(steps['size1']['memory'], 1024 ** 3)
+        # The measured average depends on timing, so the suggestion is checked with a fixed one
+        self.assertEqual(suggest(dict(steps['size1'], cpu_average=0.8)), (1.0, 384 * 1024 ** 2))
+        self.assertEqual(format_memory(384 * 1024 ** 2), '384m')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+# 
+# The MIT License (MIT)
+# 
+# Copyright (c) 2015 Dan Leehr
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from history import StepHistory
+from models import Step
+from scheduler import StepGraph, Scheduler
+
+
+class StepGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Same shape as total_size.yaml: two independent steps feeding a third
+        self.steps = [
+            Step('size1', 'dleehr/filesize', infiles={'IN': '/data/file1'}, outfiles={'OUT': '/tmp/step1-size'}),
+            Step('size2', 'dleehr/filesize', infiles={'IN': '/data/file2'}, outfiles={'OUT': '/tmp/step2-size'}),
+            Step('add', 'dleehr/add', infiles={'IN1': '/tmp/step1-size', 'IN2': '/tmp/step2-size'},
+                 outfiles={'OUT': '/data/total'}),
+        ]
+
+    def test_dependencies(self):
+        graph = StepGraph(self.steps)
+        self.assertEqual(graph.dependencies, {0: set(), 1: set(), 2: set([0, 1])})
+        self.assertEqual(graph.dependents, {0: set([2]), 1: set([2]), 2: set()})
+
+    def test_overwrite_waits_for_reader(self):
+        steps = [
+            Step('read', 'image', infiles={'IN': '/data/shared'}),
+            Step('write', 'image', outfiles={'OUT': '/data/shared'}),
+        ]
+        self.assertEqual(StepGraph(steps).dependencies, {0: set(), 1: set([0])})
+
+    def test_stream_dependencies(self):
+        steps = [
+            Step('produce', 'image', outfiles={'OUT': '/data/pipe'}, streams=['OUT']),
+            Step('consume', 'image', infiles={'IN': '/data/pipe'}),
+        ]
+        graph = StepGraph(steps)
+        self.assertEqual(graph.dependencies, {0: set(), 1: set()})
+        self.assertEqual(graph.stream_dependencies, {0: set(), 1: set([0])})
+        self.assertEqual(graph.stream_dependents, {0: set([1]), 1: set()})
+
+    def test_writer_waits_for_reader(self):
+        steps = [
+            Step('prepare', 'image', outfiles={'OUT': '/data/reference'}),
+            Step('produce', 'image', outfiles={'OUT': '/data/pipe'}, streams=['OUT']),
+            Step('consume', 'image', infiles={'IN': '/data/pipe', 'REF': '/data/reference'}),
+        ]
+        graph = StepGraph(steps)
+        self.assertEqual(graph.reader_dependencies, {0: set(), 1: set([0]), 2: set()})
+        scheduler = Scheduler(graph, None, max_concurrency=2)
+        self.assertEqual(scheduler.simulate({0: 10, 1: 5, 2: 5}), {0: (0, 10), 1: (10, 15), 2: (10, 15)})
+        # Rejected when the reader waits for a step that needs the writer to finish
+        steps[0] = Step('prepare', 'image', infiles={'IN': '/data/side'}, outfiles={'OUT': '/data/reference'})
+        steps[1] = Step('produce', 'image', outfiles={'OUT': '/data/pipe', 'SIDE': '/data/side'}, streams=['OUT'])
+        self.assertRaises(ValueError, StepGraph, [steps[1], steps[0], steps[2]])
+
+    def test_stream_must_be_outfile(self):
+        self.assertRaises(ValueError, Step, 'produce', 'image', outfiles={'OUT': '/data/pipe'}, streams=['IN'])
+
+    def test_critical_path(self):
+        graph = StepGraph(self.steps)
+        durations = {0: 10, 1: 60, 2: 5}
+        self.assertEqual(graph.remaining(durations), {0: 15, 1: 65, 2: 5})
+        self.assertEqual(graph.critical_path(durations), [1, 2])
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.steps = [
+            Step('size1', 'image', infiles={'IN': '/data/file1'}, outfiles={'OUT': '/tmp/step1-size'}),
+            Step('size2', 'image', infiles={'IN': '/data/file2'}, outfiles={'OUT': '/tmp/step2-size'}),
+            Step('add', 'image', infiles={'IN1': '/tmp/step1-size', 'IN2': '/tmp/step2-size'},
+                 outfiles={'OUT': '/data/total'}),
+        ]
+        self.codes = {}
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def run_step(self, step):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return {'image': step.image, 'name': step.name, 'code': self.codes.get(step.name, 0)}
+
+    def test_runs_independent_steps_concurrently(self):
+        scheduler = Scheduler(StepGraph(self.steps), self.run_step, max_concurrency=2)
+        results = scheduler.run()
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[-1]['name'], 'add')
+        self.assertEqual(self.max_running, 2)
+
+    def test_ready(self):
+        scheduler = Scheduler(StepGraph(self.steps), None, max_concurrency=2)
+        self.assertEqual(scheduler.simulate({0: 10, 1: 60, 2: 5}), {0: (0, 10), 1: (0, 60), 2: (60, 65)})
+        # Steps start in pipeline order, unless prioritized
+        scheduler = Scheduler(StepGraph(self.steps), None, max_concurrency=1, priorities={1: 1})
+        self.assertEqual(scheduler.simulate({0: 10, 1: 60, 2: 5}), {0: (60, 70), 1: (0, 60), 2: (70, 75)})
+
+    def test_concurrency_limit(self):
+        scheduler = Scheduler(StepGraph(self.steps), self.run_step, max_concurrency=1)
+        results = scheduler.run()
+        self.assertEqual([r['name'] for r in results], ['size1', 'size2', 'add'])
+        self.assertEqual(self.max_running, 1)
+
+    def test_failure_stops_downstream(self):
+        self.codes['size2'] = 1
+        scheduler = Scheduler(StepGraph(self.steps), self.run_step, max_concurrency=2)
+        results = scheduler.run()
+        self.assertEqual(sorted(r['name'] for r in results), ['size1', 'size2'])
+        self.assertEqual(scheduler.failed, [1])
+
+    def test_stream_reader_starts_with_writer(self):
+        steps = [
+            Step('produce', 'image', outfiles={'OUT': '/data/pipe'}, streams=['OUT']),
+            Step('consume', 'image', infiles={'IN': '/data/pipe'}),
+        ]
+        scheduler = Scheduler(StepGraph(steps), self.run_step, max_concurrency=1)
+        self.assertEqual(len(scheduler.run()), 2)
+        self.assertEqual(self.max_running, 2)
+
+    def test_stream_writer_waits_for_failed_dependency(self):
+        steps = [
+            Step('prepare', 'image', outfiles={'OUT': '/data/reference'}),
+            Step('produce', 'image', outfiles={'OUT': '/data/pipe'}, streams=['OUT']),
+            Step('consume', 'image', infiles={'IN': '/data/pipe', 'REF': '/data/reference'}),
+        ]
+        self.codes['prepare'] = 1
+        scheduler = Scheduler(StepGraph(steps), self.run_step, max_concurrency=2)
+        # The writer is not started, since its reader never can be
+        self.assertEqual([r['name'] for r in scheduler.run()], ['prepare'])
+
+    def test_exception_propagates(self):
+        def run_step(step):
+            raise RuntimeError('boom')
+        scheduler = Scheduler(StepGraph(self.steps), run_step, max_concurrency=2)
+        self.assertRaises(RuntimeError, scheduler.run)
+
+    def test_capacity_limits_admission(self):
+        steps = [Step('big{}'.format(i), 'image', cpus=4, memory='8g') for i in range(3)]
+        scheduler = Scheduler(StepGraph(steps), self.run_step, max_concurrency=3,
+                              capacity={'cpus': 8, 'memory': 12 * 1024 ** 3})
+        scheduler.run()
+        self.assertEqual(self.max_running, 1)
+        scheduler = Scheduler(StepGraph(steps), self.run_step, max_concurrency=3, capacity={'cpus': 8})
+        self.max_running = 0
+        scheduler.run()
+        self.assertEqual(self.max_running, 2)
+
+    def test_step_larger_than_capacity_runs_alone(self):
+        steps = [Step('huge', 'image', cpus=16)]
+        scheduler = Scheduler(StepGraph(steps), self.run_step, capacity={'cpus': 8})
+        self.assertEqual(len(scheduler.run()), 1)
+
+    def test_priorities(self):
+        # The long step is last in the pipeline, but starts first
+        steps = self.steps[:2] + [Step('long', 'image', infiles={'IN': '/data/file3'})]
+        scheduler = Scheduler(StepGraph(steps), self.run_step, priorities={0: 1, 1: 1, 2: 100})
+        self.assertEqual([r['name'] for r in scheduler.run()], ['long', 'size1', 'size2'])
+
+    def test_simulate(self):
+        durations = {0: 10, 1: 60, 2: 5}
+        times = Scheduler(StepGraph(self.steps), None, max_concurrency=1).simulate(durations)
+        self.assertEqual(times, {0: (0, 10), 1: (10, 70), 2: (70, 75)})
+        times = Scheduler(StepGraph(self.steps), None, max_concurrency=2).simulate(durations)
+        self.assertEqual(times[2], (60, 65))
+
+    def test_history(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'history.json')
+            history = StepHistory(path)
+            # Durations are kept by image and command
+            for i, step in enumerate(self.steps):
+                step.command = 'command{}'.format(i)
+            history.record(self.steps[1], {'code': 0, 'timings': {'logs': 50, 'wait': 10, 'acquire_host': 100}})
+            history.record(self.steps[0], {'code': 1, 'timings': {'logs': 50}})
+            history.record(self.steps[0], {'code': 0, 'cached': True, 'timings': {}})
+            history.save()
+            history = StepHistory(path)
+            self.assertEqual(history.estimate(self.steps[1]), 60)
+            self.assertIsNone(history.estimate(self.steps[0]))
+            durations, unknown = history.estimates(self.steps)
+            self.assertEqual(unknown, set([0, 2]))
+            self.assertEqual(durations[0], 60)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_requires_positive_concurrency(self):
+        self.assertRaises(ValueError, Scheduler, StepGraph(self.steps), self.run_step, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
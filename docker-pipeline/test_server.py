@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+# 
+# The MIT License (MIT)
+# 
+# Copyright (c) 2015 Dan Leehr
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+from fake_docker import FakeClient
+from server import PipelineServer, request
+
+PIPELINE_YAML = '''
+name: Total size
+steps:
+  -
+    name: Get size
+    image: dleehr/filesize
+    infiles:
+      CONT_INPUT_FILE: !var FILE1
+    outfiles:
+      CONT_OUTPUT_FILE: /tmp/size
+'''
+
+
+class PipelineServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.temp_dir, 'server.sock')
+        self.client = FakeClient(exit_codes={'dleehr/add': 1})
+        self.server = PipelineServer(self.socket_path, history_path=None, client=self.client).start()
+        # Runs report their progress on stdout
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        self.server.close()
+        shutil.rmtree(self.temp_dir)
+
+    def wait_for(self, run_id):
+        for _ in range(100):
+            status, run = request(self.socket_path, 'GET', '/runs/{}'.format(run_id))
+            if run['finished'] is not None:
+                return run
+            time.sleep(0.05)
+        self.fail('Run {} did not finish'.format(run_id))
+
+    def test_submit(self):
+        status, run = request(self.socket_path, 'POST', '/runs', {'yaml': PIPELINE_YAML, 'vars': {'FILE1': '/data/a'}})
+        self.assertEqual(status, 202)
+        self.assertEqual(run['name'], 'Total size')
+        run = self.wait_for(run['id'])
+        self.assertEqual(run['state'], 'succeeded')
+        self.assertEqual(run['code'], 0)
+        # The second run reuses the first run's client
+        failing = PIPELINE_YAML.replace('dleehr/filesize', 'dleehr/add')
+        status, run = request(self.socket_path, 'POST', '/runs', {'yaml': failing, 'vars': {'FILE1': '/data/b'}})
+        self.assertEqual(self.wait_for(run['id'])['state'], 'failed')
+        self.assertEqual(self.client.calls['create_container'], 2)
+        self.assertEqual(len(self.server.endpoint_pools), 1)
+        self.assertEqual(self.server.get_run(run['id']).pipeline.steps[0].infiles['CONT_INPUT_FILE'], '/data/b')
+        status, runs = request(self.socket_path, 'GET', '/runs')
+        self.assertEqual(len(runs), 2)
+
+    def test_failed_pull_is_retried(self):
+        pulls = list()
+        pull = self.client.pull
+
+        def flaky_pull(repository, **kwargs):
+            pulls.append(repository)
+            if len(pulls) == 1:
+                raise IOError('registry down')
+            return pull(repository, **kwargs)
+        self.client.pull = flaky_pull
+        yaml_contents = PIPELINE_YAML + 'pull_images: true\n'
+        for state in ['error', 'succeeded']:
+            status, run = request(self.socket_path, 'POST', '/runs', {'yaml': yaml_contents, 'vars': {'FILE1': '/a'}})
+            self.assertEqual(self.wait_for(run['id'])['state'], state)
+        # Each run pulls its images again, rather than reusing the first run's result
+        self.assertEqual(pulls, ['dleehr/filesize', 'dleehr/filesize'])
+
+    def test_socket_mode(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0600)
+
+    def test_invalid_submission(self):
+        status, response = request(self.socket_path, 'POST', '/runs', {'yaml': 'steps: [{name: no image}]'})
+        self.assertEqual(status, 400)
+        self.assertIn('error', response)
+        status, response = request(self.socket_path, 'GET', '/runs/unknown')
+        self.assertEqual(status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,7 +28,7 @@ __author__ = 'dcl9'
 
 import yaml
 import unittest
-from tag_handlers import configure
+from tag_handlers import configure, make_loader
 
 
 class TagHandlersTestCase(unittest.TestCase):
@@ -91,5 +91,16 @@ class TagHandlersTestCase(unittest.TestCase):
         """
         self.load('k: !join [a,/,!var VAR2,/, !base [!change_ext [!var FILE1, new]]]')
         self.expect({'k': 'a/val2/file.new'}, 'Combining all tags')
+
+    def test_make_loader(self):
+        """
+        Test tag handlers scoped to a loader
+        """
+        loader = make_loader({'VAR1': 'scoped'})
+        self.loaded = yaml.load('k: !join [!var VAR1, /, !base /path/to/bar]', Loader=loader)
+        self.expect({'k': 'scoped/bar'}, 'Tags on a scoped loader')
+        self.load('k: !var VAR1')
+        self.expect({'k': 'val1'}, 'Scoped loader changed the default loader')
+
 if __name__ == '__main__':
     unittest.main()
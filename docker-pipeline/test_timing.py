@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+# 
+# The MIT License (MIT)
+# 
+# Copyright (c) 2015 Dan Leehr
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import unittest
+from timing import Tracer, monotonic
+
+
+class TracerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = Tracer()
+        self.tracer.record('pull_image', 0.0, 1.0)
+        self.tracer.record('create_container', 1.0, 1.5, 'size1', 1)
+        self.tracer.record('logs', 1.5, 4.0, 'size1', 1)
+        self.tracer.record('wait', 3.5, 4.5, 'size1', 1)
+        self.tracer.record('finish_container', 4.5, 5.0, 'size1', 1)
+        # The second step was created twice, and its container ran while the first one's did
+        self.tracer.record('create_container', 0.5, 0.75, 'size2', 2)
+        self.tracer.record('create_container', 1.0, 1.25, 'size2', 2)
+        self.tracer.record('logs', 2.0, 3.0, 'size2', 2)
+        self.tracer.record('wait', 6.0, 7.0, 'size2', 2)
+        self.tracer.end = 8.0
+
+    def test_monotonic(self):
+        first = monotonic()
+        self.assertLessEqual(first, monotonic())
+
+    def test_covered(self):
+        self.assertEqual(Tracer.covered([]), 0)
+        self.assertEqual(Tracer.covered([(5.0, 6.0), (0.0, 2.0), (5.5, 5.75), (1.0, 3.0)]), 4.0)
+
+    def test_report(self):
+        report = self.tracer.report()
+        self.assertEqual(report['total'], 8.0)
+        # Containers ran from 1.5 to 4.5 and from 6 to 7
+        self.assertEqual(report['orchestration_overhead'], 4.0)
+        first, second = report['steps']
+        self.assertEqual(first, {'name': 'size1', 'number': 1, 'start': 1.0, 'end': 5.0,
+                                 'phases': {'create_container': 0.5, 'logs': 2.5, 'wait': 1.0,
+                                            'finish_container': 0.5}})
+        self.assertEqual((second['start'], second['end']), (0.5, 7.0))
+        self.assertEqual(second['phases'], {'create_container': 0.5, 'logs': 1.0, 'wait': 1.0})
+        self.assertEqual(self.tracer.step_timings(2), second['phases'])
+
+    def test_span(self):
+        tracer = Tracer()
+        with tracer.span('resolve_image', 'size1', 1):
+            pass
+        span = tracer.spans[0]
+        self.assertEqual((span['phase'], span['step'], span['step_number']), ('resolve_image', 'size1', 1))
+        self.assertLessEqual(span['start'], span['end'])
+
+    def test_chrome_trace(self):
+        trace = self.tracer.chrome_trace()
+        self.assertEqual(trace['displayTimeUnit'], 'ms')
+        events = trace['traceEvents']
+        self.assertEqual(len(events), 9)
+        self.assertEqual(events[0], {'name': 'pull_image', 'cat': 'pipeline', 'ph': 'X', 'ts': 0, 'dur': 1000000,
+                                     'pid': os.getpid(), 'tid': 0, 'args': {'step': None}})
+        self.assertEqual(events[2], {'name': 'logs', 'cat': 'step', 'ph': 'X', 'ts': 1500000, 'dur': 2500000,
+                                     'pid': os.getpid(), 'tid': 1, 'args': {'step': 'size1'}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# docker-pipeline
+# 
+# The MIT License (MIT)
+# 
+# Copyright (c) 2015 Dan Leehr
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from models import Pipeline, Step
+from pipeline import parse_args
+from pipeline_cache import parse_pipeline
+from wrapper import as_user, check_volumes, invoking_user, read_yaml, root_paths
+from yaml.constructor import ConstructorError
+
+# The nobody user, which the tests that need root switch to
+NOBODY = (65534, 65534, [65534])
+
+
+class WrapperTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        # Other users may look inside, but only where a test allows it
+        os.chmod(self.temp_dir, 0755)
+        self.environ = dict(os.environ)
+        self.getuid = os.getuid
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        os.getuid = self.getuid
+        shutil.rmtree(self.temp_dir)
+
+    def make_pipeline(self, output_mode):
+        infile = os.path.join(self.temp_dir, 'input', 'file1')
+        os.makedirs(os.path.dirname(infile))
+        with open(infile, 'w') as f:
+            f.write('contents')
+        output_dir = os.path.join(self.temp_dir, 'output')
+        os.makedirs(output_dir)
+        os.chmod(output_dir, output_mode)
+        step = Step('size', 'dleehr/filesize', infiles={'IN': infile}, outfiles={'OUT': os.path.join(output_dir, 'size')})
+        return Pipeline('Test Pipeline', steps=[step])
+
+    def test_startup_does_not_import_docker(self):
+        script = 'import sys, wrapper; print "docker" in sys.modules'
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), 'False')
+
+    def test_safe_parse(self):
+        yaml_contents = 'name: Safe\nsteps:\n  - name: size\n    image: dleehr/filesize\n    infiles: {IN: !var FILE}\n    outfiles: {OUT: /tmp/size}\n'
+        pipeline = parse_pipeline(yaml_contents, {'FILE': '/data/file1'}, safe=True)
+        self.assertEqual(pipeline.steps[0].infiles['IN'], '/data/file1')
+        unsafe = 'name: !!python/object/apply:os.getcwd []\nsteps: []\n'
+        self.assertRaises(ConstructorError, parse_pipeline, unsafe, {}, safe=True)
+
+    def test_invoking_user(self):
+        os.getuid = lambda: 0
+        os.environ.update({'SUDO_UID': '65534', 'SUDO_GID': '65534'})
+        uid, gid, groups = invoking_user()
+        self.assertEqual((uid, gid), (65534, 65534))
+        self.assertIn(65534, groups)
+        del os.environ['SUDO_UID']
+        self.assertRaises(Exception, invoking_user)
+        os.environ['SUDO_UID'] = '65534'
+        os.getuid = lambda: 1000
+        self.assertRaises(Exception, invoking_user)
+
+    def test_root_paths(self):
+        pipeline = Pipeline('Test Pipeline', steps=[])
+        args, options, var_map = parse_args([os.devnull])
+        self.assertEqual(root_paths(options, pipeline), [])
+        args, options, var_map = parse_args([os.devnull, '--report', '/etc/cron.d/x', '--journal', '/etc/shadow',
+                                             '--resume', '--history', '/tmp/history.json'])
+        self.assertEqual(root_paths(options, pipeline), ['--history', '--journal', '--report'])
+        pipeline.log_dir = '/etc'
+        pipeline.scratch_dir = '/etc'
+        self.assertEqual(root_paths(options, pipeline)[-2:], ['log_dir', 'scratch_dir'])
+
+    @unittest.skipUnless(os.getuid() == 0, 'switching users needs root')
+    def test_as_user(self):
+        secret = os.path.join(self.temp_dir, 'secret')
+        with open(secret, 'w') as f:
+            f.write('secret')
+        os.chmod(secret, 0600)
+        with as_user(*NOBODY):
+            self.assertEqual(os.geteuid(), 65534)
+            self.assertRaises(IOError, open, secret)
+        self.assertEqual(os.geteuid(), 0)
+        self.assertEqual(os.getegid(), 0)
+        with open(secret) as f:
+            self.assertEqual(f.read(), 'secret')
+
+    @unittest.skipUnless(os.getuid() == 0, 'switching users needs root')
+    def test_yaml_read_as_user(self):
+        yaml_file = os.path.join(self.temp_dir, 'pipeline.yaml')
+        with open(yaml_file, 'w') as f:
+            f.write('name: Secret\nsteps: []\n')
+        os.chmod(yaml_file, 0600)
+        # Parsing the command line leaves the file to be opened as the user
+        args, options, var_map = parse_args([yaml_file], open_yaml=False)
+        self.assertEqual(args.yaml_file, yaml_file)
+        self.assertRaises(IOError, read_yaml, yaml_file, NOBODY)
+        os.chmod(yaml_file, 0644)
+        self.assertEqual(read_yaml(yaml_file, NOBODY), 'name: Secret\nsteps: []\n')
+
+    @unittest.skipUnless(os.getuid() == 0, 'switching users needs root')
+    def test_check_volumes(self):
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            self.assertTrue(check_volumes(self.make_pipeline(0777), NOBODY))
+            shutil.rmtree(self.temp_dir)
+            os.makedirs(self.temp_dir, 0755)
+            # Root could write to the output directory, but the user cannot
+            self.assertFalse(check_volumes(self.make_pipeline(0755), NOBODY))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        self.assertEqual(os.geteuid(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from contextlib import contextmanager
+import ctypes
+import ctypes.util
+import json
+import os
+import threading
+import time
+
+CLOCK_MONOTONIC = 1
+
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def load_clock_gettime():
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    return clock_gettime
+
+_clock_gettime = load_clock_gettime()
+
+
+def monotonic():
+    '''
+    Seconds from a clock that never goes backwards. Falls back to time.time() where clock_gettime is not available
+    '''
+    if _clock_gettime is None:
+        return time.time()
+    t = timespec()
+    if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+        return time.time()
+    return t.tv_sec + t.tv_nsec * 1e-9
+
+
+class Tracer():
+    # Phases during which a step's container is running
+    CONTAINER_PHASES = ('logs', 'wait')
+
+    def __init__(self):
+        '''
+        Records the start and end of each phase of each step, in seconds since the tracer was created
+        '''
+        self.origin = monotonic()
+        self.started_at = time.time()
+        self.spans = list()
+        # Seconds spent in each phase, by step number, so a step's timings are looked up without a scan
+        self.step_phases = dict()
+        self.lock = threading.Lock()
+        self.end = None
+
+    @contextmanager
+    def span(self, phase, step_name=None, step_number=0):
+        '''
+        Times the enclosed block
+        :param phase: name of the phase, e.g. 'pull_image'
+        :param step_name: name of the step, or None for pipeline-level phases
+        :param step_number: position of the step in the pipeline, starting at 1
+        '''
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.record(phase, start, self.now(), step_name, step_number)
+
+    def now(self):
+        return monotonic() - self.origin
+
+    def record(self, phase, start, end, step_name=None, step_number=0):
+        '''
+        Records a phase timed by the caller, for phases that do not fit in one block
+        :param start: value of now() when the phase started
+        :param end: value of now() when the phase ended
+        '''
+        with self.lock:
+            self.spans.append({'phase': phase, 'step': step_name, 'step_number': step_number,
+                               'start': start, 'end': end})
+            if step_name is not None:
+                phases = self.step_phases.setdefault(step_number, {})
+                phases[phase] = phases.get(phase, 0) + end - start
+
+    def finish(self):
+        self.end = self.now()
+
+    def step_timings(self, step_number):
+        with self.lock:
+            return dict(self.step_phases.get(step_number, {}))
+
+    @classmethod
+    def covered(cls, intervals):
+        # Total length of the union of (start, end) intervals
+        total = 0
+        covered_until = None
+        for start, end in sorted(intervals):
+            if covered_until is None or start > covered_until:
+                total += end - start
+                covered_until = end
+            elif end > covered_until:
+                total += end - covered_until
+                covered_until = end
+        return total
+
+    def report(self):
+        '''
+        Summarizes the run
+        :return: dict with the run's total seconds, the seconds when no container was running, and per-step phase timings
+        '''
+        end = self.end if self.end is not None else self.now()
+        with self.lock:
+            spans = list(self.spans)
+        steps = dict()
+        for span in spans:
+            if span['step'] is None:
+                continue
+            step = steps.setdefault(span['step_number'], {'name': span['step'], 'number': span['step_number'],
+                                                          'start': span['start'], 'end': span['end'], 'phases': {}})
+            step['start'] = min(step['start'], span['start'])
+            step['end'] = max(step['end'], span['end'])
+            phases = step['phases']
+            phases[span['phase']] = phases.get(span['phase'], 0) + span['end'] - span['start']
+        container_time = Tracer.covered([(span['start'], span['end']) for span in spans
+                                         if span['phase'] in Tracer.CONTAINER_PHASES])
+        return {
+            'started_at': self.started_at,
+            'total': end,
+            'orchestration_overhead': end - container_time,
+            'steps': [steps[number] for number in sorted(steps)],
+        }
+
+    def chrome_trace(self):
+        '''
+        Converts the spans to Chrome trace format, viewable in chrome://tracing. Each step is one row.
+        '''
+        with self.lock:
+            spans = list(self.spans)
+        events = list()
+        for span in spans:
+            events.append({
+                'name': span['phase'],
+                'cat': 'step' if span['step'] is not None else 'pipeline',
+                'ph': 'X',
+                'ts': int(span['start'] * 1e6),
+                'dur': int((span['end'] - span['start']) * 1e6),
+                'pid': os.getpid(),
+                'tid': span['step_number'],
+                'args': {'step': span['step']},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_report(self, path):
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+    def write_trace(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
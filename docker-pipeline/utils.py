@@ -23,6 +23,11 @@
 # SOFTWARE.
 
 from collections import defaultdict
+import csv
+import re
+
+MEMORY_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
 
 
 def extract_var_map(leftovers):
@@ -32,3 +37,43 @@ def extract_var_map(leftovers):
         d[k] = v
     return d
 
+
+def parse_memory(memory):
+    """
+    Converts a memory size to bytes
+    :param memory: a number of bytes, or a string with a unit suffix, e.g. '512m' or '4g'
+    :return: the number of bytes, or None if memory is None
+    """
+    if memory is None or isinstance(memory, (int, long)):
+        return memory
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([bkmgt]?)b?\s*$', str(memory).lower())
+    if match is None:
+        raise ValueError('Invalid memory size: {}'.format(memory))
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+
+def parse_duration(duration):
+    """
+    Converts a duration to seconds
+    :param duration: a number of seconds, or a string with a unit suffix, e.g. '90s', '30m' or '2h'
+    :return: the number of seconds, or None if duration is None
+    """
+    if duration is None or isinstance(duration, (int, long, float)):
+        return duration
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$', str(duration).lower())
+    if match is None:
+        raise ValueError('Invalid duration: {}'.format(duration))
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def read_sample_sheet(sample_sheet):
+    """
+    Reads variable sets from a sample sheet. The first row names the variables, each following row is one sample.
+    Files ending in .csv are comma-separated, all others tab-separated.
+    :param sample_sheet: path to the sample sheet
+    :return: a list of dicts, one per sample, mapping variable names to values
+    """
+    delimiter = ',' if sample_sheet.lower().endswith('.csv') else '\t'
+    with open(sample_sheet, 'rb') as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        return [row for row in reader if any(row.values())]
@@ -0,0 +1,174 @@
+# docker-pipeline
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Dan Leehr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+Entry point of bin/docker-pipeline-wrapper.sh, run as root through sudo. The pipeline is parsed once, its volumes
+are checked by a child process running as the user who ran sudo, and then it runs in this process.
+'''
+
+from contextlib import contextmanager
+from history import DEFAULT_HISTORY
+from pipeline import parse_args, run
+from pipeline_cache import parse_pipeline
+import grp
+import imp
+import os
+import pwd
+import sys
+
+IMAGE = 'dukegcb/docker-pipeline'
+# Options naming files the run would read or write, with their flags and defaults. Through sudo those files would
+# be opened as root, so the options cannot be used
+PATH_OPTIONS = {
+    'report': ('--report', None),
+    'trace': ('--trace', None),
+    'journal_path': ('--journal', None),
+    'manifest': ('--manifest', None),
+    'cache_dir': ('--cache-dir', None),
+    'log_dir': ('--log-dir', None),
+    'compiled_dir': ('--compiled-dir', None),
+    'history_path': ('--history', DEFAULT_HISTORY),
+}
+# Pipeline settings naming directories the run would write to
+PATH_SETTINGS = ('log_dir', 'scratch_dir')
+
+
+def invoking_user():
+    '''
+    :return: tuple of the uid, gid and group ids of the user who ran sudo
+    '''
+    if os.getuid() != 0 or 'SUDO_UID' not in os.environ:
+        raise Exception('Error: Must be run with sudo')
+    uid = int(os.environ['SUDO_UID'])
+    gid = int(os.environ['SUDO_GID'])
+    name = pwd.getpwuid(uid).pw_name
+    groups = sorted(set([gid] + [group.gr_gid for group in grp.getgrall() if name in group.gr_mem]))
+    return uid, gid, groups
+
+
+@contextmanager
+def as_user(uid, gid, groups):
+    # Only the effective ids change, so root's can be restored afterwards
+    root_groups = os.getgroups()
+    os.setgroups(groups)
+    os.setegid(gid)
+    os.seteuid(uid)
+    try:
+        yield
+    finally:
+        os.seteuid(0)
+        os.setegid(0)
+        os.setgroups(root_groups)
+
+
+def read_yaml(path, user):
+    # The user must be able to read the pipeline themselves
+    with as_user(*user):
+        with open(path, 'r') as yaml_file:
+            return yaml_file.read()
+
+
+def check_volumes(pipeline, user):
+    '''
+    Checks the pipeline's volumes as the user. os.access checks the real user, which cannot be changed back once
+    changed, so the check runs in a child process sharing the parsed pipeline.
+    :param pipeline: the parsed Pipeline
+    :param user: tuple from invoking_user()
+    :return: True if the user can access all of the pipeline's volumes
+    '''
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            uid, gid, groups = user
+            os.setgroups(groups)
+            os.setgid(gid)
+            os.setuid(uid)
+            pipeline.check_volumes()
+            code = 0
+        except Exception as e:
+            print e
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    return status == 0
+
+
+def has_docker_py():
+    try:
+        imp.find_module('docker')
+        return True
+    except ImportError:
+        return False
+
+
+def hand_off(yaml_file, argv):
+    # Without docker-py on the host, the pipeline runs in the docker-pipeline image, which parses it again
+    os.execvp('docker', ['docker', 'run', '-i', '-v', '/var/run/docker.sock:/var/run/docker.sock',
+                         '-v', '{}:/pipeline.yaml:ro'.format(os.path.abspath(yaml_file)), IMAGE, '/pipeline.yaml']
+              + argv)
+
+
+def root_paths(options, pipeline):
+    '''
+    Finds the options and pipeline settings that would have root read or write files the user named
+    :param options: options for run(), from parse_args()
+    :param pipeline: the parsed Pipeline
+    :return: list of the flags and settings that are set
+    '''
+    paths = [flag for option, (flag, default) in sorted(PATH_OPTIONS.items()) if options.get(option) != default]
+    return paths + [setting for setting in PATH_SETTINGS if getattr(pipeline, setting) is not None]
+
+
+def main(argv):
+    user = invoking_user()
+    # ~ expands to root's home rather than the user's, which sudo may keep, so the step history and image cache
+    # are root's own files
+    os.environ['HOME'] = pwd.getpwuid(0).pw_dir
+    # The YAML file is opened only as the user, in read_yaml
+    args, options, var_map = parse_args(argv, open_yaml=False)
+    # The YAML is written by the user, so it may only construct plain YAML types
+    pipeline = parse_pipeline(read_yaml(args.yaml_file, user), var_map, safe=True)
+    paths = root_paths(options, pipeline)
+    if paths:
+        raise Exception('Error: {} cannot be used through sudo, as the files would be written by root'
+                        .format(', '.join(paths)))
+    options.pop('compiled_dir')
+    if not check_volumes(pipeline, user):
+        return 1
+    if not has_docker_py():
+        hand_off(args.yaml_file, argv[1:])
+    run(pipeline, **options)
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except Exception as e:
+        print e
+        sys.exit(1)